@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Measures how much the deflate transfer mode of protocol version 5 saves on
+# @TEL batches and logs, and what it costs to compress them.
+#
+# Pass queue segment files ('/sd/queue/seg*'), legacy 'queued_frames' files or
+# log files copied from a device's SD card. Lines starting with '@TEL' are
+# treated as telemetry (and also sent as binary records), anything else as a
+# log. Without arguments a day of frames and a log are generated.
+#
+# src/Deflate.py is the pure Python compressor used on firmware without the
+# `deflate` module; zlib with the same window is shown for comparison. Times
+# are CPython times on the host.
+#
+# Usage:
+#   python3 bench_deflate.py queue/seg0 queue/seg1 log
+#
+
+import argparse
+import math
+import os
+import sys
+import time
+import zlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import Deflate  # noqa: E402
+import TelRecord  # noqa: E402
+
+
+class _Count:
+
+    def __init__(self):
+        self.n = 0
+
+    def write(self, data):
+        self.n += len(data)
+
+
+def _deflate_size(payload, wbits, chunk):
+    out = _Count()
+    w = Deflate.DeflateWriter(out, wbits)
+    for i in range(0, len(payload), chunk):
+        w.write(payload[i:i + chunk])
+    w.close()
+    return out.n
+
+
+def _zlib_size(payload, wbits):
+    c = zlib.compressobj(6, zlib.DEFLATED, -wbits)
+    return len(c.compress(payload) + c.flush())
+
+
+def _sample_frames(n=144):
+    # one frame every 10 minutes, slowly changing values as on a parked trailer
+    frames = []
+    for i in range(n):
+        t = i * 600
+        frames.append(
+            '@TEL,{},2020-06-05T{:02d}:{:02d}:{:02d}+00:00,{:.6f},{:.6f},{:.2f},'
+            '{:.2f},{:.3f},0,{:.8f},{:.8f},{:.8f},{:.4f},{:.4f},0,{},{},,,1,'
+            'DA68B8C24CC4,,-32,1008,3157,{:.1f},{:.3f},99902,2911,4\r\n'.format(
+                i + 1, t // 3600, t // 60 % 60, t % 60,
+                43.762341 + 0.00001 * math.sin(i), -79.324445 + 0.00001 * math.cos(i),
+                (i * 7) % 360, 0.1 * (i % 3), 4.1 - i * 0.0005,
+                0.0122 + 0.0001 * (i % 5), -0.0081, 1.0015 - 0.0001 * (i % 4),
+                -0.46, 0.70, 4.0 + 0.0078125 * (i % 40), 5.0 + 0.0078125 * (i % 33),
+                41.5 + 0.5 * math.sin(i / 10.0), 21.0 + 0.005 * (i % 70)))
+    return ''.join(frames).encode('ascii')
+
+
+def _sample_log(n=2000):
+    lines = []
+    for i in range(n):
+        lines.append('{:-10} \t [D] > {}\n'.format(
+            i * 137, ('Queued frames: {}'.format(i % 50), 'GNSS fix: None',
+                      'LTE attached in {} ms'.format(2000 + i % 900),
+                      'SENT 20 frames (format=BZ): 1234 bytes in 2 segments')[i % 4]))
+    return ''.join(lines).encode('ascii')
+
+
+def _to_binary(tel):
+    out = []
+    for line in tel.splitlines(True):
+        text = line.decode('ascii')
+        sequenced = text[5:text.index(',', 5)].isdigit()
+        record = TelRecord.encode_frame(text, sequenced=sequenced)
+        if record is None:
+            out.append(line)  # with cells, text like on the device
+        else:
+            out.append(TelRecord.TEL_BINARY_MARKER)
+            out.append(record)
+    return b''.join(out)
+
+
+def _report(name, payload, chunk, wbits_list):
+    if not payload:
+        return
+    start = time.perf_counter()
+    size = _deflate_size(payload, Deflate.DEFAULT_WBITS, chunk)
+    us_per_kb = (time.perf_counter() - start) / len(payload) * 1024 * 1e6
+    cols = ['{:>8}'.format(len(payload))]
+    for wbits in wbits_list:
+        size = _deflate_size(payload, wbits, chunk)
+        cols.append('{:>9.1f}%'.format(100.0 * size / len(payload)))
+    cols.append('{:>9.1f}%'.format(
+        100.0 * _zlib_size(payload, Deflate.DEFAULT_WBITS) / len(payload)))
+    cols.append('{:>10.0f}'.format(us_per_kb))
+    print('{:<14} {}'.format(name, ' '.join(cols)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure deflate compression of @TEL batches and logs')
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+
+    tel = b''
+    log = b''
+    if args.files:
+        for path in args.files:
+            with open(path, 'rb') as f:
+                for line in f:
+                    if line.startswith(b'@TEL'):
+                        tel += line
+                    else:
+                        log += line
+    else:
+        tel = _sample_frames()
+        log = _sample_log()
+
+    wbits_list = (9, Deflate.DEFAULT_WBITS, 12, 15)
+    print('{:<14} {:>8} {} {:>10} {:>10}'.format(
+        'payload', 'bytes', ' '.join('{:>10}'.format('w={}'.format(w))
+                                     for w in wbits_list),
+        'zlib w={}'.format(Deflate.DEFAULT_WBITS), 'us/KB'))
+    # frames are written to the compressor one at a time, log in 1 KB chunks
+    frame_size = len(tel.split(b'\n', 1)[0]) + 1 if tel else 1
+    _report('@TEL text', tel, frame_size, wbits_list)
+    if tel:
+        binary = _to_binary(tel)
+        _report('@TEL binary', binary, len(binary) // tel.count(b'\n'), wbits_list)
+    _report('log', log, 1024, wbits_list)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+#
+# Benchmark of the on-SD telemetry queue (src/FrameQueue.py) against the
+# single-file queue of older firmware, on the host file system.
+#
+# For each backlog size it measures the time to append the frames, the time
+# to drain them (streaming + committing in batches, like partial server
+# acknowledgements), and the peak Python heap used while draining. The old
+# queue reads the whole file and splits it, so its peak grows with the
+# backlog.
+#
+# Usage:
+#   python3 bench_frame_queue.py --frames 10000 50000
+#
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from FrameQueue import FrameQueue  # noqa: E402
+
+FRAME = ('@TEL,2020-06-05T21:44:20+00:00,43.762341,-79.324445,123.48,1.21,'
+         '4.123,0,0.0123,-0.0081,1.0012,-0.46,0.7,0,4.8984375,5.0078125,,,0,'
+         ',,,,,,,,,\r\n')
+
+
+def bench_legacy(root, n):
+    path = os.path.join(root, 'queued_frames')
+    start = time.perf_counter()
+    for _ in range(n):
+        with open(path, 'a', newline='') as f:
+            f.write(FRAME)
+    t_append = time.perf_counter() - start
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(path, 'r', newline='') as f:
+        frames = [fr + '\r\n' for fr in f.read().split('\r\n')]
+    frames.pop()
+    sent = sum(len(fr) for fr in frames)
+    os.remove(path)
+    t_drain = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert sent == n * len(FRAME)
+    return t_append, t_drain, peak
+
+
+def bench_queue(root, n, batch):
+    queue = FrameQueue(os.path.join(root, 'queue'))
+    frame = FRAME.encode('ascii')
+    start = time.perf_counter()
+    for _ in range(n):
+        queue.append(frame)
+    t_append = time.perf_counter() - start
+    assert len(queue) == n
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    sent = 0
+    while len(queue):
+        cursor = None
+        for i, (fr, cursor) in enumerate(queue.frames()):
+            sent += len(fr)
+            if i + 1 == batch:
+                break
+        queue.commit(cursor)
+    t_drain = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert sent == n * len(FRAME)
+    return t_append, t_drain, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the frame queue')
+    parser.add_argument('--frames', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--batch', type=int, default=500,
+                        help='frames acknowledged per commit')
+    args = parser.parse_args()
+
+    print('{:<8} {:>8} {:>14} {:>11} {:>14}'.format(
+        'queue', 'frames', 'append [us/fr]', 'drain [ms]', 'drain peak [KB]'))
+    for n in args.frames:
+        for name, fn in (('legacy', bench_legacy),
+                         ('segment', lambda r, n: bench_queue(r, n, args.batch))):
+            with tempfile.TemporaryDirectory() as root:
+                t_append, t_drain, peak = fn(root, n)
+            print('{:<8} {:>8} {:>14.1f} {:>11.1f} {:>14.1f}'.format(
+                name, n, t_append / n * 1e6, t_drain * 1000, peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#
+# Compares the time to decode Ruuvi advertisement payloads with the
+# table-driven decoder (src/RuuviDecoder.py) and with the decoder it replaced
+# (one unpack per field on a slice, the power field through bin(); copied
+# below), on the host.
+#
+# The payloads are the manufacturer specific data of the advertisements, as
+# hex, one per line ('#' starts a comment), e.g. recorded with a BLE sniffer.
+# Without a file, payloads of formats 3 and 5 are generated.
+#
+# Usage:
+#   python3 bench_ruuvi.py
+#   python3 bench_ruuvi.py --rounds 50 payloads.txt
+#
+
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import sim  # noqa: E402
+
+
+def _legacy_decode_3(data):
+    humidity = data[3] / 2
+    temperature = data[4] + data[5] / 100
+    if temperature > 128:
+        temperature -= 128
+        temperature = round(0 - temperature, 2)
+    pressure = struct.unpack("!H", data[6:8])[0] + 50000
+    acceleration_x = struct.unpack("!h", data[8:10])[0]
+    acceleration_y = struct.unpack("!h", data[10:12])[0]
+    acceleration_z = struct.unpack("!h", data[12:14])[0]
+    battery_voltage = struct.unpack("!H", data[14:16])[0]
+    return (3, humidity, temperature, pressure, acceleration_x, acceleration_y,
+            acceleration_z, battery_voltage)
+
+
+def _legacy_decode_5(data):
+    temperature = struct.unpack("!h", data[3:5])[0] * 0.005
+    humidity = struct.unpack("!H", data[5:7])[0] * 0.0025
+    pressure = struct.unpack("!H", data[7:9])[0] + 50000
+    acceleration_x = struct.unpack("!h", data[9:11])[0]
+    acceleration_y = struct.unpack("!h", data[11:13])[0]
+    acceleration_z = struct.unpack("!h", data[13:15])[0]
+    power_bin = bin(struct.unpack("!H", data[15:17])[0])[2:]
+    battery_voltage = int(power_bin[:11], 2) + 1600
+    tx_power = int(power_bin[11:], 2) * 2 - 40
+    movement_counter = data[18]
+    measurement_sequence = struct.unpack("!H", data[18:20])[0]
+    return (5, humidity, temperature, pressure, acceleration_x, acceleration_y,
+            acceleration_z, battery_voltage, tx_power, movement_counter,
+            measurement_sequence)
+
+
+def _legacy_decode(data):
+    from model import ExternalSensor
+    if data[2] == 3:
+        d = _legacy_decode_3(data)
+        return ExternalSensor(humidity=str(d[1]), temperature=str(d[2]), pressure=str(d[3]),
+                              acceleration_x=str(d[4]), acceleration_y=str(d[5]),
+                              acceleration_z=str(d[6]), battery_voltage=str(d[7]))
+    elif data[2] == 5:
+        d = _legacy_decode_5(data)
+        return ExternalSensor(humidity=str(d[1]), temperature=str(d[2]), pressure=str(d[3]),
+                              acceleration_x=str(d[4]), acceleration_y=str(d[5]),
+                              acceleration_z=str(d[6]), battery_voltage=str(d[7]),
+                              tx_power=str(d[8]), movement_counter=str(d[9]),
+                              measurement_sequence=str(d[10]))
+
+
+def _format_3(rng):
+    t = rng.uniform(-30, 40)
+    return b'\x99\x04' + struct.pack(
+        '>BBBBHhhhH', 3, rng.randint(40, 160), (0x80 if t < 0 else 0) | int(abs(t)),
+        int(abs(t) * 100) % 100, rng.randint(40000, 60000), rng.randint(-1000, 1000),
+        rng.randint(-1000, 1000), rng.randint(-1000, 1000), rng.randint(2500, 3100))
+
+
+def generate(count, seed=1):
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        if i % 4 == 3:
+            payloads.append(_format_3(rng))
+            continue
+        tag = sim.RuuviTag('{:012X}'.format(i), temperature=round(rng.uniform(-30, 40), 2),
+                           humidity=round(rng.uniform(10, 90), 2),
+                           pressure=rng.randint(90000, 110000),
+                           acceleration=(rng.randint(-1000, 1000), rng.randint(-1000, 1000),
+                                         rng.randint(-1000, 1000)),
+                           battery_voltage=rng.randint(2500, 3100))
+        tag.movement_counter = rng.randint(0, 254)
+        payloads.append(tag.manufacturer_data())
+    return payloads
+
+
+def read_payloads(path):
+    payloads = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                payloads.append(bytes.fromhex(line))
+    return payloads
+
+
+def _time(decode, payloads, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for p in payloads:
+            decode(p)
+    return (time.perf_counter() - start) / (rounds * len(payloads)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Ruuvi payload decoders on the host')
+    parser.add_argument('file', nargs='?', help='payloads as hex, one per line')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='payloads to generate without a file')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    sim.install(sim.Device(tempfile.gettempdir()))  # ustruct, ubinascii
+    try:
+        from RuuviDecoder import decode
+        payloads = read_payloads(args.file) if args.file else generate(args.count)
+        payloads = [p for p in payloads if len(p) > 2 and p[2] in (3, 5)]
+        if not payloads:
+            print('no payloads of format 3 or 5')
+            return
+
+        # fields decoded differently, e.g. the movement counter that the
+        # legacy decoder read from the sequence number
+        diffs = {}
+        for p in payloads:
+            new, old = decode(p), _legacy_decode(p)
+            for field in ('temperature', 'humidity', 'pressure', 'acceleration_x',
+                          'acceleration_y', 'acceleration_z', 'battery_voltage',
+                          'tx_power', 'movement_counter', 'measurement_sequence'):
+                if str(getattr(new, field)) != getattr(old, field):
+                    diffs[field] = diffs.get(field, 0) + 1
+        legacy_us = _time(_legacy_decode, payloads, args.rounds)
+        table_us = _time(decode, payloads, args.rounds)
+        print('{} payloads, decoded differently: {}'.format(len(payloads), ', '.join(
+            '{} {}'.format(field, n) for field, n in sorted(diffs.items())) or 'none'))
+        print('{:<14} {:>12}'.format('decoder', 'us/payload'))
+        print('{:<14} {:>12.2f}'.format('legacy', legacy_us))
+        print('{:<14} {:>12.2f}'.format('table-driven', table_us))
+    finally:
+        sim.uninstall()
+
+
+if __name__ == '__main__':
+    main()
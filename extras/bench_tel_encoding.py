@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# Compares the text @TEL frame with the binary record of protocol version 2:
+# bytes on the wire per frame and time to produce them.
+#
+# The text frame is built with the same format string as
+# ServerUtil.create_tel_frame; the binary record is produced from that text
+# frame by TelRecord.encode_frame, like the device does when sending. Times are
+# CPython times on the host, so only the ratio between them is meaningful for
+# the device.
+#
+# Usage:
+#   python3 bench_tel_encoding.py
+#
+
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import TelRecord  # noqa: E402
+import tel_codec  # noqa: E402
+
+TEL_FORMAT = '@TEL,{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},,{},{},{},{},{},{},{},{},{},{},{}\r\n'
+
+SAMPLES = {
+    'gps + 2 temps': (
+        '2020-06-05T21:44:20+00:00', 43.762341, -79.324445, 123.48, 1.21,
+        4.123, 0, 0.01220703, -0.00805664, 1.00146484, -0.4613, 0.6984, '0',
+        '4.8984375', '5.0078125', '', '', 0, '', '', '', '', '', '', '', '', '', '', '', '1200:batt+parked'),
+    'no fix, 4 temps': (
+        '2020-06-05T21:44:20+00:00', '', '', '', '', 3.981, 0, 0.00366211,
+        0.00244141, 0.99853516, 0.1401, -0.2101, '1', '-18.0234375',
+        '-17.8828125', '-18.2421875', '-17.9609375', 0, '', '', '', '', '',
+        '', '', '', '', '', '', ''),
+    'gps + ruuvi': (
+        '2020-06-05T21:44:20+00:00', 43.762341, -79.324445, 123.48, 1.21,
+        4.123, 1, 0.01220703, -0.00805664, 1.00146484, -0.4613, 0.6984, '0',
+        '4.8984375', '', '', '', 1, 'DA68B8C24CC4', '-32', '1008', '3157',
+        '41.5', '21.345', '99902', '2911', '4', '', '', '60:moving'),
+    'reused fix': (
+        '2020-06-05T21:44:20+00:00', 43.762341, -79.324445, '', 0.0,
+        4.123, 0, 0.01220703, -0.00805664, 1.00146484, -0.4613, 0.6984, '0',
+        '4.8984375', '5.0078125', '', '', 0, '', '', '', '', '', '', '', '', '', 1800, '', ''),
+}
+
+
+def _bench(fn, number=20000):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    print('{:<18} {:>10} {:>10} {:>7} {:>12} {:>12} {:>12}'.format(
+        'sample', 'text [B]', 'binary [B]', 'ratio', 'text [us]',
+        'binary [us]', 'decode [us]'))
+    for name, values in SAMPLES.items():
+        text = TEL_FORMAT.format(*values)
+        record = TelRecord.TEL_BINARY_MARKER + TelRecord.encode_frame(text)
+
+        # check the round trip before timing anything
+        decoded = tel_codec.decode_record(record, len(TelRecord.TEL_BINARY_MARKER))
+        assert tel_codec.record_to_text(decoded).count(',') == text.count(',')
+
+        t_text = _bench(lambda: TEL_FORMAT.format(*values))
+        t_bin = _bench(lambda: TelRecord.encode_frame(TEL_FORMAT.format(*values)))
+        t_dec = _bench(lambda: tel_codec.decode_record(
+            record, len(TelRecord.TEL_BINARY_MARKER)))
+        print('{:<18} {:>10} {:>10} {:>6.0f}% {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+            name, len(text), len(record), 100.0 * len(record) / len(text),
+            t_text, t_bin, t_dec))
+
+
+if __name__ == '__main__':
+    main()
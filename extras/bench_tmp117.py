@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Compares how long SensorsHandler.get_temperatures() keeps the device awake
+# when it polls each TMP117 in turn until its continuous conversion has a
+# result, and when it reads the ready ones and starts a one-shot conversion on
+# all the others at once (batched), using the simulated sensors of the `sim`
+# package.
+#
+# Cases:
+#   power on    the sensors were just powered, no result yet
+#   after sleep the previous read was --sleep seconds ago
+#   back to back the previous read was just now (the result was consumed)
+#
+# Times are simulated milliseconds; with the default --scale 1 they include
+# the host CPU time of the driver code, which is much less than on the GPy.
+#
+# --profile selects the sampling profile (SensorsHandler.SAMPLING_PROFILES)
+# that is set after each read, as the 'temp_profile' config does.
+#
+# Usage:
+#   python3 bench_tmp117.py --sensors 4 --sleep 30
+#   python3 bench_tmp117.py --profile fast
+#
+
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import sim  # noqa: E402
+
+
+class _NoLog:
+
+    def debug(self, *args, **kwargs):
+        pass
+
+    info = error = debug
+
+
+def _read(device, batched, profile):
+    from SensorsHandler import SensorsHandler
+    bus = device.i2c
+    handler = SensorsHandler(_NoLog(), batched=batched, profile=profile)
+    transfers = bus.transfers
+    start = device.clock.now()
+    temps = handler.get_temperatures()
+    ms = (device.clock.now() - start) * 1000
+    return ms, bus.transfers - transfers, temps
+
+
+def _case(name, batched, args):
+    device = sim.Device(tempfile.gettempdir(), scale=args.scale)
+    device.tmp117 = {0x48 + i: 4.0 + i for i in range(args.sensors)}
+    sim.install(device)
+    try:
+        device.i2c  # power on the sensors
+        if name != 'power on':
+            _read(device, batched, args.profile)
+            if name == 'after sleep':
+                device.clock.advance(args.sleep)
+                device.reset_cause = sim.DEEPSLEEP_RESET
+        return _read(device, batched, args.profile)
+    finally:
+        sim.uninstall()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark sequential polling vs batched TMP117 reads')
+    parser.add_argument('--sensors', type=int, default=4, choices=(1, 2, 3, 4))
+    parser.add_argument('--sleep', type=float, default=30.0,
+                        help='deep sleep between wake cycles [s]')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='simulated seconds per host second')
+    parser.add_argument('--profile', default='avg8',
+                        choices=('fast', 'avg8', 'avg32', 'avg64', 'alert'),
+                        help='sampling profile set after each read')
+    args = parser.parse_args()
+
+    print('{:<13} {:>14} {:>8} {:>14} {:>8}'.format(
+        'case', 'polling [ms]', 'I2C', 'batched [ms]', 'I2C'))
+    for name in ('power on', 'after sleep', 'back to back'):
+        poll_ms, poll_i2c, _ = _case(name, False, args)
+        shot_ms, shot_i2c, temps = _case(name, True, args)
+        print('{:<13} {:>14.0f} {:>8} {:>14.0f} {:>8}'.format(
+            name, poll_ms, poll_i2c, shot_ms, shot_i2c))
+    print('temperatures: {}'.format(', '.join(t for t in temps if t)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+#
+# Coarse positions from the LTE cells a device reports without a GPS fix (the
+# `cells` of @TEL, see doc/protocol.md), resolved through a local table of
+# cell locations, so no lookup leaves the server.
+#
+# The table is an SQLite file imported from an OpenCellID export
+# (cell_towers.csv, optionally gzipped: radio,mcc,net,area,cell,unit,lon,lat,
+# range,samples,...), LTE rows only. `area` is the tracking area code, `cell`
+# the global cell id and `unit` the physical cell id (PCI). It is indexed on
+# (mcc, mnc, area, cell) for the serving cell and on (mcc, mnc, pci) for the
+# neighbour cells, which the modem only reports by EARFCN and PCI.
+#
+# The serving cell is looked up by its cell id, or as a PCI of its tracking
+# area when the table has no such global cell id. A neighbour is the nearest
+# cell with its PCI within NEIGHBOUR_RADIUS of the serving cell (PCIs repeat
+# across a network). The position is the centroid of the cells found,
+# weighted by their received power (RSRP in mW); a serving cell without RSRP,
+# the one of the last attach, weighs as DEFAULT_RSRP. The accuracy is the
+# weighted range of those cells.
+#
+# Usage:
+#   python3 cell_locate.py --db cells.sqlite --import cell_towers.csv.gz
+#   python3 cell_locate.py --db cells.sqlite --cells '302:720:6699:215:-98;5110:87:-104'
+#   python3 cell_locate.py --db cells.sqlite telemetry.csv
+#
+
+import argparse
+import csv
+import gzip
+import math
+import sqlite3
+import threading
+
+DEFAULT_RSRP = -110  # dBm, serving cell of the last attach
+DEFAULT_RANGE = 1000  # m, cells without a range in the table
+NEIGHBOUR_RADIUS = 20000  # m around the serving cell
+EARTH_RADIUS = 6371000  # m
+
+CELLS_INDEX = 31  # of `cells` in a telemetry.csv row: '{uid},@TEL,{utc},{lat},...'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cells (
+    mcc INTEGER NOT NULL, mnc INTEGER NOT NULL, area INTEGER NOT NULL,
+    cell INTEGER NOT NULL, pci INTEGER, lat REAL NOT NULL, lng REAL NOT NULL,
+    range INTEGER, PRIMARY KEY (mcc, mnc, area, cell));
+CREATE INDEX IF NOT EXISTS cells_pci ON cells (mcc, mnc, pci);
+'''
+
+
+def parse_cells(cells):
+    """Splits the `cells` of a @TEL frame into the serving cell (mcc, mnc,
+    tac, cell, rsrp) and a list of neighbours (earfcn, pci, rsrp), None for
+    what is missing. Returns None, [] for an empty or malformed value."""
+    def num(s):
+        return int(s) if s != '' else None
+
+    entries = cells.split(';') if cells else []
+    try:
+        serving = tuple(num(v) for v in entries[0].split(':'))
+        neighbours = [tuple(num(v) for v in e.split(':')) for e in entries[1:]]
+    except (IndexError, ValueError):
+        return None, []
+    if len(serving) != 5 or None in serving[:2] or serving[3] is None:
+        return None, []
+    return serving, [n for n in neighbours if len(n) == 3 and n[1] is not None]
+
+
+def distance(lat1, lng1, lat2, lng2):
+    """Great circle distance in m"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, 'r', newline='')
+
+
+class CellLocator:
+    """Resolves `cells` with the table in the SQLite file `path`"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()  # ingest_server.py looks up from executor threads
+
+    def import_csv(self, path):
+        """Adds the LTE cells of an OpenCellID CSV export to the table,
+        returns how many"""
+        def rows():
+            with _open(path) as f:
+                for r in csv.DictReader(f):
+                    if r['radio'] != 'LTE':
+                        continue
+                    yield (int(r['mcc']), int(r['net']), int(r['area']), int(r['cell']),
+                           int(r['unit']) if r['unit'] not in ('', '-1') else None,
+                           float(r['lat']), float(r['lon']),
+                           int(r['range']) if r['range'] else None)
+
+        before = self._db.total_changes
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows())
+        return self._db.total_changes - before
+
+    def _serving(self, mcc, mnc, tac, cell):
+        found = self._db.execute(
+            'SELECT lat, lng, range FROM cells WHERE mcc=? AND mnc=? AND area=? AND cell=?',
+            (mcc, mnc, tac, cell)).fetchone()
+        if found is None and tac is not None:
+            found = self._db.execute(
+                'SELECT lat, lng, range FROM cells WHERE mcc=? AND mnc=? AND area=? AND pci=?',
+                (mcc, mnc, tac, cell)).fetchone()
+        return found
+
+    def _neighbour(self, mcc, mnc, pci, lat, lng):
+        nearest, nearest_m = None, NEIGHBOUR_RADIUS
+        for found in self._db.execute(
+                'SELECT lat, lng, range FROM cells WHERE mcc=? AND mnc=? AND pci=?',
+                (mcc, mnc, pci)):
+            m = distance(lat, lng, found[0], found[1])
+            if m <= nearest_m:
+                nearest, nearest_m = found, m
+        return nearest
+
+    def locate(self, cells):
+        """Returns (lat, lng, accuracy in m) for the `cells` of a @TEL
+        frame, or None if the serving cell is not in the table"""
+        serving, neighbours = parse_cells(cells)
+        if serving is None:
+            return None
+        mcc, mnc, tac, cell, rsrp = serving
+        with self._lock:
+            found = self._serving(mcc, mnc, tac, cell)
+            if found is None:
+                return None
+            located = [(found, rsrp)]
+            for _, pci, n_rsrp in neighbours:
+                n = self._neighbour(mcc, mnc, pci, found[0], found[1])
+                if n is not None:
+                    located.append((n, n_rsrp))
+        total = lat = lng = accuracy = 0.0
+        for (c_lat, c_lng, c_range), c_rsrp in located:
+            w = 10 ** ((c_rsrp if c_rsrp is not None else DEFAULT_RSRP) / 10.0)
+            total += w
+            lat += w * c_lat
+            lng += w * c_lng
+            accuracy += w * (c_range or DEFAULT_RANGE)
+        return lat / total, lng / total, int(round(accuracy / total))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Coarse positions from the LTE cells of @TEL frames')
+    parser.add_argument('telemetry', nargs='?',
+                        help='telemetry.csv of ingest_server.py, the rows without '
+                             'a fix are located')
+    parser.add_argument('--db', required=True, help='SQLite file of the cell table')
+    parser.add_argument('--import', dest='import_csv', metavar='CSV',
+                        help='import an OpenCellID export (.csv or .csv.gz) first')
+    parser.add_argument('--cells', help="locate one `cells` value, e.g. "
+                                        "'302:720:6699:215:-98;5110:87:-104'")
+    args = parser.parse_args()
+
+    locator = CellLocator(args.db)
+    if args.import_csv:
+        print('{} LTE cells imported'.format(locator.import_csv(args.import_csv)))
+    if args.cells:
+        print(locator.locate(args.cells))
+    if args.telemetry:
+        with open(args.telemetry, 'r') as f:
+            for line in f:
+                words = line.rstrip('\r\n').split(',')
+                if len(words) <= CELLS_INDEX or words[3] or not words[CELLS_INDEX]:
+                    continue
+                position = locator.locate(words[CELLS_INDEX])
+                if position is not None:
+                    print('{},{},{:.6f},{:.6f},{}'.format(words[0], words[2], *position))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#
+# Local stand-in for the EPO download server of the GNSS vendor, for testing
+# the GPS assistance ($AGP in doc/protocol.md) without depending on it.
+# ingest_server.py downloads the EPO file from here (--assist-url) and sends
+# the next hours of it to the devices.
+#
+# An EPO file (Extended Prediction Orbit, MediaTek format, as the L76 uses) is
+# a list of 6 hour segments, each with one 72-byte record for each of the 32
+# GPS satellites; a record starts with the GPS hour (since 1980-01-06) of its
+# segment in 3 bytes (little-endian) and the satellite number. The generated
+# files have that layout, starting with the segment of the current time, and
+# filler data for the orbits: a real L76 accepts them but gets no faster fix.
+# With --dir the files in that directory are served instead, e.g. the ones
+# downloaded from the vendor.
+#
+# Usage:
+#   python3 epo_server.py --port 8080
+#   curl -O http://127.0.0.1:8080/MTK7d.EPO
+#
+
+import argparse
+import datetime
+import http.server
+import os
+import random
+import re
+import struct
+import threading
+import time
+
+RECORD_SIZE = 72
+SATELLITES = 32
+SEGMENT_SIZE = RECORD_SIZE * SATELLITES
+SEGMENT_HOURS = 6
+GPS_EPOCH = datetime.datetime(1980, 1, 6, tzinfo=datetime.timezone.utc).timestamp()
+GPS_LEAP_SECONDS = 18
+
+_EPO_PATH = re.compile(r'^/MTK(\d+)d\.EPO$')
+
+
+def gps_hour(unix_time):
+    return int(unix_time - GPS_EPOCH + GPS_LEAP_SECONDS) // 3600
+
+
+def generate(unix_time, days=7, seed=1):
+    """EPO data for `days` days, from the segment of `unix_time`"""
+    first = gps_hour(unix_time) // SEGMENT_HOURS * SEGMENT_HOURS
+    rng = random.Random(seed)
+    out = bytearray()
+    for segment in range(days * 24 // SEGMENT_HOURS):
+        hour = first + segment * SEGMENT_HOURS
+        for sv in range(1, SATELLITES + 1):
+            out += struct.pack('<I', hour | sv << 24)
+            out += bytes(rng.getrandbits(8) for _ in range(RECORD_SIZE - 4))
+    return bytes(out)
+
+
+def segment_hours(data):
+    """GPS hour of each segment of EPO data"""
+    return [struct.unpack_from('<I', data, offset)[0] & 0xFFFFFF
+            for offset in range(0, len(data) - SEGMENT_SIZE + 1, SEGMENT_SIZE)]
+
+
+class EpoHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        data = self.server.epo_file(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+
+class EpoServer(http.server.ThreadingHTTPServer):
+    """Serves /MTK{days}d.EPO, generated for the time of `clock()` unless
+    `directory` has that file"""
+
+    def __init__(self, address, directory=None, clock=time.time, verbose=False):
+        super().__init__(address, EpoHandler)
+        self.directory = directory
+        self.clock = clock
+        self.verbose = verbose
+
+    def epo_file(self, path):
+        m = _EPO_PATH.match(path)
+        if m is None:
+            return None
+        if self.directory is not None:
+            try:
+                with open(os.path.join(self.directory, path[1:]), 'rb') as f:
+                    return f.read()
+            except OSError:
+                return None
+        return generate(self.clock(), int(m.group(1)))
+
+
+def start_server(host='127.0.0.1', port=0, directory=None, clock=time.time):
+    """Starts an EpoServer in a thread, returns it"""
+    server = EpoServer((host, port), directory, clock)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Local stand-in for the EPO download server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--dir', default=None,
+                        help='serve the EPO files in this directory instead')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    server = EpoServer((args.host, args.port), args.dir, verbose=args.verbose)
+    print('Serving EPO files on {}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
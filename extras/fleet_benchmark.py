@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#
+# Throughput/latency benchmark for ingest_server.py
+#
+# Simulates a fleet of devices waking on overlapping schedules: each fake
+# device opens a connection, sends a +HRT heartbeat, answers the $TEL request
+# with its queued @TEL frames followed by EOT, and closes the socket once the
+# server does not ask for anything else (keep_alive=0).
+#
+# By default the server is started in-process on a free local port with a
+# NullStore, so the numbers reflect the protocol handling only. Use --host and
+# --port to benchmark a server that is already running. With --protocol 2 or
+# higher the devices send binary @TEL records when the server asks for them;
+# with --protocol 3 or higher the frames are numbered and each batch waits for
+# the server's $ACK; with --protocol 5 or higher the devices announce a deflate
+# window and compress the batch when asked to, and with --protocol 10 they
+# announce the sequence number of their next frame. The devices compress with
+# zlib, which produces the same stream format as src/Deflate.py. $TIM is
+# answered with a sample summary and $AGP with no stored data. The default
+# protocol is the PROTOCOL_VERSION of src/ServerUtil.py.
+#
+# Usage:
+#   python3 fleet_benchmark.py --devices 2000 --sessions 3 --frames 20
+#
+
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import struct
+import sys
+import time
+import zlib
+
+from ingest_server import IngestServer, NullStore
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import TelRecord  # noqa: E402
+
+# a representative frame as produced by ServerUtil.create_tel_frame
+SAMPLE_TEL_FRAME = ('@TEL,2020-06-05T21:44:20+00:00,43.762341,-79.324445,'
+                    '123.48,1.21,4.123,0,0.0123,-0.0081,1.0012,-0.46,0.7,0,'
+                    '4.8984375,5.0078125,,,0,,,,,,,,,,\r\n')
+# and by ServerUtil.create_tim_frame
+SAMPLE_TIM_FRAME = b'@TIM,48,12043,19217,lte:9712:16853,gps:1405:15016,led:1440:1441\r\n'
+
+
+DEFLATE_WBITS = 10
+BLOCK_SIZE = 512
+
+
+def _compress(payload):
+    """Compresses a response like Deflate.DeflateWriter: '@DFL\\r\\n' and
+    length-prefixed blocks of raw deflate data ending with an empty block"""
+    c = zlib.compressobj(6, zlib.DEFLATED, -DEFLATE_WBITS)
+    data = c.compress(payload) + c.flush()
+    out = [b'@DFL\r\n']
+    for i in range(0, len(data), BLOCK_SIZE):
+        block = data[i:i + BLOCK_SIZE]
+        out.append(struct.pack('<H', len(block)) + block)
+    out.append(b'\x00\x00')
+    return b''.join(out)
+
+
+def _protocol_version():
+    """The PROTOCOL_VERSION the firmware announces, read from ServerUtil.py
+    (it only imports on the device)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'ServerUtil.py')
+    with open(path, 'r') as f:
+        return int(re.search(r'PROTOCOL_VERSION = (\d+)', f.read()).group(1))
+
+
+def _encode_batch(first_seq, n, protocol):
+    """Returns the payloads of `n` queued frames by requested format"""
+    if protocol < 3:
+        text = SAMPLE_TEL_FRAME.encode('ascii') * n
+        record = TelRecord.TEL_BINARY_MARKER + TelRecord.encode_frame(SAMPLE_TEL_FRAME)
+        return {'': text + b'\x04', 'B': record * n + b'\x04'}
+    text = []
+    binary = []
+    for seq in range(first_seq, first_seq + n):
+        frame = '@TEL,{},{}'.format(seq, SAMPLE_TEL_FRAME[5:])
+        text.append(frame.encode('ascii'))
+        binary.append(TelRecord.TEL_BINARY_MARKER)
+        binary.append(TelRecord.encode_frame(frame, sequenced=True))
+    payloads = {'': b''.join(text) + b'\x04', 'B': b''.join(binary) + b'\x04'}
+    if protocol >= 5:
+        payloads['Z'] = _compress(payloads[''])
+        payloads['BZ'] = _compress(payloads['B'])
+    return payloads
+
+
+async def _device_session(host, port, uid, frames, protocol, read_size):
+    # `frames` is a tuple of (payloads by format, number of frames, next_seq)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        queued = frames[1]
+        heartbeat = '+HRT,{},{},{}'
+        if protocol >= 5:
+            heartbeat += ',{}'.format(DEFLATE_WBITS)
+        if protocol >= 10:
+            heartbeat += ',{}'.format(frames[2])
+        keep_alive = '1'
+        while keep_alive == '1':
+            writer.write((heartbeat + '\r\n').format(
+                queued, uid, protocol).encode('ascii'))
+            request = await reader.readuntil(b'\r\n')
+            words = request.decode('ascii').rstrip('\r\n').split(',')
+            keep_alive = words[1] if len(words) > 1 else '0'
+            if words[0] == '$TEL':
+                writer.write(frames[0][words[2] if len(words) > 2 else ''])
+                queued = 0
+                if len(words) > 3:
+                    ack = await reader.readuntil(b'\r\n')
+                    if not ack.startswith(b'$ACK'):
+                        raise OSError('expected $ACK, got {!r}'.format(ack))
+            elif words[0] == '$TIM':
+                writer.write(SAMPLE_TIM_FRAME)
+            elif words[0] == '$AGP':
+                # '$AGP,{keep_alive},{utc_datetime},{lat},{lng},{length}'
+                if len(words) > 5 and words[5]:
+                    await reader.readexactly(int(words[5]))
+                writer.write(b'@AGP,0\r\n')
+            await writer.drain()
+        # the server has everything once it closes its side
+        while await reader.read(read_size):
+            pass
+    finally:
+        writer.close()
+
+
+async def _device(host, port, index, args, limiter, latencies, failures):
+    uid = '{:012X}'.format(0x240AC4000000 + index)
+    for session in range(args.sessions):
+        # the encoding cost belongs to the device, not the server, so do it
+        # outside of the timed part
+        first_seq = session * args.frames + 1
+        frames = (_encode_batch(first_seq, args.frames, args.protocol), args.frames,
+                  first_seq + args.frames)
+        async with limiter:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(
+                    _device_session(host, port, uid, frames, args.protocol, 1024),
+                    args.timeout)
+                latencies.append(time.perf_counter() - start)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                failures.append(index)
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[k]
+
+
+async def _main(args):
+    server = None
+    host, port = args.host, args.port
+    if host is None:
+        server = IngestServer(NullStore())
+        await server.start('127.0.0.1', 0)
+        host, port = server.sockets()[0].getsockname()[:2]
+
+    limiter = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    failures = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _device(host, port, i, args, limiter, latencies, failures)
+        for i in range(args.devices)])
+    elapsed = time.perf_counter() - start
+
+    sessions = len(latencies)
+    frames = sessions * args.frames
+    tel_bytes = frames * len(SAMPLE_TEL_FRAME)
+    print('devices={} sessions/device={} frames/session={} concurrency={} protocol={}'.format(
+        args.devices, args.sessions, args.frames, args.concurrency, args.protocol))
+    print('elapsed:     {:.2f} s'.format(elapsed))
+    print('sessions:    {} ok, {} failed, {:.0f} sessions/s'.format(
+        sessions, len(failures), sessions / elapsed))
+    print('throughput:  {:.0f} frames/s ({:.2f} MB/s as text frames)'.format(
+        frames / elapsed, tel_bytes / elapsed / 1e6))
+    if latencies:
+        print('latency ms:  mean={:.1f} p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}'.format(
+            statistics.mean(latencies) * 1000,
+            _percentile(latencies, 50) * 1000,
+            _percentile(latencies, 95) * 1000,
+            _percentile(latencies, 99) * 1000,
+            max(latencies) * 1000))
+    if server is not None:
+        print('server:      {}'.format(server.stats))
+        server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the ingestion server with a fleet of fake devices')
+    parser.add_argument('--host', default=None,
+                        help='server to benchmark (default: start one in-process)')
+    parser.add_argument('--port', type=int, default=8883)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, default=3,
+                        help='wake-ups per device')
+    parser.add_argument('--frames', type=int, default=10,
+                        help='queued @TEL frames per wake-up')
+    parser.add_argument('--protocol', type=int, default=_protocol_version(),
+                        help='protocol version announced in the heartbeat '
+                             '(default: the one of the firmware)')
+    parser.add_argument('--concurrency', type=int, default=256,
+                        help='maximum simultaneous connections')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='per-session timeout [seconds]')
+    asyncio.run(_main(parser.parse_args()))
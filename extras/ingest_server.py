@@ -0,0 +1,922 @@
+#!/usr/bin/env python3
+#
+# Fleet ingestion server for the device protocol (see doc/protocol.md)
+#
+# Unlike socket-server.py and the interactive servers, this server handles
+# many device connections concurrently on a single asyncio event loop:
+#
+#  - every connection reads into one fixed-size buffer (BufferedProtocol), and
+#    frames are split in place without growing byte strings
+#  - each connection has an idle timeout (no bytes received) and an overall
+#    session timeout, so a device that stalls mid-transfer cannot pin a slot
+#  - the request sent after each heartbeat is chosen per device: operator
+#    requests queued with `--request` first, then `$TEL` to drain telemetry
+#
+# Devices announcing protocol version 2 are asked for binary @TEL records
+# (`$TEL,{keep_alive},B`), which are decoded with tel_codec.py. Devices with
+# version 3 number their frames: the server tells them the last sequence number
+# it has (`$TEL,{keep_alive},{format},{last_seq}`), drops frames it already
+# stored and confirms each batch with `$ACK,{last_seq}`, after which the device
+# removes the frames from its queue. Use `--state` to keep the last sequence
+# numbers across restarts of the server. Devices with version 5 announce a
+# deflate window in the heartbeat and are asked to compress their @TEL and @LOG
+# responses (format `Z`), which are inflated here before the frames are split.
+# Devices with version 6 are asked for a summary of their wake cycle phase
+# times (`$TIM`) once every `--timing-interval` seconds; use phase_report.py
+# to see which phases dominate the awake time across the fleet.
+# Devices with version 8 get GPS assistance (`$AGP`) once every
+# `--assist-interval` seconds with `--assist-url`: the server time, the last
+# position the device reported, and the next `--assist-hours` of the EPO file
+# downloaded from that URL (refreshed hourly, e.g. from epo_server.py).
+# Devices with version 9 report their LTE cells in @TEL frames without a fix;
+# with `--cell-db` (a table built by cell_locate.py) those are resolved to a
+# coarse position, appended to a CSV file as
+# `{device_uid},{utc_datetime},{lat},{lng},{accuracy_m},{cells}`.
+# Devices with version 10 announce the sequence number of their next frame in
+# the heartbeat; when it went back (e.g. the queue on the SD card was lost),
+# the last sequence number of the device is lowered to just before its queue.
+#
+# Received @TEL frames are appended to a CSV file as `{device_uid},{frame}` in
+# the text form of protocol version 1, @CFG frames to a separate file, and
+# @LOG payloads are appended to `{log_dir}/{device_uid}.log`, and @TIM
+# summaries to a CSV file as `{device_uid},{unix_time},{summary}`. A log request can
+# ask for a byte range, e.g. `--request 240AC4C7C35C:'$LOG,-65536'` for the
+# last 64 KB or `'$LOG,{offset},{length}'` to resume an interrupted transfer.
+#
+# Usage:
+#   python3 ingest_server.py --port 8883 --out telemetry.csv --state seq.json
+#   python3 ingest_server.py --request 240AC4C7C35C:'$RCF'
+#   python3 ingest_server.py --assist-url http://127.0.0.1:8080/MTK7d.EPO
+#   python3 ingest_server.py --cell-db cells.sqlite
+#
+
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import time
+import urllib.request
+import zlib
+
+from cell_locate import CellLocator
+from epo_server import SEGMENT_HOURS, SEGMENT_SIZE, gps_hour
+from tel_codec import (TEL_BINARY_MARKER, SEQ_SIZE, decode_record, decode_seq,
+                       record_size, record_to_text, sequenced_record_size)
+
+EOT = 0x04
+DEFLATE_MARKER = b'@DFL\r\n'  # the rest of the response is compressed
+READ_BUFFER_SIZE = 4096  # bytes, also the maximum length of a single frame
+IDLE_TIMEOUT = 30  # seconds without receiving anything
+TIMING_INTERVAL = 86400  # seconds between $TIM requests to a device
+SESSION_TIMEOUT = 300  # seconds for a whole connection
+ASSIST_INTERVAL = 86400  # seconds between $AGP requests to a device
+ASSIST_HOURS = 48  # hours of EPO data sent with $AGP
+ASSIST_REFRESH = 3600  # seconds between downloads of the EPO file
+TEL_CELLS_INDEX = 30  # of `cells` in the words of a text @TEL frame
+
+
+class FrameTooLong(Exception):
+    pass
+
+
+class FrameSplitter:
+    """Splits a byte stream into frames using a single fixed-size buffer.
+
+    Frames are terminated by '\\n' (normally as part of '\\r\\n') or by the EOT
+    character, whichever comes first. The terminator is part of the returned
+    frame, so an EOT sent right after the last @TEL frame comes back as the
+    one-byte frame b'\\x04'.
+    """
+
+    def __init__(self, size=READ_BUFFER_SIZE):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # first byte of the pending (incomplete) frame
+        self._end = 0  # end of the received data
+
+    def get_buffer(self):
+        """Returns a writable view of the free space at the end of the buffer"""
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buf):
+            if self._start == 0:
+                raise FrameTooLong(
+                    'No frame terminator within {} bytes'.format(len(self._buf)))
+            # move the pending partial frame to the front of the buffer
+            pending = self._end - self._start
+            self._buf[:pending] = self._view[self._start:self._end].tobytes()
+            self._start = 0
+            self._end = pending
+        return self._view[self._end:]
+
+    def advance(self, nbytes):
+        """Marks `nbytes` bytes written into the view from get_buffer() as received"""
+        self._end += nbytes
+
+    def buffered(self):
+        return self._end - self._start
+
+    def next_record(self, marker, size_of, header_size=4):
+        """Returns the next binary record starting with `marker`, including the
+        marker. `size_of(buffer, offset)` gives the size of the record body at
+        `offset` from its first `header_size` bytes. Data not starting with the
+        marker is split as a normal frame (see next_frame())."""
+        available = self._end - self._start
+        if available == 0:
+            return None
+        if self._buf[self._start] != marker[0]:
+            return self.next_frame()
+        header = len(marker) + header_size
+        if available < header:
+            return None
+        if self._view[self._start:self._start + len(marker)] != marker:
+            return self.next_frame()
+        stop = self._start + len(marker) + size_of(self._buf, self._start + len(marker))
+        if stop > self._end:
+            if stop - self._start > len(self._buf):
+                raise FrameTooLong('Record of {} bytes'.format(stop - self._start))
+            return None
+        frame = self._view[self._start:stop].tobytes()
+        self._start = stop
+        return frame
+
+    def next_bytes(self, max_size):
+        """Returns up to `max_size` received bytes without looking for a
+        terminator, or None if nothing is buffered"""
+        if self._start == self._end or max_size <= 0:
+            return None
+        stop = min(self._end, self._start + max_size)
+        data = self._view[self._start:stop].tobytes()
+        self._start = stop
+        return data
+
+    def next_block(self):
+        """Returns the data of the next block prefixed with its length as a
+        uint16, b'' for a zero-length block, or None if it is incomplete"""
+        if self._end - self._start < 2:
+            return None
+        n = self._buf[self._start] | (self._buf[self._start + 1] << 8)
+        stop = self._start + 2 + n
+        if stop > self._end:
+            if 2 + n > len(self._buf):
+                raise FrameTooLong('Block of {} bytes'.format(n))
+            return None
+        data = self._view[self._start + 2:stop].tobytes()
+        self._start = stop
+        return data
+
+    def next_frame(self):
+        """Returns the next complete frame as bytes, or None if there is none yet"""
+        if self._start == self._end:
+            return None
+        lf = self._buf.find(b'\n', self._start, self._end)
+        eot = self._buf.find(b'\x04', self._start, self._end)
+        if lf < 0 and eot < 0:
+            return None
+        if lf < 0 or (0 <= eot < lf):
+            stop = eot + 1
+        else:
+            stop = lf + 1
+        frame = self._view[self._start:stop].tobytes()
+        self._start = stop
+        return frame
+
+
+class AssistSource:
+    """EPO data for $AGP, downloaded from `url` every `refresh` seconds"""
+
+    def __init__(self, url, refresh=ASSIST_REFRESH, clock=time.time):
+        self.url = url
+        self.refresh_interval = refresh
+        self.clock = clock
+        self._data = b''
+        self._tried = None  # clock() of the last download attempt
+
+    def stale(self):
+        return self._tried is None or self.clock() - self._tried >= self.refresh_interval
+
+    def refresh(self):
+        """Downloads the EPO file (blocking), the old data is kept if it fails"""
+        self._tried = self.clock()
+        try:
+            with urllib.request.urlopen(self.url, timeout=30) as r:
+                data = r.read()
+        except OSError as ex:
+            print('EPO download from {} failed: {}'.format(self.url, ex))
+            return False
+        if not data or len(data) % SEGMENT_SIZE:
+            print('EPO download from {}: not EPO data ({} bytes)'.format(
+                self.url, len(data)))
+            return False
+        self._data = data
+        return True
+
+    def segments(self, unix_time, hours=ASSIST_HOURS):
+        """The EPO data from the segment of `unix_time` on, at most `hours`
+        long, b'' if it does not cover that time"""
+        if not self._data:
+            return b''
+        first = self._data[0] | self._data[1] << 8 | self._data[2] << 16
+        segment = (gps_hour(unix_time) - first) // SEGMENT_HOURS
+        if segment < 0:
+            return b''
+        start = segment * SEGMENT_SIZE
+        count = max(1, hours // SEGMENT_HOURS)
+        return self._data[start:start + count * SEGMENT_SIZE]
+
+
+class ServerStats:
+
+    def __init__(self):
+        self.connections = 0
+        self.active = 0
+        self.sessions_completed = 0
+        self.tel_frames = 0
+        self.duplicates = 0
+        self.bytes_received = 0
+        self.bytes_inflated = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return ('connections={} active={} completed={} tel_frames={} '
+                'duplicates={} bytes={} inflated={} timeouts={} errors={}'.format(
+                    self.connections, self.active, self.sessions_completed,
+                    self.tel_frames, self.duplicates, self.bytes_received,
+                    self.bytes_inflated, self.timeouts, self.errors))
+
+
+class FileStore:
+    """Persists everything received from the devices to local files"""
+
+    def __init__(self, tel_path='telemetry.csv', cfg_path='config_frames.csv',
+                 log_dir='logs', tim_path='phase_times.csv',
+                 position_path='cell_positions.csv'):
+        self._tel_file = open(tel_path, 'a')
+        self._cfg_file = open(cfg_path, 'a')
+        self._tim_file = open(tim_path, 'a')
+        self._position_path = position_path
+        self._position_file = None  # opened with the first cell position
+        self._log_dir = log_dir
+
+    def store_tel(self, uid, frames):
+        self._tel_file.write(''.join(
+            '{},{}\n'.format(uid, f.decode('ascii', 'replace').rstrip('\r\n'))
+            for f in frames))
+
+    def store_cfg(self, uid, frame):
+        self._cfg_file.write('{},{}\n'.format(
+            uid, frame.decode('ascii', 'replace').rstrip('\r\n')))
+
+    def store_tim(self, uid, frame):
+        # '@TIM,{summary}' -> '{uid},{unix_time},{summary}'
+        self._tim_file.write('{},{},{}\n'.format(
+            uid, int(time.time()),
+            frame[5:].decode('ascii', 'replace').rstrip('\r\n')))
+
+    def store_position(self, uid, utc_datetime, position, cells):
+        if self._position_file is None:
+            self._position_file = open(self._position_path, 'a')
+        self._position_file.write('{},{},{:.6f},{:.6f},{},{}\n'.format(
+            uid, utc_datetime, position[0], position[1], position[2], cells))
+
+    def store_log(self, uid, chunks):
+        os.makedirs(self._log_dir, exist_ok=True)
+        with open(os.path.join(self._log_dir, '{}.log'.format(uid)), 'ab') as f:
+            for c in chunks:
+                f.write(c)
+
+    def flush(self):
+        self._tel_file.flush()
+        self._cfg_file.flush()
+        self._tim_file.flush()
+        if self._position_file is not None:
+            self._position_file.flush()
+
+    def close(self):
+        self._tel_file.close()
+        self._cfg_file.close()
+        self._tim_file.close()
+        if self._position_file is not None:
+            self._position_file.close()
+
+
+class NullStore:
+    """Discards everything, used for benchmarking the protocol handling"""
+
+    def store_tel(self, uid, frames):
+        pass
+
+    def store_cfg(self, uid, frame):
+        pass
+
+    def store_tim(self, uid, frame):
+        pass
+
+    def store_position(self, uid, utc_datetime, position, cells):
+        pass
+
+    def store_log(self, uid, chunks):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# session states
+_WAIT_HRT = 0
+_WAIT_TEL = 1
+_WAIT_CFG = 2
+_WAIT_LOG_HEADER = 3
+_WAIT_LOG_BODY = 4
+_WAIT_CLOSE = 5
+_WAIT_TIM = 6
+_WAIT_AGP = 7
+
+
+class DeviceSession(asyncio.BufferedProtocol):
+    """Protocol state machine for one device connection"""
+
+    def __init__(self, server):
+        self._server = server
+        self._splitter = FrameSplitter(server.read_buffer_size)
+        self._transport = None
+        self._state = _WAIT_HRT
+        self._uid = None
+        self._protocol_version = None
+        self._deflate_wbits = 0  # 0 = the device can not compress
+        self._inflater = None  # decompressor while inside a compressed response
+        self._inflate_tail = b''  # compressed data not inflated yet
+        self._inner = None  # splitter for the inflated data
+        self._requests = None  # requests left for this connection
+        self._tel_binary = False
+        self._tel_sequenced = False
+        self._tel_frames = []
+        self._last_seq = 0  # highest sequence number received from the device
+        self._log_chunks = []
+        self._log_remaining = None  # bytes of the @LOG body still expected
+        self._idle_handle = None
+        self._session_handle = None
+        self._last_rx = 0.0
+
+    # --- asyncio callbacks
+
+    def connection_made(self, transport):
+        self._transport = transport
+        loop = asyncio.get_running_loop()
+        self._last_rx = loop.time()
+        self._idle_handle = loop.call_later(
+            self._server.idle_timeout, self._check_idle)
+        self._session_handle = loop.call_later(
+            self._server.session_timeout, self._timed_out, 'session')
+        self._server.stats.connections += 1
+        self._server.stats.active += 1
+
+    def get_buffer(self, sizehint):
+        return self._splitter.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self._last_rx = asyncio.get_running_loop().time()
+        self._server.stats.bytes_received += nbytes
+        self._splitter.advance(nbytes)
+        try:
+            frame = self._next_frame()
+            while frame is not None:
+                self._handle_frame(frame)
+                if self._transport is None or self._transport.is_closing():
+                    return
+                frame = self._next_frame()
+        except Exception as ex:
+            self._fail('{}: {}'.format(type(ex).__name__, ex))
+
+    def eof_received(self):
+        if self._state != _WAIT_CLOSE and self._state != _WAIT_HRT:
+            self._fail('connection closed in state {}'.format(self._state))
+        return False
+
+    def connection_lost(self, exc):
+        if self._state == _WAIT_TEL and self._tel_frames:
+            # keep what arrived, the device sends it again without an $ACK
+            # and the duplicates are dropped then
+            self._store_tel()
+        elif self._state == _WAIT_LOG_BODY and self._log_chunks:
+            self._store_log()
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+        if self._session_handle is not None:
+            self._session_handle.cancel()
+        self._transport = None
+        self._server.stats.active -= 1
+        self._server.session_closed(self)
+
+    # --- timeouts
+
+    def _check_idle(self):
+        loop = asyncio.get_running_loop()
+        idle = loop.time() - self._last_rx
+        if idle >= self._server.idle_timeout:
+            self._timed_out('idle')
+        else:
+            self._idle_handle = loop.call_later(
+                self._server.idle_timeout - idle, self._check_idle)
+
+    def _timed_out(self, which):
+        if self._transport is None:
+            return
+        self._server.stats.timeouts += 1
+        self._server.log('{} timeout [{}] in state {}'.format(
+            which, self._uid, self._state))
+        self._transport.abort()
+
+    def _fail(self, reason):
+        self._server.stats.errors += 1
+        self._server.log('closing [{}]: {}'.format(self._uid, reason))
+        if self._transport is not None:
+            self._transport.abort()
+
+    # --- protocol handling
+
+    def _next_frame(self):
+        if self._inflater is None:
+            return self._next_frame_from(self._splitter)
+        while True:
+            frame = self._next_frame_from(self._inner)
+            if frame is not None:
+                return frame
+            if not self._inflate_more():
+                if self._inflater is None:
+                    # end of the compressed data, back to the socket
+                    return self._next_frame_from(self._splitter)
+                return None
+
+    def _inflate_more(self):
+        """Moves inflated data into the inner splitter, as much as fits"""
+        if not self._inflate_tail:
+            block = self._splitter.next_block()
+            if block is None:
+                return False
+            if not block:
+                if not self._inflater.eof or self._inner.buffered():
+                    raise ValueError('truncated compressed response')
+                self._inflater = None
+                return False
+            self._inflate_tail = block
+        view = self._inner.get_buffer()
+        data = self._inflater.decompress(self._inflate_tail, len(view))
+        self._inflate_tail = self._inflater.unconsumed_tail
+        view[:len(data)] = data
+        self._inner.advance(len(data))
+        self._server.stats.bytes_inflated += len(data)
+        return True
+
+    def _next_frame_from(self, splitter):
+        if self._state == _WAIT_LOG_BODY and self._log_remaining:
+            # the log text is taken as it is, only the EOT after it is a frame
+            data = splitter.next_bytes(self._log_remaining)
+            if data is None:
+                return None
+            self._log_remaining -= len(data)
+            self._log_chunks.append(data)
+            if self._log_remaining:
+                return None
+        if self._state == _WAIT_TEL and self._tel_binary:
+            if self._tel_sequenced:
+                return splitter.next_record(
+                    TEL_BINARY_MARKER, sequenced_record_size, SEQ_SIZE + 4)
+            return splitter.next_record(TEL_BINARY_MARKER, record_size)
+        return splitter.next_frame()
+
+    def _send_next_request(self):
+        req = self._requests.popleft()
+        keep_alive = 1 if self._requests else 0
+        words = req.split(',')
+        cmd = words[0]
+        data = b''
+        if cmd == '$AGP' and len(words) == 1:
+            words, data = self._server.assist_request(self._uid)
+        if cmd == '$LOG' and self._deflate_wbits and self._server.compress:
+            # '$LOG,{offset},{length}' -> '$LOG,{offset},{length},Z'
+            if len(words) < 4:
+                words = (words + ['', ''])[:3] + ['Z']
+        out = '{},{}'.format(words[0], keep_alive)
+        if len(words) > 1:
+            out += ',' + ','.join(words[1:])
+        self._transport.write((out + '\r\n').encode('ascii') + data)
+
+        if cmd == '$TEL':
+            self._tel_frames = []
+            self._tel_binary = len(words) > 1 and 'B' in words[1]
+            self._tel_sequenced = len(words) > 2
+            self._state = _WAIT_TEL
+        elif cmd == '$RCF' or cmd == '$WCF':
+            self._state = _WAIT_CFG
+        elif cmd == '$LOG':
+            self._state = _WAIT_LOG_HEADER
+        elif cmd == '$TIM':
+            self._state = _WAIT_TIM
+        elif cmd == '$AGP':
+            self._state = _WAIT_AGP
+        else:
+            self._state = _WAIT_CLOSE
+
+    def _response_done(self):
+        if self._requests:
+            self._state = _WAIT_HRT  # keep_alive was 1
+        else:
+            # nothing else to ask for, the device would close the socket now
+            self._state = _WAIT_CLOSE
+            self._server.stats.sessions_completed += 1
+            self._transport.close()
+
+    def _handle_frame(self, frame):
+        state = self._state
+        if frame == DEFLATE_MARKER and self._inflater is None:
+            if not self._deflate_wbits:
+                raise ValueError('compressed response without deflate support')
+            self._inflater = zlib.decompressobj(-15)
+            if self._inner is None:
+                self._inner = FrameSplitter(self._server.read_buffer_size)
+            return
+        if state == _WAIT_TEL:
+            if frame == b'\x04':
+                self._store_tel()
+                if self._tel_sequenced:
+                    # the device removes the frames on $ACK, they must be on
+                    # disk with their last_seq first
+                    self._server.flush()
+                    self._transport.write('$ACK,{}\r\n'.format(
+                        self._last_seq).encode('ascii'))
+                self._response_done()
+            elif frame.startswith(b'@TEL'):
+                if self._tel_sequenced:
+                    # '@TEL,{seq},...' -> '@TEL,...'
+                    comma = frame.index(b',', 5)
+                    self._add_tel(int(frame[5:comma]), b'@TEL' + frame[comma:])
+                else:
+                    self._tel_frames.append(frame)
+            elif frame.startswith(TEL_BINARY_MARKER):
+                offset = len(TEL_BINARY_MARKER)
+                if self._tel_sequenced:
+                    seq = decode_seq(frame, offset)
+                    if seq <= self._last_seq:
+                        self._server.stats.duplicates += 1
+                        return  # no need to decode it
+                    offset += SEQ_SIZE
+                record = decode_record(frame, offset)
+                text = record_to_text(record).encode('ascii')
+                if self._tel_sequenced:
+                    self._add_tel(seq, text)
+                else:
+                    self._tel_frames.append(text)
+            else:
+                raise ValueError('unexpected frame {!r}'.format(frame[:16]))
+        elif state == _WAIT_HRT:
+            self._handle_heartbeat(frame)
+        elif state == _WAIT_CFG:
+            if not frame.startswith(b'@CFG'):
+                raise ValueError('unexpected frame {!r}'.format(frame[:16]))
+            self._server.store.store_cfg(self._uid, frame)
+            self._response_done()
+        elif state == _WAIT_TIM:
+            if not frame.startswith(b'@TIM'):
+                raise ValueError('unexpected frame {!r}'.format(frame[:16]))
+            self._server.store.store_tim(self._uid, frame)
+            self._response_done()
+        elif state == _WAIT_AGP:
+            if not frame.startswith(b'@AGP'):
+                raise ValueError('unexpected frame {!r}'.format(frame[:16]))
+            self._server.log('assist [{}]: stored {} bytes'.format(
+                self._uid, frame[5:].decode('ascii').rstrip('\r\n')))
+            self._response_done()
+        elif state == _WAIT_LOG_HEADER:
+            if not frame.upper().startswith(b'@LOG'):
+                raise ValueError('unexpected frame {!r}'.format(frame[:16]))
+            # '@LOG,{total},{offset},{length}', without a length the text
+            # runs up to the EOT
+            words = frame.decode('ascii').rstrip('\r\n').split(',')
+            self._log_remaining = int(words[3]) if len(words) > 3 else None
+            if self._log_remaining is not None:
+                self._server.log('log [{}]: bytes {}-{} of {}'.format(
+                    self._uid, words[2], int(words[2]) + self._log_remaining,
+                    words[1]))
+            self._log_chunks = []
+            self._state = _WAIT_LOG_BODY
+        elif state == _WAIT_LOG_BODY:
+            if self._log_remaining is not None:
+                if frame != b'\x04':
+                    raise ValueError('expected EOT, got {!r}'.format(frame[:16]))
+                self._store_log()
+                self._response_done()
+            elif frame[-1] == EOT:
+                self._log_chunks.append(frame[:-1])
+                self._store_log()
+                self._response_done()
+            else:
+                self._log_chunks.append(frame)
+        else:
+            raise ValueError('unexpected frame {!r}'.format(frame[:16]))
+
+    def _add_tel(self, seq, frame):
+        if seq <= self._last_seq:
+            self._server.stats.duplicates += 1
+            return
+        self._last_seq = seq
+        self._tel_frames.append(frame)
+
+    def _store_tel(self):
+        self._server.stats.tel_frames += len(self._tel_frames)
+        if self._server.cell_locator is not None:
+            for f in self._tel_frames:
+                self._server.locate_cells(self._uid, f)
+        # the last position, for $AGP: '@TEL,{utc_datetime},{lat},{lng},...'
+        for f in reversed(self._tel_frames):
+            words = f.split(b',', 4)
+            if len(words) > 3 and words[2] and words[3]:
+                self._server.set_position(
+                    self._uid, words[2].decode('ascii'), words[3].decode('ascii'))
+                break
+        self._server.store.store_tel(self._uid, self._tel_frames)
+        self._tel_frames = []
+        if self._tel_sequenced:
+            self._server.set_last_seq(self._uid, self._last_seq)
+
+    def _store_log(self):
+        self._server.store.store_log(self._uid, self._log_chunks)
+        self._log_chunks = []
+
+    def _handle_heartbeat(self, frame):
+        words = frame.decode('ascii').rstrip('\r\n').split(',')
+        if words[0] != '+HRT' or len(words) < 4:
+            raise ValueError('expected heartbeat, got {!r}'.format(frame[:16]))
+        if self._requests is None:
+            # first heartbeat of the connection, plan the requests
+            self._uid = words[2]
+            self._protocol_version = int(words[3])
+            if len(words) > 4 and words[4] != '':
+                self._deflate_wbits = int(words[4])
+            self._last_seq = self._server.last_seq(self._uid)
+            if len(words) > 5 and words[5] != '':
+                # the device numbers its next frame below what the server has,
+                # e.g. after its queue was lost: its queued frames are new
+                next_seq = int(words[5])
+                if next_seq <= self._last_seq:
+                    self._server.log('heartbeat [{}]: next_seq {} <= last_seq {}, reset'.format(
+                        self._uid, next_seq, self._last_seq))
+                    self._last_seq = max(0, next_seq - 1 - int(words[1] or 0))
+                    self._server.reset_last_seq(self._uid, self._last_seq)
+            self._requests = self._server.plan_requests(
+                self._uid, self._protocol_version, self._deflate_wbits)
+        if not self._requests:
+            self._requests.append(self._server.tel_request(
+                self._protocol_version, self._last_seq, self._deflate_wbits))
+        self._send_next_request()
+
+
+class IngestServer:
+
+    def __init__(self, store, read_buffer_size=READ_BUFFER_SIZE,
+                 idle_timeout=IDLE_TIMEOUT, session_timeout=SESSION_TIMEOUT,
+                 binary_tel=True, compress=True, state_path=None,
+                 timing_interval=TIMING_INTERVAL, assist=None,
+                 assist_interval=ASSIST_INTERVAL, assist_hours=ASSIST_HOURS,
+                 cell_locator=None, clock=time.time, verbose=False):
+        self.store = store
+        self.binary_tel = binary_tel
+        self.compress = compress
+        self.timing_interval = timing_interval  # 0 = never ask for $TIM
+        self.assist = assist  # AssistSource, None = never send $AGP
+        self.assist_interval = assist_interval
+        self.assist_hours = assist_hours
+        self.cell_locator = cell_locator  # CellLocator, None = cells not resolved
+        self.clock = clock  # UTC for $AGP
+        self.read_buffer_size = read_buffer_size
+        self.idle_timeout = idle_timeout
+        self.session_timeout = session_timeout
+        self.stats = ServerStats()
+        self.verbose = verbose
+        self._pending = {}  # device_uid -> deque of operator requests
+        self._state_path = state_path
+        self._last_seqs = {}  # device_uid -> last stored @TEL sequence number
+        self._last_timing = {}  # device_uid -> time of the last $TIM request
+        self._last_assist = {}  # device_uid -> clock() of the last $AGP request
+        self._positions = {}  # device_uid -> (lat, lng) of the last fix, or of its cells before one
+        self._lookups = set()  # pending cell lookups, see locate_cells()
+        self._state_dirty = False
+        self._server = None
+        if state_path is not None and os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                self._last_seqs = json.load(f)
+
+    def log(self, msg):
+        if self.verbose:
+            print('{:.3f} {}'.format(time.time(), msg))
+
+    def queue_request(self, uid, request):
+        """Queue an operator request (e.g. '$RCF', or '$WCF,3' followed by 19
+        commas to only set the log_level) for a device. The keep_alive
+        parameter is filled in when the request is sent, after the command."""
+        self._pending.setdefault(uid, collections.deque()).append(request)
+
+    def tel_request(self, protocol_version, last_seq=0, deflate_wbits=0):
+        fmt = 'B' if self.binary_tel and protocol_version >= 2 else ''
+        if self.compress and deflate_wbits:
+            fmt += 'Z'
+        if protocol_version >= 3:
+            return '$TEL,{},{}'.format(fmt, last_seq)
+        return '$TEL,B' if fmt else '$TEL'
+
+    def plan_requests(self, uid, protocol_version, deflate_wbits=0):
+        requests = self._pending.pop(uid, collections.deque())
+        requests.append(self.tel_request(
+            protocol_version, self.last_seq(uid), deflate_wbits))
+        if protocol_version >= 6 and self.timing_interval:
+            now = time.time()
+            if now - self._last_timing.get(uid, 0) >= self.timing_interval:
+                self._last_timing[uid] = now
+                requests.append('$TIM')
+        if protocol_version >= 8 and self.assist is not None and self.assist_interval:
+            now = self.clock()
+            last = self._last_assist.get(uid)
+            if last is None or now - last >= self.assist_interval:
+                self._last_assist[uid] = now
+                requests.append('$AGP')
+        return requests
+
+    def assist_request(self, uid):
+        """Returns the words of '$AGP,{utc_datetime},{lat},{lng},{length}'
+        for a device, and the EPO data that follows it"""
+        now = self.clock()
+        data = self.assist.segments(now, self.assist_hours) if self.assist else b''
+        lat, lng = self._positions.get(uid, ('', ''))
+        utc = datetime.datetime.fromtimestamp(round(now), datetime.timezone.utc)
+        return ['$AGP', utc.strftime('%Y-%m-%dT%H:%M:%S+00:00'), lat, lng,
+                str(len(data))], data
+
+    def set_position(self, uid, lat, lng):
+        self._positions[uid] = (lat, lng)
+
+    def locate_cells(self, uid, frame):
+        """Resolves the cells of a text @TEL frame without a fix to a coarse
+        position and stores it. The SQLite lookup runs in the executor, so it
+        does not hold up the other connections."""
+        words = frame.decode('ascii', 'replace').rstrip('\r\n').split(',')
+        if len(words) <= TEL_CELLS_INDEX or words[2] or not words[TEL_CELLS_INDEX]:
+            return
+        task = asyncio.ensure_future(self._locate_cells(uid, words[1], words[TEL_CELLS_INDEX]))
+        self._lookups.add(task)
+        task.add_done_callback(self._lookups.discard)
+
+    async def _locate_cells(self, uid, utc_datetime, cells):
+        try:
+            position = await asyncio.get_running_loop().run_in_executor(
+                None, self.cell_locator.locate, cells)
+        except Exception as ex:
+            print('{}: locating cells {} failed: {}'.format(uid, cells, ex))
+            return
+        if position is None:
+            self.log('{}: cells {} not found'.format(uid, cells))
+            return
+        self.store.store_position(uid, utc_datetime, position, cells)
+        if uid not in self._positions:
+            self.set_position(uid, '{:.6f}'.format(position[0]), '{:.6f}'.format(position[1]))
+
+    def last_seq(self, uid):
+        return self._last_seqs.get(uid, 0)
+
+    def set_last_seq(self, uid, seq):
+        if seq > self._last_seqs.get(uid, 0):
+            self._last_seqs[uid] = seq
+            self._state_dirty = True
+
+    def reset_last_seq(self, uid, seq):
+        """Moves the last sequence number back when the device restarted its
+        numbering"""
+        if self._last_seqs.get(uid, 0) != seq:
+            self._last_seqs[uid] = seq
+            self._state_dirty = True
+
+    def flush(self):
+        """Flushes the store, then the last sequence numbers it covers"""
+        self.store.flush()
+        self.save_state()
+
+    def save_state(self):
+        """Writes the last sequence numbers to the `--state` file, only after
+        the frames they cover were flushed by the store"""
+        if self._state_path is None or not self._state_dirty:
+            return
+        tmp = self._state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._last_seqs, f)
+        os.replace(tmp, self._state_path)
+        self._state_dirty = False
+
+    def session_closed(self, session):
+        pass
+
+    async def start(self, host, port, backlog=1024):
+        loop = asyncio.get_running_loop()
+        if self.assist is not None:
+            await loop.run_in_executor(None, self.assist.refresh)
+        self._server = await loop.create_server(
+            lambda: DeviceSession(self), host, port, backlog=backlog,
+            reuse_address=True)
+        return self._server
+
+    def sockets(self):
+        return self._server.sockets
+
+    async def serve_forever(self, flush_interval=1.0):
+        async with self._server:
+            while True:
+                await asyncio.sleep(flush_interval)
+                self.flush()
+                if self.assist is not None and self.assist.stale():
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self.assist.refresh)
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        for task in list(self._lookups):
+            task.cancel()
+        self.store.close()
+        if self.cell_locator is not None:
+            self.cell_locator.close()
+        self.save_state()
+
+
+async def _main(args):
+    store = FileStore(args.out, args.cfg_out, args.log_dir, args.tim_out, args.position_out)
+    server = IngestServer(store, idle_timeout=args.idle_timeout,
+                          session_timeout=args.session_timeout,
+                          binary_tel=not args.text_only,
+                          compress=not args.no_compress, state_path=args.state,
+                          timing_interval=args.timing_interval,
+                          assist=AssistSource(args.assist_url) if args.assist_url else None,
+                          assist_interval=args.assist_interval,
+                          assist_hours=args.assist_hours,
+                          cell_locator=CellLocator(args.cell_db) if args.cell_db else None,
+                          verbose=args.verbose)
+    for r in args.request:
+        uid, _, req = r.partition(':')
+        server.queue_request(uid, req)
+    await server.start(args.host, args.port)
+    print('Listening on {}:{}'.format(args.host, args.port))
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
+        print(server.stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fleet ingestion server for the device protocol')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8883)
+    parser.add_argument('--out', default='telemetry.csv',
+                        help='file the @TEL frames are appended to')
+    parser.add_argument('--cfg-out', default='config_frames.csv',
+                        help='file the @CFG frames are appended to')
+    parser.add_argument('--log-dir', default='logs',
+                        help='directory for the device logs received with $LOG')
+    parser.add_argument('--tim-out', default='phase_times.csv',
+                        help='file the @TIM phase time summaries are appended to')
+    parser.add_argument('--timing-interval', type=float, default=TIMING_INTERVAL,
+                        help='seconds between $TIM requests to a device, 0 never')
+    parser.add_argument('--assist-url', default=None,
+                        help='EPO file to send to the devices with $AGP, '
+                             'e.g. http://127.0.0.1:8080/MTK7d.EPO (epo_server.py)')
+    parser.add_argument('--assist-interval', type=float, default=ASSIST_INTERVAL,
+                        help='seconds between $AGP requests to a device')
+    parser.add_argument('--assist-hours', type=int, default=ASSIST_HOURS,
+                        help='hours of EPO data sent with $AGP')
+    parser.add_argument('--cell-db', default=None,
+                        help='cell table of cell_locate.py, to resolve the cells '
+                             'of @TEL frames without a fix')
+    parser.add_argument('--position-out', default='cell_positions.csv',
+                        help='file the positions resolved from cells are appended to')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT)
+    parser.add_argument('--session-timeout', type=float,
+                        default=SESSION_TIMEOUT)
+    parser.add_argument('--request', action='append', default=[],
+                        metavar='UID:REQUEST',
+                        help="queue a request for a device, e.g. 240AC4C7C35C:'$LOG'")
+    parser.add_argument('--state', default=None,
+                        help='JSON file keeping the last @TEL sequence number '
+                             'of each device across restarts')
+    parser.add_argument('--text-only', action='store_true',
+                        help='always ask for text @TEL frames')
+    parser.add_argument('--no-compress', action='store_true',
+                        help='never ask for deflate compressed responses')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Shows which phases of the wake cycle dominate the awake time across the
+# fleet, from the @TIM summaries collected by ingest_server.py
+# (phase_times.csv, one line per summary: '{uid},{unix_time},{wakes},
+# {awake_avg},{awake_max},{name}:{avg}:{max},...').
+#
+# The latest summary of each device is used. Phase averages are weighted by
+# the number of wake cycles in each summary. Phases can overlap (e.g. the LTE
+# attach runs during the GPS fix), so their shares do not add up to 100%.
+#
+# Usage:
+#   python3 phase_report.py phase_times.csv
+#   python3 phase_report.py --device 240AC4C7C35C phase_times.csv
+#
+
+import argparse
+import csv
+
+
+def read_latest(path, device=None):
+    """Returns {uid: (wakes, awake_avg, awake_max, {name: (avg, max)})}"""
+    latest = {}
+    with open(path, 'r', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 5 or (device is not None and row[0] != device):
+                continue
+            uid, t = row[0], int(row[1])
+            wakes, awake_avg, awake_max = int(row[2]), int(row[3]), int(row[4])
+            phases = {}
+            for word in row[5:]:
+                name, avg, mx = word.split(':')
+                phases[name] = (int(avg), int(mx))
+            if uid not in latest or t >= latest[uid][0]:
+                latest[uid] = (t, (wakes, awake_avg, awake_max, phases))
+    return {uid: summary for uid, (_, summary) in latest.items()}
+
+
+def report(summaries):
+    wakes = sum(s[0] for s in summaries.values())
+    if not wakes:
+        print('no wake cycles')
+        return
+    awake = sum(s[0] * s[1] for s in summaries.values()) / wakes
+    print('{} devices, {} wake cycles, awake {:.0f} ms on average, {} ms at most'.format(
+        len(summaries), wakes, awake, max(s[2] for s in summaries.values())))
+
+    totals = {}  # name -> [weighted sum, wakes, max, devices]
+    for n, _, _, phases in summaries.values():
+        for name, (avg, mx) in phases.items():
+            t = totals.setdefault(name, [0, 0, 0, 0])
+            t[0] += avg * n
+            t[1] += n
+            t[2] = max(t[2], mx)
+            t[3] += 1
+    rows = sorted(((t[0] / t[1], name, t) for name, t in totals.items()),
+                  reverse=True)
+    print('{:<10} {:>9} {:>9} {:>7} {:>8}'.format(
+        'phase', 'avg [ms]', 'max [ms]', 'share', 'devices'))
+    for avg, name, t in rows:
+        print('{:<10} {:>9.0f} {:>9} {:>6.1f}% {:>8}'.format(
+            name, avg, t[2], 100.0 * avg / awake if awake else 0, t[3]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Summarize the wake cycle phase times of the fleet')
+    parser.add_argument('file', help='phase_times.csv of ingest_server.py')
+    parser.add_argument('--device', default=None, help='only this device uid')
+    args = parser.parse_args()
+    report(read_latest(args.file, args.device))
+
+
+if __name__ == '__main__':
+    main()
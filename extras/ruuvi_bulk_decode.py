@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+#
+# Decodes captured Ruuvi advertisement payloads in bulk with NumPy, for the
+# fleet analytics. The payloads are the manufacturer specific data, as hex,
+# one per line ('#' starts a comment), the same as for bench_ruuvi.py.
+#
+# The payloads are copied into one byte matrix and each data format is read
+# at once through a structured dtype with the layout of the format in
+# src/RuuviDecoder.py (FORMATS), then converted with array operations. The
+# result is columnar: one array per field, in the order of the input, with
+# NaN where the tag marks a field as not available or the field is not in
+# the format of that payload. Payloads of other formats have format 0.
+#
+# Requires NumPy (pip install numpy), which the firmware does not use.
+#
+# Usage:
+#   python3 ruuvi_bulk_decode.py payloads.txt --out columns.npz
+#   python3 ruuvi_bulk_decode.py --generate 1000000 --bench
+#
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit('ruuvi_bulk_decode.py needs NumPy: pip install numpy')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import sim  # noqa: E402
+
+MANUFACTURER_ID = 0x0499
+HEADER = [('manufacturer', '<u2'), ('format', 'u1')]
+
+# the same layouts as RuuviDecoder.FORMATS, after the header
+RAWV1 = np.dtype(HEADER + [
+    ('humidity', 'u1'), ('temp_int', 'u1'), ('temp_frac', 'u1'), ('pressure', '>u2'),
+    ('acceleration_x', '>i2'), ('acceleration_y', '>i2'), ('acceleration_z', '>i2'),
+    ('battery', '>u2')])
+RAWV2 = np.dtype(HEADER + [
+    ('temperature', '>i2'), ('humidity', '>u2'), ('pressure', '>u2'),
+    ('acceleration_x', '>i2'), ('acceleration_y', '>i2'), ('acceleration_z', '>i2'),
+    ('power', '>u2'), ('movement_counter', 'u1'), ('measurement_sequence', '>u2')])
+DTYPES = {3: RAWV1, 5: RAWV2}
+WIDTH = max(dtype.itemsize for dtype in DTYPES.values())
+
+COLUMNS = ('temperature', 'humidity', 'pressure', 'acceleration_x', 'acceleration_y',
+           'acceleration_z', 'battery_voltage', 'tx_power', 'movement_counter',
+           'measurement_sequence')
+
+
+def _check_layouts():
+    # the dtypes must stay in step with the firmware decoder
+    sim.install(sim.Device(tempfile.gettempdir()))  # ustruct, ubinascii
+    try:
+        from RuuviDecoder import FORMATS, HEADER_SIZE
+        for fmt, dtype in DTYPES.items():
+            if dtype.itemsize != HEADER_SIZE + struct.calcsize(FORMATS[fmt][0]):
+                raise AssertionError(
+                    'dtype of format {} does not match RuuviDecoder'.format(fmt))
+    finally:
+        sim.uninstall()
+
+
+def read_payloads(path):
+    payloads = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                payloads.append(bytes.fromhex(line))
+    return payloads
+
+
+def to_matrix(payloads):
+    """Returns the payloads as an (n, WIDTH) uint8 matrix, cut or padded,
+    and their lengths"""
+    lengths = np.fromiter((len(p) for p in payloads), dtype=np.int32, count=len(payloads))
+    buf = b''.join(p[:WIDTH].ljust(WIDTH, b'\0') for p in payloads)
+    return np.frombuffer(buf, dtype=np.uint8).reshape(len(payloads), WIDTH), lengths
+
+
+def _invalid(values, marker):
+    return np.where(values == marker, np.nan, values.astype(np.float64))
+
+
+def _decode_v1(r, out, rows):
+    temperature = (r['temp_int'] & 0x7F) + r['temp_frac'] / 100.0
+    out['temperature'][rows] = np.where(r['temp_int'] & 0x80, -temperature, temperature)
+    out['humidity'][rows] = r['humidity'] / 2.0
+    out['pressure'][rows] = r['pressure'] + 50000.0
+    for axis in ('acceleration_x', 'acceleration_y', 'acceleration_z'):
+        out[axis][rows] = r[axis]
+    out['battery_voltage'][rows] = r['battery']
+
+
+def _decode_v2(r, out, rows):
+    out['temperature'][rows] = _invalid(r['temperature'], -0x8000) * 0.005
+    out['humidity'][rows] = _invalid(r['humidity'], 0xFFFF) * 0.0025
+    out['pressure'][rows] = _invalid(r['pressure'], 0xFFFF) + 50000
+    for axis in ('acceleration_x', 'acceleration_y', 'acceleration_z'):
+        out[axis][rows] = r[axis]
+    # 11 bits battery voltage above 1600 mV, 5 bits tx power in 2 dBm steps from -40 dBm
+    out['battery_voltage'][rows] = _invalid(r['power'] >> 5, 0x7FF) + 1600
+    out['tx_power'][rows] = _invalid(r['power'] & 0x1F, 0x1F) * 2 - 40
+    out['movement_counter'][rows] = _invalid(r['movement_counter'], 0xFF)
+    out['measurement_sequence'][rows] = _invalid(r['measurement_sequence'], 0xFFFF)
+
+
+_DECODERS = {3: _decode_v1, 5: _decode_v2}
+
+
+def decode(payloads):
+    """Decodes a list of payloads into {column: array}, plus 'format'"""
+    matrix, lengths = to_matrix(payloads)
+    n = len(payloads)
+    manufacturer = matrix[:, 0].astype(np.uint16) | matrix[:, 1].astype(np.uint16) << 8
+    formats = np.where(manufacturer == MANUFACTURER_ID, matrix[:, 2], 0)
+    out = {name: np.full(n, np.nan) for name in COLUMNS}
+    out['format'] = np.zeros(n, dtype=np.uint8)
+    for fmt, dtype in DTYPES.items():
+        rows = np.flatnonzero((formats == fmt) & (lengths >= dtype.itemsize))
+        if not len(rows):
+            continue
+        records = np.ascontiguousarray(matrix[rows, :dtype.itemsize]).view(dtype).ravel()
+        _DECODERS[fmt](records, out, rows)
+        out['format'][rows] = fmt
+    return out
+
+
+def bench(payloads, columns, seconds):
+    """Times the scalar decoder of the firmware on the same payloads"""
+    sim.install(sim.Device(tempfile.gettempdir()))
+    try:
+        from RuuviDecoder import decode as decode_one
+        sample = payloads[:200000]
+        start = time.perf_counter()
+        decoded = [decode_one(p) for p in sample]
+        scalar = (time.perf_counter() - start) / len(sample)
+        mismatches = 0
+        for i, sensor in enumerate(decoded):
+            if sensor is None:
+                continue
+            t = columns['temperature'][i]
+            if sensor.temperature != '' and abs(sensor.temperature - t) > 1e-6:
+                mismatches += 1
+    finally:
+        sim.uninstall()
+    print('{:<10} {:>14} {:>12}'.format('decoder', 'payloads/s', 'us/payload'))
+    print('{:<10} {:>14.0f} {:>12.3f}'.format('scalar', 1 / scalar, scalar * 1e6))
+    vector = seconds / len(payloads)
+    print('{:<10} {:>14.0f} {:>12.3f}'.format('numpy', 1 / vector, vector * 1e6))
+    print('temperature mismatches in {} payloads: {}'.format(len(sample), mismatches))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Decode captured Ruuvi payloads in bulk into columns')
+    parser.add_argument('file', nargs='?', help='payloads as hex, one per line')
+    parser.add_argument('--generate', type=int, default=0, metavar='N',
+                        help='decode N generated payloads instead of a file')
+    parser.add_argument('--out', help='write the columns to this .npz file')
+    parser.add_argument('--bench', action='store_true',
+                        help='compare the throughput with the scalar decoder')
+    args = parser.parse_args()
+    if not args.file and not args.generate:
+        parser.error('give a file or --generate')
+
+    _check_layouts()
+    if args.file:
+        payloads = read_payloads(args.file)
+    else:
+        import bench_ruuvi
+        payloads = bench_ruuvi.generate(args.generate)
+
+    start = time.perf_counter()
+    columns = decode(payloads)
+    seconds = time.perf_counter() - start
+
+    counts = np.bincount(columns['format'], minlength=6)
+    print('{} payloads: {} RAWv1, {} RAWv2, {} other, decoded in {:.3f} s'.format(
+        len(payloads), counts[3], counts[5], len(payloads) - counts[3] - counts[5], seconds))
+    if args.out:
+        np.savez(args.out, **columns)
+    if args.bench:
+        bench(payloads, columns, seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#
+# Stand-in for the Quectel L76 GNSS driver (L76GNSV4.py). The first fix comes
+# `Device.gps_cold_fix` seconds after the wake up, or `Device.gps_hot_fix` when
+# the module was kept on during deep sleep.
+#
+# L76Device is the module itself on the I2C bus, for the PMTK sentences that
+# inject GPS assistance (GnssAssist): with a reference time and the EPO data
+# of the current 6 hours of enough satellites, a cold start gets the fix
+# `Device.gps_assisted_fix` seconds after the injection.
+#
+
+import datetime
+
+import sim
+
+POLL_TIME = 0.1  # reading and parsing a batch of NMEA sentences
+CMD_TIME = 0.005
+
+ASSIST_TIME_ERROR = 60  # seconds, an injected time further off does not help
+ASSIST_MIN_SATELLITES = 4
+_GPS_EPOCH = datetime.datetime(1980, 1, 6)
+_GPS_LEAP_SECONDS = 18
+
+
+def _gps_hour(utc):
+    return int((utc - _GPS_EPOCH).total_seconds() + _GPS_LEAP_SECONDS) // 3600
+
+
+class L76Device:
+    """What was injected since the module was powered on"""
+
+    def __init__(self, device):
+        self._device = device
+        self.sentences = 0
+        self.rejected = 0  # bad checksum or parameters, or an unknown command
+        self.clear()
+
+    def clear(self):
+        """The module lost power"""
+        self.time_ok = False
+        self.position = None
+        self.satellites = set()
+        self.assisted_at = None  # clock.now() when the assistance was complete
+
+    def write(self, reg, data):
+        raise OSError('I2C bus error')  # no registers
+
+    def writeto(self, data):
+        for line in bytes(data).decode('ascii').split('\r\n'):
+            if line:
+                self._sentence(line)
+
+    def _sentence(self, line):
+        self.sentences += 1
+        body, _, checksum = line[1:].partition('*')
+        cs = 0
+        for c in body:
+            cs ^= ord(c)
+        if line[0] != '$' or checksum != '{:02X}'.format(cs):
+            self.rejected += 1
+            return
+        words = body.split(',')
+        utc = datetime.datetime(*sim.utc_time(self._device))
+        try:
+            if words[0] == 'PMTK740' and len(words) == 7:
+                injected = datetime.datetime(*(int(w) for w in words[1:]))
+                self.time_ok = abs((injected - utc).total_seconds()) <= ASSIST_TIME_ERROR
+            elif words[0] == 'PMTK741' and len(words) == 10:
+                self.position = (float(words[1]), float(words[2]))
+            elif words[0] == 'PMTK721' and len(words) == 20:
+                start = int(words[2], 16) & 0xFFFFFF
+                if start <= _gps_hour(utc) < start + 6:
+                    self.satellites.add(int(words[1], 16))
+            else:
+                self.rejected += 1
+                return
+        except ValueError:
+            self.rejected += 1
+            return
+        if (self.assisted_at is None and self.time_ok
+                and len(self.satellites) >= ASSIST_MIN_SATELLITES):
+            self.assisted_at = self._device.clock.now()
+
+
+class L76GNSS:
+
+    def __init__(self, pytrack=None, sda='P22', scl='P21', timeout=None, debug=False):
+        self._device = sim.device
+        self._clock = sim.device.clock
+        self.timeout = timeout
+        self.fixed = False
+
+    def setAlwaysOn(self):
+        self._clock.sleep(CMD_TIME)
+
+    def setPeriodicMode(self, *args):
+        self._clock.sleep(CMD_TIME)
+
+    def _fix_time(self):
+        d = self._device
+        if d.gps_on:
+            return None if d.gps_hot_fix is None else d.wake_time + d.gps_hot_fix
+        fix_at = None if d.gps_cold_fix is None else d.wake_time + d.gps_cold_fix
+        assisted_at = d.l76.assisted_at
+        if assisted_at is not None and d.gps_assisted_fix is not None:
+            assisted_at += d.gps_assisted_fix
+            fix_at = assisted_at if fix_at is None else min(fix_at, assisted_at)
+        return fix_at
+
+    def get_fix(self, force=False, debug=False, timeout=None):
+        if self.fixed and not force:
+            return True
+        if timeout is None:
+            timeout = self.timeout
+        fix_at = self._fix_time()
+        give_up = self._clock.now() + timeout if timeout is not None else None
+        while fix_at is None or self._clock.now() < fix_at:
+            if give_up is not None and self._clock.now() >= give_up:
+                return False
+            self._clock.sleep(POLL_TIME)
+        self.fixed = True
+        return True
+
+    def coordinates(self, debug=False):
+        if not self.fixed:
+            return {'latitude': None, 'longitude': None}
+        lat, lng = self._device.position
+        return {'latitude': round(lat, 6), 'longitude': round(lng, 6)}
+
+    def get_speed(self):
+        if not self.fixed:
+            return {'speed': None, 'COG': None}
+        return {'speed': round(self._device.speed, 2), 'COG': round(self._device.cog, 2)}
+
+    def getUTCDateTime(self, debug=False):
+        if not (self.fixed or self._device.gps_on):
+            return None
+        return '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}+00:00'.format(
+            *sim.utc_time(self._device))
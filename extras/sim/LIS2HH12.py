@@ -0,0 +1,38 @@
+#
+# Stand-in for the LIS2HH12 accelerometer driver of pycom-libraries, reporting
+# `Device.acceleration`.
+#
+
+import math
+
+import sim
+
+READ_TIME = 0.001  # 6 bytes over I2C
+CONFIG_TIME = 0.002
+
+
+class LIS2HH12:
+
+    def __init__(self, pysense=None, sda='P22', scl='P21'):
+        self._device = sim.device
+        self._clock = sim.device.clock
+        self._clock.sleep(CONFIG_TIME)
+        self.activity_threshold = None
+        self.activity_duration = None
+
+    def acceleration(self):
+        self._clock.sleep(READ_TIME)
+        return self._device.acceleration
+
+    def roll(self):
+        x, y, z = self.acceleration()
+        return math.degrees(math.atan2(y, z))
+
+    def pitch(self):
+        x, y, z = self.acceleration()
+        return math.degrees(math.atan2(-x, math.sqrt(y * y + z * z)))
+
+    def enable_activity_interrupt(self, threshold, duration, handler=None):
+        self._clock.sleep(CONFIG_TIME)
+        self.activity_threshold = threshold
+        self.activity_duration = duration
@@ -0,0 +1,297 @@
+#
+# Host-side simulation of the GPy + Pytrack hardware, so the firmware in src/
+# (main.py included) runs unchanged under CPython.
+#
+# install() registers stand-ins for the MicroPython and Pycom modules the
+# firmware imports (machine, network, pycom, pytrack, pycoproc, L76GNSV4,
+# LIS2HH12, the u* aliases) in sys.modules, adds the MicroPython time functions
+# to `time`, and maps '/sd' and '/flash' to directories on the host. Everything
+# that is simulated (sensors, modem, GNSS, Ruuvi tags, clock) hangs off one
+# Device, whose fields describe the hardware and how long it takes to respond.
+#
+# The clock runs `scale` times faster than the host clock: sleeps and waits for
+# the simulated hardware are shortened by that factor, but so is the meaning of
+# the CPU time the firmware spends, so time the firmware logic with scale=1.
+# Deep sleep does not wait at all, it only moves the clock forward.
+#
+# A wake cycle ends with DeepSleep (Pytrack.go_to_sleep(), machine.deepsleep())
+# or Reset (machine.reset()). Both derive from BaseException so the firmware's
+# `except Exception` blocks let them through, like the real thing never returns.
+#
+# Usage:
+#   import sim
+#   device = sim.Device(sd_dir='/tmp/sd', scale=10)
+#   sim.install(device)
+#   device.boot()
+#   try:
+#       import main
+#   except sim.DeepSleep as sleep:
+#       device.wake_up(sleep)
+#
+
+import binascii
+import datetime
+import json
+import errno
+import os
+import socket
+import struct
+import sys
+import types
+
+import _thread
+
+from .clock import Clock
+from .sdcard import SDCard
+
+
+class DeepSleep(BaseException):
+
+    def __init__(self, seconds, gps_on=False):
+        BaseException.__init__(self, seconds)
+        self.seconds = seconds
+        self.gps_on = gps_on
+
+
+class Reset(BaseException):
+    pass
+
+
+# machine.reset_cause() values
+PWRON_RESET = 0
+HARD_RESET = 1
+WDT_RESET = 2
+DEEPSLEEP_RESET = 3
+SOFT_RESET = 4
+BROWN_OUT_RESET = 5
+
+# Pytrack.get_wake_reason() values
+WAKE_REASON_ACCELEROMETER = 1
+WAKE_REASON_PUSH_BUTTON = 2
+WAKE_REASON_TIMER = 4
+WAKE_REASON_INT_PIN = 8
+
+
+class RuuviTag:
+    """A Ruuvi tag advertising data format 5 (RAWv2) every `interval` seconds"""
+
+    def __init__(self, mac, temperature=4.0, humidity=55.0, pressure=100325,
+                 acceleration=(0, 0, 1000), battery_voltage=2950, tx_power=4,
+                 interval=1.0, rssi=-70):
+        self.mac = mac.upper()
+        self.temperature = temperature
+        self.humidity = humidity
+        self.pressure = pressure
+        self.acceleration = acceleration
+        self.battery_voltage = battery_voltage
+        self.tx_power = tx_power
+        self.interval = interval
+        self.rssi = rssi
+        self.movement_counter = 0
+        self.sequence = 0
+
+    def manufacturer_data(self):
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        power = ((self.battery_voltage - 1600) << 5) | ((self.tx_power + 40) // 2)
+        return b'\x99\x04' + struct.pack(
+            '>BhHHhhhHBH6s', 5, int(round(self.temperature / 0.005)),
+            int(round(self.humidity / 0.0025)), self.pressure - 50000,
+            self.acceleration[0], self.acceleration[1], self.acceleration[2],
+            power, self.movement_counter, self.sequence,
+            binascii.unhexlify(self.mac))
+
+
+class Device:
+    """The simulated hardware and its timing (seconds unless noted)"""
+
+    def __init__(self, sd_dir, flash_dir=None, scale=1.0):
+        self.clock = Clock(scale)
+        self.sd = SDCard(self, sd_dir, flash_dir)
+        self.uid = b'\x24\x0a\xc4\xc7\xc3\x5c'
+        self.imei = '354347090000000'
+        self.reset_cause = PWRON_RESET
+        self.wake_reason = WAKE_REASON_PUSH_BUTTON
+        self.battery_voltage = 4.1
+        self.date = (2020, 6, 5, 21, 0, 0)  # UTC at power on
+        self.boot_time = 0.9  # from the wake up until boot.py runs
+
+        # TMP117 temperatures by I2C address, a missing address has no sensor
+        self.tmp117 = {0x48: 4.0, 0x49: 5.0}
+        self.i2c_freq = 100000  # Hz
+        self.acceleration = (0.012, -0.008, 1.001)  # g
+
+        self.lte_attach = 8.0  # None never attaches
+        self.lte_band_attach = 3.0  # attach on the band of the cell
+        self.lte_band = 12  # band of the cell, an attach on another one fails
+        self.lte_cell = (302, 720, 0x1A2B, 215, 5110)  # MCC, MNC, TAC, Id, EARFCN
+        self.lte_neighbours = [(5110, 87, -104.5), (5110, 301, -109.0)]  # EARFCN, PCI, RSRP
+        self.lte_connect = 1.5
+        self.lte_attached = False  # still attached from the previous wake
+        self.lte_psm = False  # PSM requested with AT+CPSMS
+        self.lte_drop_after = None  # the network drops the registration after
+                                    # a deep sleep this long, None never
+        self.lte_connected = False  # sockets only connect during a data session
+        self.lte_rtt = 0.15  # round trip time of a TCP connect
+
+        self.gps_cold_fix = 30.0  # None never gets a fix
+        self.gps_hot_fix = 1.0  # when the GNSS was kept on during deep sleep
+        self.gps_assisted_fix = 10.0  # after injecting the assistance, None no help
+        self.gps_on = False
+        self.position = (43.762341, -79.324445)
+        self.speed = 0.0  # km/h
+        self.cog = 0.0
+
+        self.ruuvi_tags = []
+        self.ble_poll = 0.01  # time get_advertisements() takes
+
+        self.nvs = {}  # pycom.nvs_* storage, kept across deep sleep
+        self.sleep_seconds = 0
+        self.wake_time = 0.0  # clock.now() at the wake up
+        self._i2c = None
+        from .L76GNSV4 import L76Device
+        self.l76 = L76Device(self)
+
+    @property
+    def i2c(self):
+        if self._i2c is None:
+            from .i2c import I2CBus, TMP117Device
+            self._i2c = I2CBus(self)
+            for addr, temp in self.tmp117.items():
+                self._i2c.attach(addr, TMP117Device(self.clock, temp))
+            self._i2c.attach(0x10, self.l76)
+        return self._i2c
+
+    def boot(self):
+        """Starts a wake cycle, call before importing boot.py and main.py"""
+        self.wake_time = self.clock.now()
+        self.clock.reset_ticks()
+        self.clock.advance(self.boot_time)
+
+    def wake_up(self, sleep):
+        """Ends a deep sleep (DeepSleep caught by the caller)"""
+        self.clock.advance(sleep.seconds)
+        self.gps_on = sleep.gps_on
+        if not self.gps_on:
+            self.l76.clear()
+        self.lte_connected = False
+        if self.lte_drop_after is not None and sleep.seconds >= self.lte_drop_after:
+            self.lte_attached = False
+        self.reset_cause = DEEPSLEEP_RESET
+        self.wake_reason = WAKE_REASON_TIMER
+        self.sd.unmount()
+
+    def reset(self):
+        """Ends a machine.reset() (Reset caught by the caller)"""
+        self.gps_on = False
+        self.l76.clear()
+        self.lte_attached = False
+        self.lte_connected = False
+        self.reset_cause = SOFT_RESET
+        self.sd.unmount()
+
+
+def utc_time(dev):
+    """Returns (year, month, day, hour, minute, second) of the simulated UTC"""
+    t = datetime.datetime(*dev.date) + datetime.timedelta(seconds=dev.clock.now())
+    return t.timetuple()[:6]
+
+
+device = None  # the Device installed with install()
+
+_saved_modules = {}
+_saved_time = {}
+
+_STAND_INS = ('machine', 'network', 'pycom', 'pytrack', 'pycoproc', 'L76GNSV4',
+              'LIS2HH12')
+_ALIASES = {'ubinascii': binascii, 'ujson': json, 'uos': os, 'ustruct': struct}
+
+
+def _thread_module():
+    # the firmware asks for small task stacks; CPython needs at least 32 KB
+    m = types.ModuleType('_thread')
+    m.__dict__.update(_thread.__dict__)
+
+    def stack_size(size=0):
+        return _thread.stack_size(0 if 0 < size < 32768 else size)
+
+    m.stack_size = stack_size
+    return m
+
+
+def _socket_module():
+    # sockets of the firmware need an LTE data session
+    m = types.ModuleType('socket')
+    m.__dict__.update(socket.__dict__)
+
+    class SimSocket(socket.socket):
+
+        def connect(self, address):
+            if not device.lte_connected:
+                raise OSError(errno.ENETUNREACH, 'no LTE data session')
+            device.clock.sleep(device.lte_rtt)
+            socket.socket.connect(self, address)
+
+    m.socket = SimSocket
+    return m
+
+
+def _print_exception(ex, file=sys.stdout):
+    import traceback
+    traceback.print_exception(type(ex), ex, ex.__traceback__, file=file)
+
+
+def install(dev):
+    """Makes the firmware modules import the stand-ins backed by `dev`"""
+    global device
+    if device is not None:
+        uninstall()
+    device = dev
+    import time
+    clock = dev.clock
+    for name in ('sleep', 'sleep_ms', 'sleep_us', 'ticks_ms', 'ticks_us',
+                 'ticks_diff', 'ticks_add'):
+        _saved_time[name] = getattr(time, name, None)
+    time.sleep = clock.sleep
+    time.sleep_ms = clock.sleep_ms
+    time.sleep_us = clock.sleep_us
+    time.ticks_ms = clock.ticks_ms
+    time.ticks_us = clock.ticks_us
+    time.ticks_diff = clock.ticks_diff
+    time.ticks_add = clock.ticks_add
+    _saved_modules['sys.print_exception'] = getattr(sys, 'print_exception', None)
+    sys.print_exception = _print_exception
+
+    modules = dict(_ALIASES)
+    modules['utime'] = time
+    modules['_thread'] = _thread_module()
+    modules['socket'] = _socket_module()
+    for name in _STAND_INS:
+        modules[name] = __import__('sim.' + name, fromlist=[name])
+    for name, module in modules.items():
+        _saved_modules.setdefault(name, sys.modules.get(name))
+        sys.modules[name] = module
+    dev.sd.install()
+
+
+def uninstall():
+    global device
+    import time
+    if device is None:
+        return
+    device.sd.uninstall()
+    for name, fn in _saved_time.items():
+        if fn is None:
+            delattr(time, name)
+        else:
+            setattr(time, name, fn)
+    _saved_time.clear()
+    print_exception = _saved_modules.pop('sys.print_exception')
+    if print_exception is None:
+        del sys.print_exception
+    for name, module in _saved_modules.items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+    _saved_modules.clear()
+    device = None
@@ -0,0 +1,60 @@
+#
+# Simulated time: `scale` simulated seconds pass per host second, plus the
+# time skipped with advance() (deep sleep). Provides the MicroPython time
+# functions (sleep_ms, ticks_ms, ticks_diff, ...) on top of it.
+#
+
+import time
+
+_monotonic = time.monotonic
+_sleep = time.sleep
+
+TICKS_PERIOD = 1 << 30  # MicroPython ticks wrap around at 2^30
+
+
+class Clock:
+
+    def __init__(self, scale=1.0):
+        self.scale = float(scale)
+        self._start = _monotonic()
+        self._skipped = 0.0
+        self._ticks_start = 0.0
+
+    def now(self):
+        """Seconds since the device was powered on"""
+        return (_monotonic() - self._start) * self.scale + self._skipped
+
+    def reset_ticks(self):
+        # ticks count from the (re)boot
+        self._ticks_start = self.now()
+
+    def advance(self, seconds):
+        self._skipped += seconds
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _sleep(seconds / self.scale)
+
+    def sleep_until(self, t):
+        self.sleep(t - self.now())
+
+    def sleep_ms(self, ms):
+        self.sleep(ms / 1000.0)
+
+    def sleep_us(self, us):
+        self.sleep(us / 1000000.0)
+
+    def ticks_ms(self):
+        return int((self.now() - self._ticks_start) * 1000) % TICKS_PERIOD
+
+    def ticks_us(self):
+        return int((self.now() - self._ticks_start) * 1000000) % TICKS_PERIOD
+
+    @staticmethod
+    def ticks_diff(end, start):
+        d = (end - start) % TICKS_PERIOD
+        return d - TICKS_PERIOD if d >= TICKS_PERIOD // 2 else d
+
+    @staticmethod
+    def ticks_add(ticks, delta):
+        return (ticks + delta) % TICKS_PERIOD
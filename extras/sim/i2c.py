@@ -0,0 +1,194 @@
+#
+# Simulated I2C bus and the TMP117 temperature sensors on it.
+#
+# Every transfer takes as long as its bytes take on the wire (9 clocks per
+# byte, plus the address and register bytes). A read or write to an address
+# without a device raises OSError like the ESP32 driver.
+#
+# TMP117Device models the registers of the sensor (doc/tmp117.pdf): the
+# conversion modes, the conversion cycle and averaging times, the Data_Ready
+# and alert flags (cleared when the configuration register is read), the limit
+# and offset registers, and the soft reset. A sensor keeps converting while
+# the GPy is in deep sleep, so after waking up a result is usually ready.
+#
+
+import struct
+
+# active conversion time [s] for AVG = 0, 1, 2, 3 (no, 8, 32, 64 averages)
+_ACTIVE = (0.0155, 0.125, 0.5, 1.0)
+# conversion cycle time [s] for CONV = 0..7 (rows) and AVG = 0..3 (columns)
+_CYCLE = ((0.0155, 0.125, 0.5, 1.0),
+          (0.125, 0.125, 0.5, 1.0),
+          (0.25, 0.25, 0.5, 1.0),
+          (0.5, 0.5, 0.5, 1.0),
+          (1.0, 1.0, 1.0, 1.0),
+          (4.0, 4.0, 4.0, 4.0),
+          (8.0, 8.0, 8.0, 8.0),
+          (16.0, 16.0, 16.0, 16.0))
+
+_RESOLUTION = 0.0078125
+_CONFIG_RESET = 0x0220  # continuous conversion, 1 s cycle, 8 averages
+_CONFIG_WRITABLE = 0x0FFC  # MOD, CONV, AVG, T/nA, POL, DR/Alert
+_RESET_TIME = 0.002
+
+_HIGH_ALERT = 1 << 15
+_LOW_ALERT = 1 << 14
+_DATA_READY = 1 << 13
+_SOFT_RESET = 1 << 1
+_ALERT_MODE = 1 << 4
+
+MOD_CC = 0
+MOD_SD = 1
+MOD_OS = 3
+
+
+class I2CBus:
+
+    def __init__(self, device):
+        self._device = device
+        self._devices = {}
+        self.transfers = 0
+
+    def attach(self, addr, dev):
+        self._devices[addr] = dev
+
+    def scan(self):
+        # addresses each of 0x08..0x77 (start, address byte, stop) and
+        # returns the ones that acknowledged
+        probes = 0x78 - 0x08
+        self.transfers += probes
+        self._device.clock.sleep(probes * 2 * 9.0 / self._device.i2c_freq)
+        return sorted(self._devices)
+
+    def _transfer(self, addr, nbytes):
+        self.transfers += 1
+        self._device.clock.sleep((nbytes + 2) * 9.0 / self._device.i2c_freq)
+        dev = self._devices.get(addr)
+        if dev is None:
+            raise OSError('I2C bus error')
+        return dev
+
+    def readfrom_mem(self, addr, reg, nbytes):
+        return self._transfer(addr, nbytes).read(reg, nbytes)
+
+    def writeto_mem(self, addr, reg, data):
+        self._transfer(addr, len(data)).write(reg, bytes(data))
+
+    def writeto(self, addr, data):
+        # no register byte
+        self._transfer(addr, len(data) - 1).writeto(bytes(data))
+
+
+class TMP117Device:
+    """`temperature` is a number or a function of the simulated time"""
+
+    DEVICE_ID = 0x0117
+
+    def __init__(self, clock, temperature):
+        self._clock = clock
+        self.temperature = temperature
+        self.conversions = 0
+        self._reset(clock.now())
+
+    def _reset(self, now):
+        self._config = _CONFIG_RESET
+        self._flags = 0
+        self._high = 0x6000  # 192 C
+        self._low = 0x8000  # -256 C
+        self._offset = 0
+        self._result = 0x8000  # until the first conversion
+        self._start(now + _RESET_TIME)
+
+    def _start(self, t):
+        # conversions restart when the mode or the timing changes
+        self._conv_start = t
+        self._done = 0  # conversions since _conv_start
+        self._mode = (self._config >> 10) & 3
+        if self._mode == 2:
+            self._mode = MOD_CC
+
+    def _timing(self):
+        avg = (self._config >> 5) & 3
+        conv = (self._config >> 7) & 7
+        return _ACTIVE[avg], _CYCLE[conv][avg]
+
+    def _temp(self):
+        t = self.temperature
+        return t(self._clock.now()) if callable(t) else t
+
+    def _update(self):
+        now = self._clock.now()
+        if self._mode == MOD_SD or now < self._conv_start:
+            return
+        active, cycle = self._timing()
+        elapsed = now - self._conv_start - active
+        if elapsed < 0:
+            return
+        n = 1 if self._mode == MOD_OS else int(elapsed // cycle) + 1
+        if n > self._done:
+            self.conversions += n - self._done
+            self._done = n
+            self._convert()
+        if self._mode == MOD_OS:
+            # back to shutdown after a one-shot conversion
+            self._config = (self._config & ~0x0C00) | (MOD_SD << 10)
+            self._mode = MOD_SD
+
+    def _convert(self):
+        raw = int(round(self._temp() / _RESOLUTION)) + self._offset
+        self._result = max(-32768, min(32767, raw))
+        self._flags |= _DATA_READY
+        high = struct.unpack('>h', struct.pack('>H', self._high))[0]
+        low = struct.unpack('>h', struct.pack('>H', self._low))[0]
+        if self._config & _ALERT_MODE:
+            if self._result > high:
+                self._flags |= _HIGH_ALERT
+            if self._result < low:
+                self._flags |= _LOW_ALERT
+        else:
+            # therm mode: high flag with hysteresis, no low flag
+            if self._result > high:
+                self._flags |= _HIGH_ALERT
+            elif self._result < low:
+                self._flags &= ~_HIGH_ALERT
+
+    def read(self, reg, nbytes):
+        self._update()
+        if reg == 0x00:
+            value = self._result & 0xFFFF
+            self._flags &= ~_DATA_READY
+        elif reg == 0x01:
+            value = self._config | self._flags
+            if self._config & _ALERT_MODE:
+                self._flags = 0
+            else:
+                self._flags &= ~_DATA_READY
+        elif reg == 0x02:
+            value = self._high
+        elif reg == 0x03:
+            value = self._low
+        elif reg == 0x07:
+            value = self._offset & 0xFFFF
+        elif reg == 0x0F:
+            value = self.DEVICE_ID
+        else:
+            value = 0  # EEPROM registers
+        return struct.pack('>H', value)[:nbytes]
+
+    def write(self, reg, data):
+        self._update()
+        value = struct.unpack('>H', data[:2])[0]
+        if reg == 0x01:
+            if value & _SOFT_RESET:
+                self._reset(self._clock.now())
+                return
+            old = self._config
+            self._config = value & _CONFIG_WRITABLE
+            if (old ^ self._config) & 0x0FE0 or (value >> 10) & 3 == MOD_OS:
+                self._start(self._clock.now())
+        elif reg == 0x02:
+            self._high = value
+        elif reg == 0x03:
+            self._low = value
+        elif reg == 0x07:
+            self._offset = struct.unpack('>h', data[:2])[0]
@@ -0,0 +1,131 @@
+#
+# Stand-in for the Pycom `machine` module
+#
+
+import sim
+
+PWRON_RESET = sim.PWRON_RESET
+HARD_RESET = sim.HARD_RESET
+WDT_RESET = sim.WDT_RESET
+DEEPSLEEP_RESET = sim.DEEPSLEEP_RESET
+SOFT_RESET = sim.SOFT_RESET
+BROWN_OUT_RESET = sim.BROWN_OUT_RESET
+
+
+def unique_id():
+    return sim.device.uid
+
+
+def reset_cause():
+    return sim.device.reset_cause
+
+
+def idle():
+    pass
+
+
+def main(filename):
+    pass
+
+
+def reset():
+    raise sim.Reset()
+
+
+def deepsleep(ms=0):
+    raise sim.DeepSleep(ms / 1000.0, sim.device.gps_on)
+
+
+class Timer:
+
+    class Chrono:
+
+        def __init__(self):
+            self._clock = sim.device.clock
+            self._total = 0.0
+            self._started = None
+
+        def start(self):
+            if self._started is None:
+                self._started = self._clock.now()
+
+        def stop(self):
+            if self._started is not None:
+                self._total += self._clock.now() - self._started
+                self._started = None
+
+        def reset(self):
+            self._total = 0.0
+            if self._started is not None:
+                self._started = self._clock.now()
+
+        def read(self):
+            if self._started is None:
+                return self._total
+            return self._total + self._clock.now() - self._started
+
+        def read_ms(self):
+            return self.read() * 1000
+
+        def read_us(self):
+            return self.read() * 1000000
+
+
+class SD:
+
+    def __init__(self, id=0):
+        pass
+
+
+class Pin:
+
+    IN = 1
+    OUT = 2
+    OPEN_DRAIN = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+
+    def __init__(self, id, mode=IN, pull=None, value=None):
+        self.id = id
+        self._value = value or 0
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    def callback(self, trigger, handler=None, arg=None):
+        pass
+
+
+class I2C:
+    """All I2C(0) instances share the simulated bus, whatever their pins"""
+
+    MASTER = 0
+
+    def __init__(self, bus=0, mode=MASTER, pins=None, baudrate=100000):
+        self._bus = sim.device.i2c
+
+    def init(self, mode=MASTER, pins=None, baudrate=100000):
+        pass
+
+    def deinit(self):
+        pass
+
+    def scan(self):
+        return self._bus.scan()
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        return self._bus.readfrom_mem(addr, memaddr, nbytes)
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self._bus.writeto_mem(addr, memaddr, buf)
+
+    def writeto(self, addr, buf, stop=True):
+        self._bus.writeto(addr, buf)
+        return len(buf)
@@ -0,0 +1,219 @@
+#
+# Stand-ins for the LTE modem, Bluetooth, WLAN and Server of the `network`
+# module.
+#
+# LTE attaches `Device.lte_attach` seconds after attach(), or
+# `Device.lte_band_attach` with the band of the cell (never with another
+# band), and has a data session `Device.lte_connect` seconds after connect();
+# sockets then go out through the host network. Bluetooth receives one
+# advertisement from each of `Device.ruuvi_tags` every `RuuviTag.interval`
+# seconds while scanning, and calls the NEW_ADV_EVENT handler from its own
+# thread when one arrives.
+#
+
+import _thread
+import collections
+
+import sim
+
+LTE_INIT_TIME = 0.3  # LTE() with the modem in deep sleep
+AT_CMD_TIME = 0.05
+
+
+class LTE:
+
+    IP = 'IP'
+
+    def __init__(self, carrier=None, cid=1):
+        self._device = sim.device
+        self._clock = sim.device.clock
+        self._clock.sleep(LTE_INIT_TIME)
+        self._attach_at = 0.0 if self._device.lte_attached else None
+        self._connect_at = None
+
+    def send_at_cmd(self, cmd, delay=None):
+        self._clock.sleep(AT_CMD_TIME)
+        if cmd.startswith('AT+CGSN'):
+            return '\r\n+CGSN: "{}"\r\n\r\nOK\r\n'.format(self._device.imei)
+        if cmd.startswith('AT+CPSMS='):
+            self._device.lte_psm = cmd[9] == '1'
+        if cmd.startswith('AT+SQNMONI') and self.isattached():
+            lines = ['+SQNMONI: Sim Cc:{} Nc:{} RSRP:-98.20 CINR:0.00 RSRQ:-11.20 '
+                     'TAC:{} Id:{} EARFCN:{} PWR:-75.50 PAGING:128'.format(*self._device.lte_cell)]
+            for earfcn, pci, rsrp in self._device.lte_neighbours:
+                lines.append('+SQNMONI: RSRP:{:.2f} CINR:0.00 RSRQ:-14.00 Id:{} EARFCN:{}'.format(
+                    rsrp, pci, earfcn))
+            return '\r\n' + '\r\n'.join(lines) + '\r\n\r\nOK\r\n'
+        return '\r\nOK\r\n'
+
+    def attach(self, band=None, apn=None, cid=None, type=None, legacyattach=None):
+        if self._attach_at is not None:
+            return
+        if band is None:
+            seconds = self._device.lte_attach
+        elif band == self._device.lte_band:
+            seconds = self._device.lte_band_attach
+        else:
+            seconds = None
+        if seconds is not None:
+            self._attach_at = self._clock.now() + seconds
+
+    def isattached(self):
+        attached = (self._attach_at is not None
+                    and self._clock.now() >= self._attach_at)
+        self._device.lte_attached = attached
+        return attached
+
+    def detach(self, reset=False):
+        self._attach_at = None
+        self.disconnect()
+        self._device.lte_attached = False
+
+    def connect(self, cid=1):
+        if not self.isattached():
+            raise OSError('the modem is not attached')
+        if self._connect_at is None:
+            self._connect_at = self._clock.now() + self._device.lte_connect
+
+    def isconnected(self):
+        connected = (self._connect_at is not None
+                     and self._clock.now() >= self._connect_at)
+        self._device.lte_connected = connected
+        return connected
+
+    def disconnect(self):
+        self._connect_at = None
+        self._device.lte_connected = False
+
+    def deinit(self, detach=True, reset=False, dettach=None):
+        if detach:
+            self.detach()
+        self.disconnect()
+
+    def pppsuspend(self):
+        pass
+
+    def pppresume(self):
+        pass
+
+
+Advertisement = collections.namedtuple(
+    'Advertisement', ('mac', 'addr_type', 'adv_type', 'rssi', 'data'))
+
+
+class Bluetooth:
+
+    ADV_MANUFACTURER_DATA = 0xFF
+    CONN_ADV = 0
+    NEW_ADV_EVENT = 0x10
+
+    def __init__(self):
+        self._clock = sim.device.clock
+        self._tags = sim.device.ruuvi_tags
+        self._scan_start = None
+        self._seen = {}  # mac -> advertisements already received
+        self._pending = collections.deque()  # received, not yet read
+        self._handler = None
+        self._events = 0
+
+    def start_scan(self, timeout):
+        self._scan_start = self._clock.now()
+        self._seen = {}
+        self._pending.clear()
+        if self._handler is not None and self._tags:
+            _thread.start_new_thread(self._notify, (self._scan_start,))
+
+    def stop_scan(self):
+        self._scan_start = None
+
+    def isscanning(self):
+        return self._scan_start is not None
+
+    def _phase(self, i, tag):
+        # tags advertise out of step with each other
+        return tag.interval * (i + 1) / (len(self._tags) + 1)
+
+    def _receive(self):
+        """Queues the advertisements sent since the last call"""
+        if self._scan_start is None:
+            return
+        elapsed = self._clock.now() - self._scan_start
+        for i, tag in enumerate(self._tags):
+            phase = self._phase(i, tag)
+            sent = int((elapsed - phase) // tag.interval) + 1 if elapsed >= phase else 0
+            if sent > self._seen.get(tag.mac, 0):
+                self._seen[tag.mac] = sent
+                mac = bytes.fromhex(tag.mac)
+                # AD structures: flags, then the manufacturer specific data
+                data = tag.manufacturer_data()
+                raw = b'\x02\x01\x06' + bytes((len(data) + 1, 0xFF)) + data
+                self._pending.append(Advertisement(mac, 0, self.CONN_ADV, tag.rssi, raw))
+
+    def _notify(self, scan_start):
+        # calls the handler when the next advertisement is due, until the scan
+        # stops (or a new one starts)
+        while self._scan_start == scan_start and self._handler is not None:
+            elapsed = self._clock.now() - scan_start
+            due = None
+            for i, tag in enumerate(self._tags):
+                phase = self._phase(i, tag)
+                n = int((elapsed - phase) // tag.interval) + 1 if elapsed >= phase else 0
+                t = phase + n * tag.interval
+                due = t if due is None else min(due, t)
+            self._clock.sleep_until(scan_start + due + 0.0001)
+            handler = self._handler
+            if self._scan_start == scan_start and handler is not None:
+                self._events |= self.NEW_ADV_EVENT
+                handler(self)
+
+    def callback(self, trigger=None, handler=None, arg=None):
+        self._handler = handler if trigger and trigger & self.NEW_ADV_EVENT else None
+
+    def events(self):
+        events = self._events
+        self._events = 0
+        return events
+
+    def get_advertisements(self):
+        self._clock.sleep(sim.device.ble_poll)
+        self._receive()
+        advs = list(self._pending)
+        self._pending.clear()
+        return advs
+
+    def get_adv(self):
+        self._receive()
+        return self._pending.popleft() if self._pending else None
+
+    def resolve_adv_data(self, data, data_type):
+        i = 0
+        while i + 1 < len(data):
+            n = data[i]
+            if n == 0:
+                break
+            if data[i + 1] == data_type:
+                return data[i + 2:i + 1 + n]
+            i += n + 1
+        return None
+
+    def deinit(self):
+        self._scan_start = None
+        self._handler = None
+
+
+class WLAN:
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
+
+
+class Server:
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
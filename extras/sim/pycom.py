@@ -0,0 +1,44 @@
+#
+# Stand-in for the `pycom` module. The NVS (non-volatile storage) keys live in
+# the Device, so they survive deep sleep and resets like on the GPy.
+#
+
+import sim
+
+
+def heartbeat(state=None):
+    pass
+
+
+def rgbled(color):
+    pass
+
+
+def pybytes_on_boot(enable=None):
+    pass
+
+
+def nvs_set(key, value):
+    if not isinstance(value, int) or not 0 <= value < 1 << 32:
+        raise TypeError('value must be a 32-bit unsigned integer')
+    sim.device.nvs[key] = value
+
+
+def nvs_get(key, *default):
+    try:
+        return sim.device.nvs[key]
+    except KeyError:
+        if default:
+            return default[0]
+        raise ValueError('no such key')
+
+
+def nvs_erase(key):
+    try:
+        del sim.device.nvs[key]
+    except KeyError:
+        raise KeyError(key)
+
+
+def nvs_erase_all():
+    sim.device.nvs.clear()
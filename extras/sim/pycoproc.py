@@ -0,0 +1,15 @@
+#
+# Stand-in for pycoproc.py of pycom-libraries. main.py gets `os`, `machine`
+# and the wake reasons from `from pycoproc import *`.
+#
+
+import os  # noqa: F401
+import time  # noqa: F401
+
+import sim
+from sim import machine  # noqa: F401
+
+WAKE_REASON_ACCELEROMETER = sim.WAKE_REASON_ACCELEROMETER
+WAKE_REASON_PUSH_BUTTON = sim.WAKE_REASON_PUSH_BUTTON
+WAKE_REASON_TIMER = sim.WAKE_REASON_TIMER
+WAKE_REASON_INT_PIN = sim.WAKE_REASON_INT_PIN
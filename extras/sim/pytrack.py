@@ -0,0 +1,47 @@
+#
+# Stand-in for the Pytrack board (pytrack.py of pycom-libraries). The
+# coprocessor is reached over I2C, so each call takes a few milliseconds.
+#
+
+import sim
+from sim import machine
+
+COPROC_CALL_TIME = 0.003
+BATTERY_READ_TIME = 0.01  # ADC sampling on the coprocessor
+
+
+class Pytrack:
+
+    def __init__(self, i2c=None, sda='P22', scl='P21'):
+        self._device = sim.device
+        self._clock = sim.device.clock
+        self._clock.sleep(COPROC_CALL_TIME)
+        self.i2c = machine.I2C(0, pins=(sda, scl))  # shared with the L76
+        self.sleep_seconds = 0
+        self.wake_on_activity = False
+        self.wake_on_int_pin = False
+
+    def get_wake_reason(self):
+        self._clock.sleep(COPROC_CALL_TIME)
+        return self._device.wake_reason
+
+    def read_battery_voltage(self):
+        self._clock.sleep(BATTERY_READ_TIME)
+        return self._device.battery_voltage
+
+    def setup_sleep(self, time_s):
+        self._clock.sleep(COPROC_CALL_TIME)
+        self.sleep_seconds = time_s
+
+    def setup_int_wake_up(self, rising, falling):
+        self._clock.sleep(COPROC_CALL_TIME)
+        self.wake_on_activity = rising or falling
+
+    def setup_int_pin_wake_up(self, rising_edge=True):
+        self._clock.sleep(COPROC_CALL_TIME)
+        self.wake_on_int_pin = True
+
+    def go_to_sleep(self, gps=True):
+        self._clock.sleep(COPROC_CALL_TIME)
+        self._device.sleep_seconds = self.sleep_seconds
+        raise sim.DeepSleep(self.sleep_seconds, gps)
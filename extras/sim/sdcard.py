@@ -0,0 +1,89 @@
+#
+# The device filesystem on the host: '/sd' (after os.mount()) and '/flash' are
+# directories on the host, every other path is left alone. open() and the
+# os functions the firmware uses are wrapped while the simulation is installed.
+#
+
+import builtins
+import errno
+import os
+import tempfile
+
+_open = builtins.open
+_OS_FUNCS = ('listdir', 'stat', 'remove', 'rename', 'mkdir', 'rmdir')
+
+
+class SDCard:
+
+    def __init__(self, device, sd_dir, flash_dir=None):
+        self._device = device
+        self.sd_dir = sd_dir
+        self.flash_dir = flash_dir or tempfile.mkdtemp(prefix='flash')
+        self.mounted = False
+        self._saved = {}
+
+    def mount(self):
+        if self.mounted:
+            raise OSError(errno.EPERM, 'already mounted')
+        os.makedirs(self.sd_dir, exist_ok=True)
+        self.mounted = True
+
+    def unmount(self):
+        self.mounted = False
+
+    def host_path(self, path):
+        """Returns the host path of a device path, or None for other paths"""
+        if not isinstance(path, str):
+            return None
+        for root, host_dir in (('/sd', self.sd_dir), ('/flash', self.flash_dir)):
+            if path == root or path.startswith(root + '/'):
+                if root == '/sd' and not self.mounted:
+                    raise OSError(errno.ENOENT, 'No such file or directory', path)
+                return host_dir + path[len(root):]
+        return None
+
+    def _map(self, path):
+        host = self.host_path(path)
+        return path if host is None else host
+
+    def install(self):
+        saved = self._saved
+        saved['open'] = builtins.open
+        for name in _OS_FUNCS:
+            saved[name] = getattr(os, name)
+
+        def sim_open(file, *args, **kwargs):
+            return _open(self._map(file), *args, **kwargs)
+
+        def listdir(path='.'):
+            if path == '/':
+                return ['flash', 'sd'] if self.mounted else ['flash']
+            return saved['listdir'](self._map(path))
+
+        def mount(sd, path):
+            if path != '/sd':
+                raise OSError(errno.EINVAL, 'only /sd can be mounted')
+            self.mount()
+
+        def umount(path):
+            self.unmount()
+
+        builtins.open = sim_open
+        os.listdir = listdir
+        os.stat = lambda path, *a, **kw: saved['stat'](self._map(path), *a, **kw)
+        os.remove = lambda path: saved['remove'](self._map(path))
+        os.rename = lambda src, dst: saved['rename'](self._map(src), self._map(dst))
+        os.mkdir = lambda path, *a: saved['mkdir'](self._map(path), *a)
+        os.rmdir = lambda path: saved['rmdir'](self._map(path))
+        os.mount = mount
+        os.umount = umount
+
+    def uninstall(self):
+        if not self._saved:
+            return
+        builtins.open = self._saved.pop('open')
+        for name, fn in self._saved.items():
+            setattr(os, name, fn)
+        self._saved.clear()
+        del os.mount
+        del os.umount
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+#
+# Runs the firmware's wake cycle (src/boot.py + src/main.py) on the host with
+# the simulated hardware of the `sim` package, against an in-process
+# ingest_server.py, and reports how long each wake took.
+#
+# The SD card is a temporary directory (or --sd). Its config.json is written
+# with the server address of the local ingest server and any --set options.
+# Each cycle imports the firmware again, like a GPy waking from deep sleep, and
+# ends when the firmware calls Pytrack.go_to_sleep(); the simulated clock then
+# skips the sleep time. The phase times logged by main.py are printed too,
+# and at the end the summary of them that the device sends for `$TIM`.
+#
+# With --assist the ingest server also sends GPS assistance ($AGP), with EPO
+# data from an in-process epo_server.py, both on the simulated time; it is
+# used from the wake cycle after the first upload. Compare the `gps` phase
+# with and without it, e.g. with --set sleep_gps_on=0 so every fix is a cold
+# start.
+#
+# Awake time is in simulated seconds. CPU is the host CPU time of the main
+# thread, i.e. the firmware logic at host speed.
+#
+# Usage:
+#   python3 sim_run.py --cycles 5 --scale 10 --ruuvi DA68B8C24CC4
+#   python3 sim_run.py --lte-attach 20 --gps-fix none --set sleep_seconds=600
+#   python3 sim_run.py --cycles 6 --scale 20 --set sleep_gps_on=0 --assist
+#
+
+import argparse
+import asyncio
+import calendar
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+EXTRAS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(EXTRAS_DIR, '..', 'src'))
+sys.path.insert(0, SRC_DIR)
+
+import sim  # noqa: E402
+import epo_server  # noqa: E402
+from ingest_server import AssistSource, IngestServer, NullStore  # noqa: E402
+
+_thread_time = time.thread_time
+
+
+def _seconds(s):
+    return None if s.lower() == 'none' else float(s)
+
+
+def _config_value(s):
+    try:
+        return json.loads(s)
+    except ValueError:
+        return s
+
+
+def start_server(assist_url=None, clock=time.time):
+    """Starts an ingest server in a thread; with `assist_url` it sends $AGP
+    with the EPO data from there"""
+    assist = AssistSource(assist_url, clock=clock) if assist_url else None
+    server = IngestServer(NullStore(), assist=assist, clock=clock)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start('127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    return server, loop
+
+
+def purge_firmware():
+    """Forgets the imported firmware modules (and their singletons)"""
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None) or ''
+        if os.path.dirname(os.path.abspath(path)) == SRC_DIR:
+            del sys.modules[name]
+
+
+def read_new_log(sd_dir, offset):
+    path = os.path.join(sd_dir, 'log')
+    try:
+        with open(path, 'r') as f:
+            if os.path.getsize(path) < offset:
+                offset = 0  # rotated
+            f.seek(offset)
+            return f.read(), f.tell()
+    except OSError:
+        return '', 0
+
+
+def run_cycle(device):
+    """Runs one wake cycle, returns (awake seconds, CPU seconds, how it ended)"""
+    purge_firmware()
+    device.boot()
+    cpu = _thread_time()
+    end = None
+    try:
+        import boot  # noqa: F401
+        import main  # noqa: F401
+    except sim.DeepSleep as sleep:
+        end = sleep
+    except sim.Reset as reset:
+        end = reset
+    awake = device.clock.now() - device.wake_time
+    cpu = _thread_time() - cpu
+    if isinstance(end, sim.DeepSleep):
+        device.wake_up(end)
+    elif isinstance(end, sim.Reset):
+        device.reset()
+    return awake, cpu, end
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the firmware wake cycle on simulated hardware')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='simulated seconds per host second')
+    parser.add_argument('--sd', default=None,
+                        help='directory used as the SD card (kept afterwards)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='config.json entry, e.g. ruuvi_enabled=1')
+    parser.add_argument('--temps', default='4.0,5.0',
+                        help='temperatures of the TMP117 sensors at 0x48, 0x49, ...')
+    parser.add_argument('--lte-attach', type=_seconds, default=8.0,
+                        help="seconds until the modem is attached, 'none' never")
+    parser.add_argument('--lte-connect', type=_seconds, default=1.5)
+    parser.add_argument('--lte-drop', type=_seconds, default=None, metavar='SECONDS',
+                        help='the network drops the LTE registration after a deep sleep '
+                             'this long (with lte_psm)')
+    parser.add_argument('--gps-fix', type=_seconds, default=30.0,
+                        help="seconds until the first fix, 'none' never")
+    parser.add_argument('--gps-hot-fix', type=_seconds, default=1.0,
+                        help='seconds until a fix when the GNSS was kept on')
+    parser.add_argument('--gps-assisted-fix', type=_seconds, default=10.0,
+                        help="seconds until a fix after the GPS assistance was "
+                             "injected, 'none' it does not help")
+    parser.add_argument('--assist', action='store_true',
+                        help='send GPS assistance ($AGP) from a local EPO server')
+    parser.add_argument('--ruuvi', action='append', default=[], metavar='MAC',
+                        help='a Ruuvi tag advertising nearby (enables the scan)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print the whole device log')
+    args = parser.parse_args()
+
+    sd_dir = args.sd or tempfile.mkdtemp(prefix='sim_sd')
+    device = sim.Device(sd_dir, scale=args.scale)
+
+    def utc_now():
+        return calendar.timegm(sim.utc_time(device))
+
+    assist_url = None
+    if args.assist:
+        epo = epo_server.start_server(clock=utc_now)
+        assist_url = 'http://127.0.0.1:{}/MTK7d.EPO'.format(epo.server_address[1])
+    server, loop = start_server(assist_url, utc_now)
+    port = server.sockets()[0].getsockname()[1]
+
+    config_path = os.path.join(sd_dir, 'config.json')
+    config = {}
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+    config.update({'server_address': '127.0.0.1', 'server_port': port,
+                   'server_use_ssl': 0})
+    if args.ruuvi:
+        config['ruuvi_enabled'] = 1
+        config['ruuvi_mac'] = ';'.join(mac.upper() for mac in args.ruuvi)
+    for kv in args.set:
+        key, _, value = kv.partition('=')
+        config[key] = _config_value(value)
+    os.makedirs(sd_dir, exist_ok=True)
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+
+    device.tmp117 = {0x48 + i: float(t)
+                     for i, t in enumerate(args.temps.split(',')) if t}
+    device.lte_attach = args.lte_attach
+    device.lte_connect = args.lte_connect
+    device.lte_drop_after = args.lte_drop
+    device.gps_cold_fix = args.gps_fix
+    device.gps_hot_fix = args.gps_hot_fix
+    device.gps_assisted_fix = args.gps_assisted_fix
+    device.ruuvi_tags = [sim.RuuviTag(mac) for mac in args.ruuvi]
+
+    sim.install(device)
+    log_offset = read_new_log(sd_dir, 0)[1]
+    total_awake = 0.0
+    try:
+        for cycle in range(1, args.cycles + 1):
+            awake, cpu, end = run_cycle(device)
+            total_awake += awake
+            log, log_offset = read_new_log(sd_dir, log_offset)
+            print('cycle {}: awake {:.3f} s, CPU {:.1f} ms, {}'.format(
+                cycle, awake, cpu * 1000,
+                'deep sleep {} s'.format(end.seconds)
+                if isinstance(end, sim.DeepSleep) else 'reset'))
+            for line in log.splitlines():
+                if args.verbose:
+                    print('  ' + line)
+                elif '[E]' in line or 'Phases' in line or 'Awake' in line:
+                    print('  ' + line.split('> ', 1)[-1])
+        purge_firmware()
+        import PhaseTimer
+        device.sd.mount()
+        print('@TIM,{}'.format(PhaseTimer.summarize()))
+    finally:
+        sim.uninstall()
+        loop.call_soon_threadsafe(loop.stop)
+
+    print('average awake {:.3f} s'.format(total_awake / max(1, args.cycles)))
+    print(server.stats)
+    shutil.rmtree(device.sd.flash_dir, ignore_errors=True)
+    if args.sd is None:
+        shutil.rmtree(sd_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# Server side decoder for the binary @TEL records of protocol version 2 and 3.
+#
+# The layout must match src/TelRecord.py on the device. Decoded records can be
+# rendered back as a text @TEL frame, so the rest of the server tooling does
+# not need to care which encoding a device used.
+#
+
+import datetime
+import struct
+
+TEL_BINARY_MARKER = b'@TLB'
+SEQ_SIZE = 4  # uint32 sequence number before each record, protocol version 3
+
+RECORD_FORMAT = '<IIiiHHHhhhhhhhhhBB6shhhHhHHb'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+_RECORD = struct.Struct(RECORD_FORMAT)
+
+P_TIME = 0
+P_POS = 1
+P_COG = 2
+P_SPEED = 3
+P_BATT = 4
+P_ACC = 5
+P_ORIENT = 6
+P_TEMP_1 = 7
+P_EX_UID = 11
+P_EX_ACC = 12
+P_EX_HUM = 13
+P_EX_TEMP = 14
+P_EX_PRES = 15
+P_EX_BATT = 16
+P_EX_TX = 17
+
+F_ACC_ALERT = 0
+F_TEMP_ALERT = 1
+F_FIX_REUSED = 2
+F_SLEEP = 3  # bits 3 to 7
+
+SLEEP_REASONS = ('batt', 'moving', 'parked', 'temp', 'backlog')
+
+EPOCH_2000 = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+# column order of the text @TEL frame, see ServerUtil.create_tel_frame
+TEL_FIELDS = ('utc_datetime', 'lat', 'lng', 'cog', 'speed', 'battery_voltage',
+              'acc_activity_alert', 'acc_x', 'acc_y', 'acc_z', 'acc_roll',
+              'acc_pitch', 'temp_alert', 'temp_1', 'temp_2', 'temp_3', 'temp_4',
+              'ex_type', 'ex_uid', None, 'ex_acc_x', 'ex_acc_y', 'ex_acc_z',
+              'ex_humidity', 'ex_temp', 'ex_pressure', 'ex_battery_voltage',
+              'ex_tx_power', 'fix_age', 'cells', 'sleep')
+
+
+def record_size(data, offset=0):
+    """Size of the record starting at `offset` (after the marker)"""
+    return RECORD_SIZE
+
+
+def sequenced_record_size(data, offset=0):
+    """Size of the sequence number and the record starting at `offset`"""
+    return SEQ_SIZE + record_size(data, offset + SEQ_SIZE)
+
+
+def decode_seq(data, offset=0):
+    return struct.unpack_from('<I', data, offset)[0]
+
+
+def decode_record(data, offset=0):
+    """Decodes one binary record into a dict with the same keys as TEL_FIELDS,
+    plus 'fix_reused'. Values that were not present on the device are None;
+    a record only tells whether the fix was reused, not its fix_age, only
+    the reasons of the sleep, as ':{reason}+...', and never has cells (the
+    device sends those frames as text)."""
+    v = _RECORD.unpack_from(data, offset)
+    mask = v[0]
+
+    def has(bit):
+        return mask & (1 << bit)
+
+    r = dict.fromkeys(f for f in TEL_FIELDS if f is not None)
+    if has(P_TIME):
+        r['utc_datetime'] = EPOCH_2000 + datetime.timedelta(seconds=v[1])
+    if has(P_POS):
+        r['lat'] = v[2] / 1e7
+        r['lng'] = v[3] / 1e7
+    if has(P_COG):
+        r['cog'] = v[4] / 100
+    if has(P_SPEED):
+        r['speed'] = v[5] / 100
+    if has(P_BATT):
+        r['battery_voltage'] = v[6] / 1000
+    if has(P_ACC):
+        r['acc_x'], r['acc_y'], r['acc_z'] = (a / 1000 for a in v[7:10])
+    if has(P_ORIENT):
+        r['acc_roll'] = v[10] / 100
+        r['acc_pitch'] = v[11] / 100
+    for n in range(4):
+        if has(P_TEMP_1 + n):
+            r['temp_{}'.format(n + 1)] = v[12 + n] / 128
+    r['acc_activity_alert'] = (v[16] >> F_ACC_ALERT) & 1
+    r['temp_alert'] = (v[16] >> F_TEMP_ALERT) & 1
+    r['fix_reused'] = (v[16] >> F_FIX_REUSED) & 1
+    reasons = [name for n, name in enumerate(SLEEP_REASONS) if (v[16] >> (F_SLEEP + n)) & 1]
+    if reasons:
+        r['sleep'] = ':' + '+'.join(reasons)
+    r['ex_type'] = v[17]
+    if has(P_EX_UID):
+        r['ex_uid'] = v[18].hex().upper()
+    if has(P_EX_ACC):
+        r['ex_acc_x'], r['ex_acc_y'], r['ex_acc_z'] = v[19:22]
+    if has(P_EX_HUM):
+        r['ex_humidity'] = v[22] / 400
+    if has(P_EX_TEMP):
+        r['ex_temp'] = v[23] / 200
+    if has(P_EX_PRES):
+        r['ex_pressure'] = v[24] + 50000
+    if has(P_EX_BATT):
+        r['ex_battery_voltage'] = v[25]
+    if has(P_EX_TX):
+        r['ex_tx_power'] = v[26]
+    return r
+
+
+def _fmt(v):
+    if v is None:
+        return ''
+    if isinstance(v, datetime.datetime):
+        return v.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+    if isinstance(v, float):
+        return '{:.7f}'.format(v).rstrip('0').rstrip('.')
+    return str(v)
+
+
+def record_to_text(record):
+    """Renders a decoded record as a text @TEL frame"""
+    return '@TEL,{}\r\n'.format(','.join(
+        '' if f is None else _fmt(record[f]) for f in TEL_FIELDS))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+#
+# Coalesces many small writes to a socket into few larger sends.
+#
+
+
+class BatchWriter:
+    """Collects data in a fixed-size buffer and sends it with sendall() only
+    when the buffer is full or flush() is called, so frames of a few hundred
+    bytes do not each become their own TCP segment.
+
+    `bytes_sent` and `segments` count what was handed to the socket, to
+    compare the airtime of different transfer strategies.
+    """
+
+    def __init__(self, sock, size=1024):
+        self._sock = sock
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._len = 0
+        self.bytes_sent = 0
+        self.segments = 0
+
+    def write(self, data):
+        n = len(data)
+        if self._len + n > len(self._buf):
+            self.flush()
+        if n >= len(self._buf):
+            # larger than the whole buffer, no point in copying it
+            self._send(data)
+            return
+        self._buf[self._len:self._len + n] = data
+        self._len += n
+
+    def flush(self):
+        if self._len > 0:
+            self._send(self._view[:self._len])
+            self._len = 0
+
+    def _send(self, data):
+        self._sock.sendall(data)
+        self.bytes_sent += len(data)
+        self.segments += 1
@@ -36,11 +36,36 @@ class Config:
     temp_alert_enabled = 0  # 0=OFF, 1=ON
     temp_alert_low = -10.0
     temp_alert_high = 50.0
+    # sampling profile of the temperature sensors: 'fast', 'avg8', 'avg32',
+    # 'avg64' or 'alert' (see SensorsHandler.SAMPLING_PROFILES)
+    temp_profile = 'avg8'
     ota_server_address = 'trackensure.com'
     ota_server_port = 8884
     acc_alert_enabled = 0  # 0=OFF, 1=ON
     acc_alert_threshold = 200  # mg (mili g-force units)
     acc_alert_duration = 300  # milliseconds
+    # upload policy, see UploadPolicy. By default every wake cycle uploads.
+    upload_every = 1  # wake cycles
+    upload_queue_bytes = 0  # upload when this many bytes are queued, 0=OFF
+    upload_max_age = 0  # seconds since the last upload, 0=OFF
+    upload_on_alert = 1  # 0=OFF, 1=ON
+    # deadband filter, see Deadband. With both deltas 0 every frame is queued.
+    deadband_temp = 0.0  # degrees
+    deadband_distance = 0  # meters
+    deadband_heartbeat = 3600  # seconds, queue a frame at least this often
+    # LTE power saving mode, see LTEUtil: the modem stays registered during
+    # deep sleep and only resumes the data session when the device wakes up
+    lte_psm = 0  # 0=OFF, 1=ON
+    lte_psm_tau = 86400  # seconds, periodic tracking area update (T3412)
+    lte_psm_active = 2  # seconds the modem stays reachable before PSM (T3324)
+    lte_edrx = 0.0  # seconds, eDRX paging cycle, 0=OFF
+    # reuse the last GPS fix while the unit did not move, see LastFix
+    gps_reuse_max_age = 0  # seconds, 0=OFF
+    # adaptive sleep interval around sleep_seconds, see SleepScheduler
+    sleep_adaptive = 0  # 0=OFF, 1=ON
+    sleep_min_seconds = 30
+    sleep_max_seconds = 3600
+    sleep_batt_low = 3.5  # volts, the interval is stretched the most below it
 
     @staticmethod
     def get_instance():
@@ -122,6 +147,9 @@ class Config:
 
                 if 'temp_alert_enabled' in j:
                     self.temp_alert_enabled = j['temp_alert_enabled']
+
+                if 'temp_profile' in j:
+                    self.temp_profile = j['temp_profile']
                 
                 if 'acc_alert_enabled' in j:
                     self.acc_alert_enabled = j['acc_alert_enabled']
@@ -132,6 +160,54 @@ class Config:
                 if 'acc_alert_duration' in j:
                     self.acc_alert_duration = j['acc_alert_duration']
 
+                if 'upload_every' in j:
+                    self.upload_every = j['upload_every']
+
+                if 'upload_queue_bytes' in j:
+                    self.upload_queue_bytes = j['upload_queue_bytes']
+
+                if 'upload_max_age' in j:
+                    self.upload_max_age = j['upload_max_age']
+
+                if 'upload_on_alert' in j:
+                    self.upload_on_alert = j['upload_on_alert']
+
+                if 'deadband_temp' in j:
+                    self.deadband_temp = j['deadband_temp']
+
+                if 'deadband_distance' in j:
+                    self.deadband_distance = j['deadband_distance']
+
+                if 'deadband_heartbeat' in j:
+                    self.deadband_heartbeat = j['deadband_heartbeat']
+
+                if 'lte_psm' in j:
+                    self.lte_psm = j['lte_psm']
+
+                if 'lte_psm_tau' in j:
+                    self.lte_psm_tau = j['lte_psm_tau']
+
+                if 'lte_psm_active' in j:
+                    self.lte_psm_active = j['lte_psm_active']
+
+                if 'lte_edrx' in j:
+                    self.lte_edrx = j['lte_edrx']
+
+                if 'gps_reuse_max_age' in j:
+                    self.gps_reuse_max_age = j['gps_reuse_max_age']
+
+                if 'sleep_adaptive' in j:
+                    self.sleep_adaptive = j['sleep_adaptive']
+
+                if 'sleep_min_seconds' in j:
+                    self.sleep_min_seconds = j['sleep_min_seconds']
+
+                if 'sleep_max_seconds' in j:
+                    self.sleep_max_seconds = j['sleep_max_seconds']
+
+                if 'sleep_batt_low' in j:
+                    self.sleep_batt_low = j['sleep_batt_low']
+
                 self._config_file_loaded = True
         except Exception as ex:
             print('load_config_file ERROR:', ex)
@@ -147,39 +223,65 @@ class Config:
         s = s.strip()
         return int(s) if s else ""
 
+    def _mk_float(self, s):
+        s = s.strip()
+        return float(s) if s else ""
+
     def _mk_empty(self, s, config_val):
         if(s == ""):
             return config_val
         else:
             return s
 
+    def _mk_word(self, frame, i):
+        # the words at the end of the frame are optional
+        return frame[i] if len(frame) > i else ''
+
     def write_config_json(self, frame):
+        # '$WCF,{keep_alive},{log_level},...', the variables start at word 2
         frame_wcf = frame
         # print(frame_wcf)
         file_path = '/sd/{}'.format('config.json')
         if 'sd' in os.listdir('/'):
             with open(file_path, 'w') as f:
                 ujson.dump({
-                    'log_level': self._mk_empty(self._mk_int(frame_wcf[1]), self.log_level),
-                    'log_file_size': self._mk_empty(self._mk_int(frame_wcf[2]), self.log_file_size),
-                    'sleep_seconds': self._mk_empty(self._mk_int(frame_wcf[3]), self.sleep_seconds),
-                    'sleep_gps_on': self._mk_empty(self._mk_int(frame_wcf[4]), self.sleep_gps_on),
-                    'server_address': self._mk_empty(frame_wcf[5], self.server_address),
-                    'server_port': self._mk_empty(self._mk_int(frame_wcf[6]), self.server_port),
-                    'server_use_ssl': self._mk_empty(self._mk_int(frame_wcf[7]), self.server_use_ssl),
-                    'server_timeout': self._mk_empty(self._mk_int(frame_wcf[8]), self.server_timeout),
-                    'apn': self._mk_empty(frame_wcf[9], self.apn),
-                    'lte_timeout': self._mk_empty(self._mk_int(frame_wcf[10]), self.lte_timeout),
-                    'gps_timeout': self._mk_empty(self._mk_int(frame_wcf[11]), self.gps_timeout),
-                    'ruuvi_enabled': self._mk_empty(self._mk_int(frame_wcf[12]), self.ruuvi_enabled),
-                    'ruuvi_mac': self._mk_empty(frame_wcf[13], self.ruuvi_mac),
-                    'ruuvi_timeout': self._mk_empty(self._mk_int(frame_wcf[14]), self.ruuvi_timeout),
-                    'temp_alert_low': self._mk_empty(self._mk_int(frame_wcf[15]), self.temp_alert_low),
-                    'temp_alert_high': self._mk_empty(self._mk_int(frame_wcf[16]), self.temp_alert_high),
-                    'temp_alert_enabled': self._mk_empty(self._mk_int(frame_wcf[17]), self.temp_alert_enabled),
-                    'acc_alert_enabled': self._mk_empty(self._mk_int(frame_wcf[18]), self.acc_alert_enabled),
-                    'acc_alert_threshold': self._mk_empty(self._mk_int(frame_wcf[19]), self.acc_alert_threshold),
-                    'acc_alert_duration': self._mk_empty(self._mk_int(frame_wcf[20]), self.acc_alert_duration)}, f)
+                    'log_level': self._mk_empty(self._mk_int(frame_wcf[2]), self.log_level),
+                    'log_file_size': self._mk_empty(self._mk_int(frame_wcf[3]), self.log_file_size),
+                    'sleep_seconds': self._mk_empty(self._mk_int(frame_wcf[4]), self.sleep_seconds),
+                    'sleep_gps_on': self._mk_empty(self._mk_int(frame_wcf[5]), self.sleep_gps_on),
+                    'server_address': self._mk_empty(frame_wcf[6], self.server_address),
+                    'server_port': self._mk_empty(self._mk_int(frame_wcf[7]), self.server_port),
+                    'server_use_ssl': self._mk_empty(self._mk_int(frame_wcf[8]), self.server_use_ssl),
+                    'server_timeout': self._mk_empty(self._mk_int(frame_wcf[9]), self.server_timeout),
+                    'apn': self._mk_empty(frame_wcf[10], self.apn),
+                    'lte_timeout': self._mk_empty(self._mk_int(frame_wcf[11]), self.lte_timeout),
+                    'gps_timeout': self._mk_empty(self._mk_int(frame_wcf[12]), self.gps_timeout),
+                    'ruuvi_enabled': self._mk_empty(self._mk_int(frame_wcf[13]), self.ruuvi_enabled),
+                    'ruuvi_mac': self._mk_empty(frame_wcf[14], self.ruuvi_mac),
+                    'ruuvi_timeout': self._mk_empty(self._mk_int(frame_wcf[15]), self.ruuvi_timeout),
+                    'temp_alert_low': self._mk_empty(self._mk_int(frame_wcf[16]), self.temp_alert_low),
+                    'temp_alert_high': self._mk_empty(self._mk_int(frame_wcf[17]), self.temp_alert_high),
+                    'temp_alert_enabled': self._mk_empty(self._mk_int(frame_wcf[18]), self.temp_alert_enabled),
+                    'acc_alert_enabled': self._mk_empty(self._mk_int(frame_wcf[19]), self.acc_alert_enabled),
+                    'acc_alert_threshold': self._mk_empty(self._mk_int(frame_wcf[20]), self.acc_alert_threshold),
+                    'acc_alert_duration': self._mk_empty(self._mk_int(frame_wcf[21]), self.acc_alert_duration),
+                    'temp_profile': self._mk_empty(self._mk_word(frame_wcf, 22), self.temp_profile),
+                    'upload_every': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 23)), self.upload_every),
+                    'upload_queue_bytes': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 24)), self.upload_queue_bytes),
+                    'upload_max_age': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 25)), self.upload_max_age),
+                    'upload_on_alert': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 26)), self.upload_on_alert),
+                    'deadband_temp': self._mk_empty(self._mk_float(self._mk_word(frame_wcf, 27)), self.deadband_temp),
+                    'deadband_distance': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 28)), self.deadband_distance),
+                    'deadband_heartbeat': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 29)), self.deadband_heartbeat),
+                    'lte_psm': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 30)), self.lte_psm),
+                    'lte_psm_tau': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 31)), self.lte_psm_tau),
+                    'lte_psm_active': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 32)), self.lte_psm_active),
+                    'lte_edrx': self._mk_empty(self._mk_float(self._mk_word(frame_wcf, 33)), self.lte_edrx),
+                    'gps_reuse_max_age': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 34)), self.gps_reuse_max_age),
+                    'sleep_adaptive': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 35)), self.sleep_adaptive),
+                    'sleep_min_seconds': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 36)), self.sleep_min_seconds),
+                    'sleep_max_seconds': self._mk_empty(self._mk_int(self._mk_word(frame_wcf, 37)), self.sleep_max_seconds),
+                    'sleep_batt_low': self._mk_empty(self._mk_float(self._mk_word(frame_wcf, 38)), self.sleep_batt_low)}, f)
 
     def read_config_file(self):
 
@@ -203,6 +305,23 @@ class Config:
         acc_alert_enabled = self.acc_alert_enabled
         acc_alert_threshold = self.acc_alert_threshold
         acc_alert_duration = self.acc_alert_duration
+        temp_profile = self.temp_profile
+        upload_every = self.upload_every
+        upload_queue_bytes = self.upload_queue_bytes
+        upload_max_age = self.upload_max_age
+        upload_on_alert = self.upload_on_alert
+        deadband_temp = self.deadband_temp
+        deadband_distance = self.deadband_distance
+        deadband_heartbeat = self.deadband_heartbeat
+        lte_psm = self.lte_psm
+        lte_psm_tau = self.lte_psm_tau
+        lte_psm_active = self.lte_psm_active
+        lte_edrx = self.lte_edrx
+        gps_reuse_max_age = self.gps_reuse_max_age
+        sleep_adaptive = self.sleep_adaptive
+        sleep_min_seconds = self.sleep_min_seconds
+        sleep_max_seconds = self.sleep_max_seconds
+        sleep_batt_low = self.sleep_batt_low
 
         config_file = None
         if 'sd' in os.listdir('/') and 'config.json' in os.listdir('/sd'):
@@ -272,7 +391,58 @@ class Config:
             if 'acc_alert_duration' in j:
                 acc_alert_duration = j['acc_alert_duration']
 
-        frame = '@CFG,{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\r\n'.format(
+            if 'temp_profile' in j:
+                temp_profile = j['temp_profile']
+
+            if 'upload_every' in j:
+                upload_every = j['upload_every']
+
+            if 'upload_queue_bytes' in j:
+                upload_queue_bytes = j['upload_queue_bytes']
+
+            if 'upload_max_age' in j:
+                upload_max_age = j['upload_max_age']
+
+            if 'upload_on_alert' in j:
+                upload_on_alert = j['upload_on_alert']
+
+            if 'deadband_temp' in j:
+                deadband_temp = j['deadband_temp']
+
+            if 'deadband_distance' in j:
+                deadband_distance = j['deadband_distance']
+
+            if 'deadband_heartbeat' in j:
+                deadband_heartbeat = j['deadband_heartbeat']
+
+            if 'lte_psm' in j:
+                lte_psm = j['lte_psm']
+
+            if 'lte_psm_tau' in j:
+                lte_psm_tau = j['lte_psm_tau']
+
+            if 'lte_psm_active' in j:
+                lte_psm_active = j['lte_psm_active']
+
+            if 'lte_edrx' in j:
+                lte_edrx = j['lte_edrx']
+
+            if 'gps_reuse_max_age' in j:
+                gps_reuse_max_age = j['gps_reuse_max_age']
+
+            if 'sleep_adaptive' in j:
+                sleep_adaptive = j['sleep_adaptive']
+
+            if 'sleep_min_seconds' in j:
+                sleep_min_seconds = j['sleep_min_seconds']
+
+            if 'sleep_max_seconds' in j:
+                sleep_max_seconds = j['sleep_max_seconds']
+
+            if 'sleep_batt_low' in j:
+                sleep_batt_low = j['sleep_batt_low']
+
+        frame = '@CFG,{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\r\n'.format(
             log_level,
             log_file_size,
             sleep_seconds,
@@ -292,6 +462,23 @@ class Config:
             temp_alert_enabled,
             acc_alert_enabled,
             acc_alert_threshold,
-            acc_alert_duration)
+            acc_alert_duration,
+            temp_profile,
+            upload_every,
+            upload_queue_bytes,
+            upload_max_age,
+            upload_on_alert,
+            deadband_temp,
+            deadband_distance,
+            deadband_heartbeat,
+            lte_psm,
+            lte_psm_tau,
+            lte_psm_active,
+            lte_edrx,
+            gps_reuse_max_age,
+            sleep_adaptive,
+            sleep_min_seconds,
+            sleep_max_seconds,
+            sleep_batt_low)
 
         return frame
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Deadband filter for the @TEL frames: a new frame is only queued when a
+# temperature moved more than `deadband_temp` degrees or the position more
+# than `deadband_distance` meters from the last queued frame, or when the
+# last one was queued `deadband_heartbeat` seconds ago (see Config). Alerts,
+# a sensor that appears or disappears and any reset other than a deep sleep
+# always queue a frame. With both deltas 0 every frame is queued.
+#
+# The last queued values and the seconds since then are kept in NVS across
+# deep sleep. NVS only holds 32-bit unsigned integers, so the values are
+# stored fixed point with an offset, and 0 means empty.
+#
+
+import math
+
+import machine
+import pycom
+
+from NvsUtil import COORD_SCALE, TEMP_SCALE, decode, encode, nvs_get
+
+NVS_TEMP_KEYS = ('db_t1', 'db_t2', 'db_t3', 'db_t4')
+NVS_LAT_KEY = 'db_lat'
+NVS_LNG_KEY = 'db_lng'
+NVS_SECONDS_KEY = 'db_secs'
+
+EARTH_RADIUS_M = 6371000
+
+
+def _number(value):
+    return None if value is None or value == '' else float(value)
+
+
+def distance_m(lat1, lng1, lat2, lng2):
+    """Approximate distance between two positions, good for short distances"""
+    rad = math.pi / 180
+    x = (lng2 - lng1) * rad * math.cos((lat1 + lat2) / 2 * rad)
+    y = (lat2 - lat1) * rad
+    return math.sqrt(x * x + y * y) * EARTH_RADIUS_M
+
+
+class Deadband:
+
+    def __init__(self, config):
+        self._temp_delta = config.deadband_temp
+        self._distance = config.deadband_distance
+        self._heartbeat = config.deadband_heartbeat
+        self.enabled = bool(self._temp_delta or self._distance)
+        self.seconds = 0  # since the last queued frame
+        self._temps = None  # last queued temperatures, None if unknown
+        self._position = (None, None)
+        if self.enabled:
+            self.seconds = nvs_get(NVS_SECONDS_KEY, None)
+            if self.seconds is not None:
+                self._temps = [decode(nvs_get(k), TEMP_SCALE) for k in NVS_TEMP_KEYS]
+                self._position = (decode(nvs_get(NVS_LAT_KEY), COORD_SCALE),
+                                  decode(nvs_get(NVS_LNG_KEY), COORD_SCALE))
+            else:
+                self.seconds = 0
+        self._new = None  # values of this wake cycle, see check()
+
+    def check(self, reset_cause, alert, temps, position):
+        """Returns why the frame with `temps` (4 strings, empty for a missing
+        sensor) and `position` should be queued, or None to drop it"""
+        temps = [_number(t) for t in temps]
+        self._new = (temps, position)
+        if not self.enabled:
+            return 'off'
+        if reset_cause != machine.DEEPSLEEP_RESET or self._temps is None:
+            return 'reset'
+        if alert:
+            return 'alert'
+        if self._heartbeat and self.seconds >= self._heartbeat:
+            return 'heartbeat'
+        for t, last in zip(temps, self._temps):
+            if (t is None) != (last is None):
+                return 'sensors'
+            if self._temp_delta and t is not None and abs(t - last) > self._temp_delta:
+                return 'temp'
+        lat, lng = _number(position.lat), _number(position.lng)
+        last_lat, last_lng = self._position
+        if self._distance and lat is not None and lng is not None:
+            if last_lat is None or last_lng is None:
+                return 'position'  # first fix since the last frame
+            if distance_m(last_lat, last_lng, lat, lng) > self._distance:
+                return 'position'
+        return None
+
+    def save(self, queued, awake_ms, sleep_seconds):
+        """Records this wake cycle in NVS, before the deep sleep"""
+        if not self.enabled:
+            return
+        if queued and self._new is not None:
+            temps, position = self._new
+            for key, t in zip(NVS_TEMP_KEYS, temps):
+                pycom.nvs_set(key, encode(t, TEMP_SCALE))
+            pycom.nvs_set(NVS_LAT_KEY, encode(position.lat, COORD_SCALE))
+            pycom.nvs_set(NVS_LNG_KEY, encode(position.lng, COORD_SCALE))
+            self.seconds = sleep_seconds
+        else:
+            self.seconds += awake_ms // 1000 + sleep_seconds
+        pycom.nvs_set(NVS_SECONDS_KEY, self.seconds)
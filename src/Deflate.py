@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+#
+# Raw deflate (RFC 1951) compression of server responses.
+#
+# The compressed stream is sent in blocks of up to BLOCK_SIZE bytes, each
+# prefixed with its length as a little-endian uint16; a zero-length block ends
+# the stream. The server inflates it with a raw deflate decoder (e.g. Python's
+# zlib with wbits=-15).
+#
+# MicroPython 1.21 and newer have a native compressor (the `deflate` module);
+# older firmware, like the current Pycom releases, only has uzlib for
+# decompression, so a small LZ77 compressor with the fixed Huffman codes of
+# deflate is used instead. The window is 2^wbits bytes for both.
+#
+
+import struct
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+DEFAULT_WBITS = 10  # 1 KB window
+BLOCK_SIZE = 512  # bytes of compressed data per block on the wire
+
+_HASH_BITS = 12
+_MAX_CHAIN = 8  # candidates tried per position
+_MIN_MATCH = 3
+_MAX_MATCH = 258
+
+# base values and extra bits of the length codes 257-285 and distance codes 0-29
+_LEN_BASE = (3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31, 35, 43,
+             51, 59, 67, 83, 99, 115, 131, 163, 195, 227, 258)
+_LEN_EXTRA = (0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4,
+              4, 4, 5, 5, 5, 5, 0)
+_DIST_BASE = (1, 2, 3, 4, 5, 7, 9, 13, 17, 25, 33, 49, 65, 97, 129, 193, 257,
+              385, 513, 769, 1025, 1537, 2049, 3073, 4097, 6145, 8193, 12289,
+              16385, 24577)
+_DIST_EXTRA = (0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 8, 9, 9,
+               10, 10, 11, 11, 12, 12, 13, 13)
+
+
+def _reverse(code, n):
+    # Huffman codes are packed starting with their most significant bit
+    r = 0
+    for _ in range(n):
+        r = (r << 1) | (code & 1)
+        code >>= 1
+    return r
+
+
+def _fixed_code(sym):
+    """Returns (bit-reversed code, number of bits) of a literal/length symbol"""
+    if sym < 144:
+        return _reverse(0x30 + sym, 8), 8
+    if sym < 256:
+        return _reverse(0x190 + sym - 144, 9), 9
+    if sym < 280:
+        return _reverse(sym - 256, 7), 7
+    return _reverse(0xC0 + sym - 280, 8), 8
+
+
+_SYM_CODE = [_fixed_code(s)[0] for s in range(286)]
+_SYM_BITS = bytes(_fixed_code(s)[1] for s in range(286))
+_DIST_CODE = [_reverse(d, 5) for d in range(30)]
+# length code index (0-28) for each match length
+_LEN_INDEX = bytearray(_MAX_MATCH + 1)
+for _i in range(len(_LEN_BASE) - 1):
+    for _l in range(_LEN_BASE[_i], _LEN_BASE[_i + 1]):
+        _LEN_INDEX[_l] = _i
+_LEN_INDEX[_MAX_MATCH] = len(_LEN_BASE) - 1
+
+
+class _BlockSink:
+    """Collects compressed bytes and writes them as length-prefixed blocks"""
+
+    def __init__(self, sink, size):
+        self._sink = sink
+        self._buf = bytearray()
+        self._size = size
+        self.bytes_out = 0
+
+    def write(self, data):
+        self._buf.extend(data)
+        while len(self._buf) >= self._size:
+            self._emit(self._size)
+        return len(data)
+
+    def _emit(self, n):
+        block = self._buf[:n]
+        self._buf = self._buf[n:]
+        self._sink.write(struct.pack('<H', n))
+        self._sink.write(block)
+        self.bytes_out += 2 + n
+
+    def close(self):
+        if self._buf:
+            self._emit(len(self._buf))
+        self._sink.write(b'\x00\x00')  # end of the compressed stream
+        self.bytes_out += 2
+
+
+class _FixedHuffmanCompressor:
+    """Greedy LZ77 over hash chains of up to _MAX_CHAIN candidates, written as
+    a single deflate block with the fixed Huffman codes"""
+
+    def __init__(self, out, wbits):
+        self._out = out
+        self._window = 1 << wbits
+        self._buf = bytearray()  # up to one window of history + the new data
+        self._base = 0  # stream position of self._buf[0]
+        self._head = [-1] * (1 << _HASH_BITS)  # hash -> last stream position
+        self._prev = [-1] * self._window  # position -> previous one, same hash
+        self._bits = 0
+        self._nbits = 0
+        self._pending = bytearray()
+        self._put(1, 1)  # BFINAL, the whole stream is one block
+        self._put(1, 2)  # BTYPE = fixed Huffman codes
+
+    def _put(self, value, n):
+        self._bits |= value << self._nbits
+        self._nbits += n
+        while self._nbits >= 8:
+            self._pending.append(self._bits & 0xFF)
+            self._bits >>= 8
+            self._nbits -= 8
+
+    def _put_sym(self, sym):
+        self._put(_SYM_CODE[sym], _SYM_BITS[sym])
+
+    def _put_match(self, length, dist):
+        i = _LEN_INDEX[length]
+        self._put_sym(257 + i)
+        if _LEN_EXTRA[i]:
+            self._put(length - _LEN_BASE[i], _LEN_EXTRA[i])
+        d = 0
+        while d < 29 and _DIST_BASE[d + 1] <= dist:
+            d += 1
+        self._put(_DIST_CODE[d], 5)
+        if _DIST_EXTRA[d]:
+            self._put(dist - _DIST_BASE[d], _DIST_EXTRA[d])
+
+    def write(self, data):
+        buf = self._buf
+        i = len(buf)
+        buf.extend(data)
+        n = len(buf)
+        base = self._base
+        head = self._head
+        prev = self._prev
+        window = self._window
+        wmask = window - 1
+        mask = (1 << _HASH_BITS) - 1
+        while i < n:
+            if i + _MIN_MATCH > n:
+                self._put_sym(buf[i])
+                i += 1
+                continue
+            h = ((buf[i] << 8) ^ (buf[i + 1] << 4) ^ buf[i + 2]) & mask
+            pos = head[h]
+            head[h] = base + i
+            prev[(base + i) & wmask] = pos
+            limit = min(_MAX_MATCH, n - i)
+            length = 0
+            dist = 0
+            chain = _MAX_CHAIN
+            while chain and pos >= base and base + i - pos <= window:
+                cand = pos - base
+                k = 0
+                while k < limit and buf[cand + k] == buf[i + k]:
+                    k += 1
+                if k > length:
+                    length = k
+                    dist = i - cand
+                    if k == limit:
+                        break
+                pos = prev[pos & wmask]
+                chain -= 1
+            if length < _MIN_MATCH:
+                self._put_sym(buf[i])
+                i += 1
+                continue
+            self._put_match(length, dist)
+            # index the positions inside the match too
+            end = i + length
+            stop = min(end, n - _MIN_MATCH + 1)
+            i += 1
+            while i < stop:
+                h = ((buf[i] << 8) ^ (buf[i + 1] << 4) ^ buf[i + 2]) & mask
+                prev[(base + i) & wmask] = head[h]
+                head[h] = base + i
+                i += 1
+            i = end
+        if n > window:
+            self._buf = buf[n - window:]
+            self._base = base + n - window
+        self._flush_pending()
+
+    def _flush_pending(self):
+        if self._pending:
+            self._out.write(self._pending)
+            self._pending = bytearray()
+
+    def close(self):
+        self._put_sym(256)  # end of block
+        if self._nbits:
+            self._put(0, 8 - self._nbits)
+        self._flush_pending()
+
+
+class DeflateWriter:
+    """Compresses everything written to it into length-prefixed blocks on
+    `sink` (anything with write(), e.g. a BatchWriter). close() must be called
+    to finish the stream.
+
+    `bytes_in` and `bytes_out` count the data before and after compression.
+    """
+
+    def __init__(self, sink, wbits=DEFAULT_WBITS, block_size=BLOCK_SIZE):
+        self._blocks = _BlockSink(sink, block_size)
+        if deflate is not None:
+            self._stream = deflate.DeflateIO(self._blocks, deflate.RAW, wbits)
+        else:
+            self._stream = _FixedHuffmanCompressor(self._blocks, wbits)
+        self.bytes_in = 0
+
+    @property
+    def bytes_out(self):
+        return self._blocks.bytes_out
+
+    def write(self, data):
+        self._stream.write(data)
+        self.bytes_in += len(data)
+
+    def close(self):
+        self._stream.close()
+        self._blocks.close()
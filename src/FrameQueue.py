@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#
+# Persistent FIFO of telemetry frames on the SD card.
+#
+# Frames are appended to numbered segment files ('seg0', 'seg1', ...) of about
+# SEGMENT_SIZE bytes each. A small index records where the oldest unsent frame
+# starts (head segment + offset), the segment that is being appended to (tail),
+# the number of queued frames and the sequence number of the next frame.
+# Appending only touches the tail segment and the index, reading streams one
+# frame at a time, and committing sent frames moves the head forward and
+# deletes the segments that were fully consumed.
+#
+# The index is written alternately to 'index0' and 'index1' with an increasing
+# generation number, so a power loss while writing it leaves the previous one
+# intact. Without an index, next_seq continues after the highest sequence
+# number in the segment files; with no frames left it restarts at 1, and the
+# server learns it from the heartbeat (see ServerUtil.create_heartbeat_frame).
+#
+
+import os
+
+SEGMENT_SIZE = 16384  # bytes
+
+
+class FrameQueue:
+
+    def __init__(self, root='/sd/queue', segment_size=SEGMENT_SIZE):
+        self._root = root
+        self._segment_size = segment_size
+        parent, name = root.rsplit('/', 1)
+        if name not in os.listdir(parent or '/'):
+            os.mkdir(root)
+
+        self._gen = 0
+        self._head_seg = 0
+        self._head_off = 0
+        self._tail_seg = 0
+        self._tail_size = 0
+        self._count = 0
+        self.next_seq = 1  # sequence number for the next frame (read only)
+        self._tail_checked = False
+        if not self._load_index():
+            self._rebuild_index()
+
+    def __len__(self):
+        return self._count
+
+    def _seg_path(self, seg):
+        return '{}/seg{}'.format(self._root, seg)
+
+    def _segments(self):
+        return sorted(int(f[3:]) for f in os.listdir(self._root)
+                      if f.startswith('seg'))
+
+    def _load_index(self):
+        best = None
+        for slot in (0, 1):
+            try:
+                with open('{}/index{}'.format(self._root, slot), 'r') as f:
+                    line = f.read()
+                if not line.endswith('\n'):
+                    continue  # incomplete write
+                v = [int(x) for x in line.split()]
+                if len(v) == 6:
+                    v.append(1)  # index written before sequence numbers
+                if len(v) == 7 and (best is None or v[0] > best[0]):
+                    best = v
+            except (OSError, ValueError):
+                pass
+        if best is None:
+            return False
+        (self._gen, self._head_seg, self._head_off, self._tail_seg,
+         self._tail_size, self._count, self.next_seq) = best
+        return True
+
+    def _save_index(self):
+        self._gen += 1
+        with open('{}/index{}'.format(self._root, self._gen % 2), 'w') as f:
+            f.write('{} {} {} {} {} {} {}\n'.format(
+                self._gen, self._head_seg, self._head_off, self._tail_seg,
+                self._tail_size, self._count, self.next_seq))
+
+    def _rebuild_index(self):
+        """Recovers the queue from the segment files when there is no index.
+        Frames that were already committed are queued again, and next_seq
+        follows the highest sequence number ('@TEL,{seq},...') found."""
+        segs = self._segments()
+        if segs:
+            self._head_seg = segs[0]
+            self._tail_seg = segs[-1]
+            self._tail_size = os.stat(self._seg_path(self._tail_seg))[6]
+            self._count = 0
+            for frame, _ in self.frames():
+                self._count += 1
+                words = frame.split(b',', 2)
+                if len(words) > 2 and words[1].isdigit():
+                    self.next_seq = max(self.next_seq, int(words[1]) + 1)
+        self._save_index()
+
+    def append(self, frame):
+        """Appends one frame (bytes or str, terminated with '\\r\\n') and
+        increments next_seq. The caller puts next_seq in the frame if needed."""
+        if isinstance(frame, str):
+            frame = frame.encode('ascii')
+        if not self._tail_checked:
+            # A frame written without updating the index (power loss) would
+            # be overwritten by the next one, so start a new segment instead.
+            self._tail_checked = True
+            try:
+                if os.stat(self._seg_path(self._tail_seg))[6] != self._tail_size:
+                    self._tail_seg += 1
+                    self._tail_size = 0
+            except OSError:
+                pass
+        if self._tail_size >= self._segment_size:
+            self._tail_seg += 1
+            self._tail_size = 0
+        with open(self._seg_path(self._tail_seg), 'ab') as f:
+            f.write(frame)
+        self._tail_size += len(frame)
+        self._count += 1
+        self.next_seq += 1
+        self._save_index()
+
+    def frames(self):
+        """Yields `(frame, cursor)` for every queued frame, oldest first, reading
+        one frame at a time. Passing a cursor to commit() removes that frame and
+        all the frames before it from the queue."""
+        seg = self._head_seg
+        off = self._head_off
+        n = 0
+        while seg <= self._tail_seg:
+            try:
+                f = open(self._seg_path(seg), 'rb')
+            except OSError:
+                seg += 1
+                off = 0
+                continue
+            with f:
+                if off:
+                    f.seek(off)
+                while True:
+                    line = f.readline()
+                    if not line or line[-1:] != b'\n':
+                        break  # end of segment, or a frame cut by a power loss
+                    off += len(line)
+                    n += 1
+                    yield line, (seg, off, n)
+            seg += 1
+            off = 0
+
+    def commit(self, cursor):
+        """Removes all the frames up to and including the one at `cursor`"""
+        seg, off, n = cursor
+        for s in range(self._head_seg, seg):
+            self._remove_segment(s)
+        self._head_seg = seg
+        self._head_off = off
+        self._count = max(0, self._count - n)
+
+        if seg < self._tail_seg:
+            if off >= os.stat(self._seg_path(seg))[6]:
+                self._remove_segment(seg)
+                self._head_seg = seg + 1
+                self._head_off = 0
+        elif off >= self._tail_size:
+            # everything was sent, start over with an empty tail segment
+            self._remove_segment(seg)
+            self._head_seg = self._tail_seg = seg + 1
+            self._head_off = self._tail_size = 0
+            self._count = 0
+        self._save_index()
+
+    def queued_bytes(self):
+        total = -self._head_off
+        for seg in range(self._head_seg, self._tail_seg + 1):
+            try:
+                total += os.stat(self._seg_path(seg))[6]
+            except OSError:
+                pass
+        return max(0, total)
+
+    def clear(self):
+        for seg in self._segments():
+            self._remove_segment(seg)
+        self._head_seg = self._tail_seg = self._tail_seg + 1
+        self._head_off = self._tail_size = 0
+        self._count = 0
+        self._save_index()
+
+    def _remove_segment(self, seg):
+        try:
+            os.remove(self._seg_path(seg))
+        except OSError:
+            pass
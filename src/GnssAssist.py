@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# Assisted GNSS for the L76: before a fix, injects a reference time, a
+# reference position and EPO data (Extended Prediction Orbit, the predicted
+# ephemerides of the GPS satellites for the next days), so a cold start does
+# not wait to download the ephemerides from the satellites.
+#
+# The server sends the EPO data with `$AGP` during an upload (see
+# doc/protocol.md), and it is stored on the SD card; as the fix comes before
+# the upload, it is used from the next wake cycle on. The EPO data is a list
+# of 6 hour segments, each with a 72-byte record for each of the 32 GPS
+# satellites. Only the segment of the current time is injected, one PMTK721
+# sentence per satellite, after the time (PMTK740) and the position (PMTK741).
+#
+# The GPy has no clock across deep sleep, so the reference time is the last
+# known UTC, from the server or from the last fix, carried over each deep
+# sleep: NVS holds the UTC expected at the next wake up and the seconds since
+# the time was known. The Pytrack sleep timer drifts, so an older time is not
+# injected. The reference position is the last fix, or the one the server
+# sent. Nothing is injected when the GNSS was kept on during the deep sleep,
+# it still has all of it.
+#
+
+import machine
+import os
+import pycom
+import time
+import ustruct
+
+from NvsUtil import COORD_SCALE, decode, encode, nvs_get
+from TelRecord import iso_to_seconds, seconds_to_iso
+
+EPO_FILE = '/sd/epo'
+NVS_TIME_KEY = 'agp_time'  # UTC at the wake up, seconds since 2000-01-01, 0 if unknown
+NVS_AGE_KEY = 'agp_age'  # seconds since the time was known, at the wake up
+NVS_LAT_KEY = 'agp_lat'
+NVS_LNG_KEY = 'agp_lng'
+NVS_GPS_ON_KEY = 'agp_gps_on'  # the GNSS was kept on during the deep sleep
+
+TIME_MAX_AGE = 86400  # seconds, older reference times are not injected
+
+L76_I2C_ADDR = 0x10
+INJECT_GAP_MS = 10  # between sentences, for the L76 to empty its I2C buffer
+
+EPO_RECORD_SIZE = 72
+EPO_SATELLITES = 32
+EPO_SEGMENT_SIZE = EPO_RECORD_SIZE * EPO_SATELLITES
+EPO_SEGMENT_HOURS = 6
+GPS_EPOCH_OFFSET = 630720000  # seconds from 1980-01-06 (GPS time) to 2000-01-01
+GPS_LEAP_SECONDS = 18  # GPS time is ahead of UTC
+
+
+def sentence(body):
+    """Returns the NMEA sentence of `body` (e.g. 'PMTK740,...') with its
+    checksum"""
+    checksum = 0
+    for c in body:
+        checksum ^= ord(c)
+    return '${}*{:02X}\r\n'.format(body, checksum)
+
+
+def gps_hour(seconds):
+    """GPS hours (since 1980-01-06) of a UTC time in seconds since 2000"""
+    return (seconds + GPS_EPOCH_OFFSET + GPS_LEAP_SECONDS) // 3600
+
+
+def _date_fields(seconds):
+    # '2020-06-05T21:44:20+00:00' -> '2020,06,05,21,44,20'
+    s = seconds_to_iso(seconds)
+    return '{},{},{},{},{},{}'.format(s[0:4], s[5:7], s[8:10], s[11:13], s[14:16], s[17:19])
+
+
+class GnssAssist:
+
+    def __init__(self):
+        # after any other reset the time is unknown, the unit may have been
+        # without power for a while
+        deep_sleep = machine.reset_cause() == machine.DEEPSLEEP_RESET
+        self._time = nvs_get(NVS_TIME_KEY) if deep_sleep else 0
+        self._age = nvs_get(NVS_AGE_KEY)
+        self._ref_ms = 0  # ticks when the time was _time, the wake up
+        self._lat = self._lng = None
+        lat, lng = nvs_get(NVS_LAT_KEY), nvs_get(NVS_LNG_KEY)
+        if lat and lng:
+            self._lat, self._lng = decode(lat, COORD_SCALE), decode(lng, COORD_SCALE)
+        self._gps_on = deep_sleep and nvs_get(NVS_GPS_ON_KEY) == 1
+
+    def utc_seconds(self):
+        """The current UTC in seconds since 2000, None if not known well enough"""
+        if not self._time or self._age > TIME_MAX_AGE:
+            return None
+        return self._time + (time.ticks_diff(time.ticks_ms(), self._ref_ms) + 500) // 1000
+
+    def update(self, utc_datetime, lat='', lng=''):
+        """Sets the reference time (ISO 8601) and position, from a fix or
+        from the server; empty values are left as they are"""
+        if len(utc_datetime) >= 19:
+            try:
+                self._time = iso_to_seconds(utc_datetime)
+                self._age = 0
+                self._ref_ms = time.ticks_ms()
+            except ValueError:
+                pass
+        if lat != '' and lng != '':
+            self._lat, self._lng = float(lat), float(lng)
+
+    def needed(self):
+        """Whether the GNSS starts cold, so injecting helps"""
+        return not self._gps_on
+
+    def inject(self, i2c):
+        """Writes the reference time and position and the EPO segment of the
+        current time to the L76, returns the number of satellites injected,
+        or None if the time is not known"""
+        now = self.utc_seconds()
+        if now is None:
+            return None
+        self._write(i2c, 'PMTK740,' + _date_fields(now))
+        if self._lat is not None:
+            self._write(i2c, 'PMTK741,{:.6f},{:.6f},0,{}'.format(
+                self._lat, self._lng, _date_fields(now)))
+        return self._inject_epo(i2c, gps_hour(now))
+
+    def _write(self, i2c, body):
+        i2c.writeto(L76_I2C_ADDR, sentence(body).encode('ascii'))
+        time.sleep_ms(INJECT_GAP_MS)
+
+    def _inject_epo(self, i2c, hour):
+        try:
+            f = open(EPO_FILE, 'rb')
+        except OSError:
+            return 0  # no EPO data or no SD card
+        injected = 0
+        record = bytearray(EPO_RECORD_SIZE)
+        with f:
+            # the segments follow each other, 6 hours apart
+            if f.readinto(record) != EPO_RECORD_SIZE:
+                return 0
+            first = ustruct.unpack_from('<I', record, 0)[0] & 0xFFFFFF
+            segment = (hour - first) // EPO_SEGMENT_HOURS
+            if segment < 0:
+                return 0
+            f.seek(segment * EPO_SEGMENT_SIZE)
+            for _ in range(EPO_SATELLITES):
+                if f.readinto(record) != EPO_RECORD_SIZE:
+                    break  # past the end of the data, it expired
+                words = ustruct.unpack_from('<18I', record, 0)
+                start = words[0] & 0xFFFFFF
+                if not start <= hour < start + EPO_SEGMENT_HOURS:
+                    break
+                self._write(i2c, 'PMTK721,{:X},{}'.format(
+                    record[3], ','.join('{:X}'.format(w) for w in words)))
+                injected += 1
+        return injected
+
+    def receive(self, utc_datetime, lat, lng, length, recv):
+        """Stores what the server sent with $AGP. `recv(n)` returns the next
+        (at most n) of the `length` bytes of EPO data, which replace the
+        stored ones once all of them arrived. Returns the number of bytes
+        stored."""
+        self.update(utc_datetime, lat, lng)
+        if not length:
+            return 0
+        tmp = EPO_FILE + '.tmp'
+        try:
+            f = open(tmp, 'wb')
+        except OSError:
+            f = None  # no SD card, the data is read and dropped
+        stored = 0
+        remaining = length
+        while remaining:
+            data = recv(min(remaining, 1024))
+            if not data:
+                break  # connection closed
+            remaining -= len(data)
+            if f is not None:
+                stored += f.write(data)
+        if f is None:
+            return 0
+        f.close()
+        if stored != length:
+            os.remove(tmp)
+            return 0
+        try:
+            os.remove(EPO_FILE)
+        except OSError:
+            pass  # the first one
+        os.rename(tmp, EPO_FILE)
+        return stored
+
+    def save(self, sleep_seconds, gps_on):
+        """Records the reference time and position in NVS, before the deep
+        sleep; `gps_on` is whether the GNSS stays on during it"""
+        if self._time:
+            elapsed = (time.ticks_diff(time.ticks_ms(), self._ref_ms) + 500) // 1000
+            pycom.nvs_set(NVS_TIME_KEY, self._time + elapsed + sleep_seconds)
+            pycom.nvs_set(NVS_AGE_KEY, self._age + elapsed + sleep_seconds)
+        if self._lat is not None:
+            pycom.nvs_set(NVS_LAT_KEY, encode(self._lat, COORD_SCALE))
+            pycom.nvs_set(NVS_LNG_KEY, encode(self._lng, COORD_SCALE))
+        pycom.nvs_set(NVS_GPS_ON_KEY, 1 if gps_on else 0)
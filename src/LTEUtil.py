@@ -3,23 +3,136 @@
 # This class is a utility to be used to control all communications
 # with the LTE modem on the device.
 #
+# With `psm` the modem is not detached at the end of the wake cycle: it asks
+# the network for power saving mode (PSM, AT+CPSMS) and optionally eDRX
+# (AT+CEDRXS) before attaching, and disconnect() only ends the data session,
+# so the modem stays registered during the deep sleep. The next wake cycle
+# finds it still attached and only resumes the data session. When the
+# registration was lost it attaches again like without `psm`.
+#
+# The IMEI, the band of the last attach and the durations of the attaches
+# are kept in a ModemCache. An attach tries the cached band first, with an
+# adaptive timeout, and only then all bands with `timeout`. Starting the
+# data session gets an adaptive timeout too, at most `timeout`. The modem is
+# polled with exponential backoff from POLL_MIN_MS to POLL_MAX_MS.
+#
 
-from machine import Timer
 import time
 import gc
 from network import LTE
 
+from ModemCache import ModemCache
+
+POLL_MIN_MS = 50
+POLL_MAX_MS = 250
+
+# GPRS timer 3 (T3412 extended) and GPRS timer 2 (T3324) of 3GPP TS 24.008:
+# 3 bits unit, 5 bits value, as (unit bits, seconds per step)
+T3412_UNITS = ((0b011, 2), (0b100, 30), (0b101, 60), (0b000, 600),
+               (0b001, 3600), (0b010, 36000), (0b110, 1152000))
+T3324_UNITS = ((0b000, 2), (0b001, 60), (0b010, 360))
+
+# eDRX cycles of the 4 bits values 0 to 15, in seconds
+EDRX_CYCLES = (5.12, 10.24, 20.48, 40.96, 61.44, 81.92, 102.4, 122.88,
+               143.36, 163.84, 327.68, 655.36, 1310.72, 2621.44, 5242.88, 10485.76)
+EDRX_ACT_CAT_M1 = 4  # access technology of the GPy modem
+
+# downlink EARFCN ranges (3GPP TS 36.101) of the LTE-M bands of the GPy modem
+EARFCN_BANDS = ((0, 599, 1), (600, 1199, 2), (1200, 1949, 3), (1950, 2399, 4),
+                (2400, 2649, 5), (3450, 3799, 8), (5010, 5179, 12), (5180, 5279, 13),
+                (5280, 5379, 14), (5730, 5849, 17), (5850, 5999, 18), (6000, 6149, 19),
+                (6150, 6449, 20), (8040, 8689, 25), (8690, 9039, 26), (9210, 9659, 28),
+                (66436, 67335, 66))
+
+MAX_NEIGHBOURS = 4  # in the cells of a @TEL frame, strongest first
+
+
+def _rsrp(fields):
+    # RSRP in whole dBm, '' if not reported
+    try:
+        return str(int(round(float(fields['RSRP']))))
+    except (KeyError, ValueError):
+        return ''
+
+
+def encode_timer(seconds, units):
+    """Returns the 8 bits string of a PSM timer: the finest unit that holds
+    `seconds` (rounded up) in 5 bits"""
+    for unit, step in units:
+        value = -(-int(seconds) // step)
+        if value <= 31:
+            return '{:03b}{:05b}'.format(unit, value)
+    unit, step = units[-1]
+    return '{:03b}{:05b}'.format(unit, 31)
+
+
+def encode_edrx(seconds):
+    """Returns the 4 bits string of the shortest eDRX cycle of at least
+    `seconds`"""
+    for i, cycle in enumerate(EDRX_CYCLES):
+        if cycle >= seconds:
+            return '{:04b}'.format(i)
+    return '{:04b}'.format(len(EDRX_CYCLES) - 1)
+
+
+def earfcn_band(earfcn):
+    """Returns the band of a downlink EARFCN, None if it is not known"""
+    for first, last, band in EARFCN_BANDS:
+        if first <= earfcn <= last:
+            return band
+    return None
+
 
 class LTEUtil:
 
-    def __init__(self, log, apn, timeout=None):
+    def __init__(self, log, apn, timeout=None, psm=False, psm_tau=86400, psm_active=2,
+                 edrx=0):
         self._lte = LTE()
         self._apn = apn
         self._log = log
-        self.imei = self._get_imei()
-        self.chrono = Timer.Chrono()
-        self.timeout = timeout
-        self.timeout_status = True
+        self.cache = ModemCache()
+        self.imei = self.cache.imei
+        if not self.imei:
+            self.imei = self._get_imei()
+            self.cache.imei = self.imei
+        self.timeout = timeout  # seconds
+        self.connect_ms = 0  # until the data session was seen up, see wait()
+        self._start_ms = 0
+        self._phase_ms = 0  # start of the current attach
+        self._attach_ms = None  # duration of the attach on the cached band
+        self._band = None  # band of the current attach, None for all bands
+        self.psm = psm
+        self._psm_tau = psm_tau
+        self._psm_active = psm_active
+        self._edrx = edrx
+        self.resumed = False  # still attached from the previous wake cycle
+
+    def _send_at_cmd(self, at_cmd):
+        result = self._lte.send_at_cmd(at_cmd)
+        self._log.debug('AT SENT:\n\t{}'.format(at_cmd))
+        self._log.debug('RECEIVED:\n\t{}'.format(repr(result)))
+        return result
+
+    def _set_power_saving(self):
+        """Requests PSM and eDRX from the network, used from the next attach"""
+        try:
+            if self.psm:
+                self._send_at_cmd('AT+CPSMS=1,,,"{}","{}"'.format(
+                    encode_timer(self._psm_tau, T3412_UNITS),
+                    encode_timer(self._psm_active, T3324_UNITS)))
+            else:
+                self._send_at_cmd('AT+CPSMS=0')
+            if self._edrx:
+                self._send_at_cmd('AT+CEDRXS=2,{},"{}"'.format(
+                    EDRX_ACT_CAT_M1, encode_edrx(self._edrx)))
+        except Exception as ex:
+            self._log.debug('Failed to set the power saving mode: {}'.format(ex))
+
+    @property
+    def mode(self):
+        """'resume' if the data session was resumed on the registration of
+        the previous wake cycle, 'attach' after a full attach"""
+        return 'resume' if self.resumed else 'attach'
 
     def _get_imei(self):
         imei = ''
@@ -44,58 +157,198 @@ class LTEUtil:
         return imei
 
     def connect(self):
+        self.start_attach()
+        return self.wait()
+
+    def start_attach(self):
+        """Starts attaching to a base station and returns immediately, the
+        modem attaches in the background. The attach timeouts count from
+        here."""
         self._log.debug(
             'Attaching cellular modem to a base station [apn={}]'.format(self._apn))
+        self._start_ms = time.ticks_ms()
+        self._attach_ms = None
 
-        # TODO figure out which band to use best, and what happens when you don't specify a band?
-        # self._lte.attach(band=?,apn=apn)
-        # TODO add timeout for attaching
+        self.resumed = self._lte.isattached()
+        if self.resumed:
+            self._log.debug('Still attached, resuming the data session')
+        else:
+            self._attach(self.cache.band)
 
-        if self.timeout is not None:
-            self.chrono.reset()
-            self.chrono.start()
-
-        if not self._lte.isattached():
+    def _attach(self, band=None):
+        """Attaches on `band`, or on all bands of the modem with None"""
+        if self.psm or self._edrx:
+            self._set_power_saving()
+        self._band = band
+        self._phase_ms = time.ticks_ms()
+        if band is not None:
+            self._log.debug('Attaching on band {} first'.format(band))
+            self._lte.attach(band=band, apn=self._apn)
+        else:
             self._lte.attach(apn=self._apn)
-        while not self._lte.isattached():
-            if self.timeout is not None and self.chrono.read() >= self.timeout:
-                self.chrono.stop()
-                chrono_timeout = self.chrono.read()
-                self.chrono.reset()
-                self.timeout_status = False
-                debug_timeout = True
-            if not self.timeout_status:
+
+    def _attach_timeout_ms(self):
+        if self.timeout is None:
+            return None
+        limit = self.timeout * 1000
+        if self._band is not None:
+            return self.cache.timeout_ms('att', limit)
+        return limit
+
+    def _poll(self, done, timeout_ms, start_ms):
+        """Polls `done` with exponential backoff, returns False if it was
+        not done `timeout_ms` after `start_ms`"""
+        poll_ms = POLL_MIN_MS
+        while not done():
+            elapsed = time.ticks_diff(time.ticks_ms(), start_ms)
+            if timeout_ms is not None and elapsed >= timeout_ms:
                 gc.collect()
-                self._log.debug('Attaching LTE timed out')
-                self.timeout_status = True
+                return False
+            sleep_ms = poll_ms
+            if timeout_ms is not None:
+                sleep_ms = max(1, min(poll_ms, timeout_ms - elapsed))
+            time.sleep_ms(sleep_ms)
+            poll_ms = min(poll_ms * 2, POLL_MAX_MS)
+        return True
+
+    def _wait_attached(self):
+        polled = not self._lte.isattached()
+        if self._poll(self._lte.isattached, self._attach_timeout_ms(), self._phase_ms):
+            if polled and self._band is not None:
+                # only a duration that was seen by polling, the attach may
+                # have finished long before wait() was called
+                self._attach_ms = time.ticks_diff(time.ticks_ms(), self._phase_ms)
+            return True
+        if self._band is None:
+            self._log.debug('Attaching LTE timed out')
+            return False
+        # widen to all bands, the device may have moved
+        self._log.debug('Attaching on band {} timed out, trying all bands'.format(self._band))
+        self._lte.detach()
+        self._attach()
+        return self._wait_attached()
+
+    def wait(self):
+        """Waits until the modem is attached and starts a data session.
+        Returns False when it timed out.
+
+        connect_ms counts until the polling first saw the data session up
+        (or the timeout), from start_attach() when the attach was still
+        running, otherwise from here: an attach that finished while the
+        caller did something else (the GPS fix) is not counted with it."""
+        connected = False
+        from_ms = time.ticks_ms()
+        if not self.resumed and not self._lte.isattached():
+            from_ms = self._start_ms
+        while not connected:
+            if not self.resumed and not self._wait_attached():
                 break
+            self._log.debug('Attached successfully')
 
-            self._log.debug('Attaching...')
-            time.sleep(0.25)
-        self._log.debug('Attached successfully')
-
-        self._log.debug('Starting a data session and obtaining an IP address')
-        if not self._lte.isconnected():
-            self._lte.connect()
-        while not self._lte.isconnected():
-            if self.timeout is not None and self.chrono.read() >= self.timeout:
-                self.chrono.stop()
-                chrono_timeout = self.chrono.read()
-                self.chrono.reset()
-                self.timeout_status = False
-                debug_timeout = True
-            if not self.timeout_status:
-                gc.collect()
+            self._log.debug('Starting a data session and obtaining an IP address')
+            start_ms = time.ticks_ms()
+            if not self._lte.isconnected():
+                self._lte.connect()
+            timeout_ms = None
+            if self.timeout is not None:
+                timeout_ms = self.cache.timeout_ms('con', self.timeout * 1000)
+
+            def done():
+                return self._lte.isconnected() or (self.resumed and not self._lte.isattached())
+            if not self._poll(done, timeout_ms, start_ms):
                 self._log.debug('Connecting LTE timed out')
                 break
-            self._log.debug('...')
-            time.sleep(0.25)
+            if self._lte.isconnected():
+                self.connect_ms = time.ticks_diff(time.ticks_ms(), from_ms)
+                self.cache.record('con', time.ticks_diff(time.ticks_ms(), start_ms))
+                connected = True
+            else:
+                # the network dropped the registration during the deep sleep
+                self._log.debug('Registration lost, attaching again')
+                self.resumed = False
+                self._attach(self.cache.band)
 
+        if not connected:
+            self.connect_ms = time.ticks_diff(time.ticks_ms(), from_ms)
+            self.cache.failed()
+            return False
+        if not self.resumed:
+            if self._attach_ms is not None:
+                self.cache.record('att', self._attach_ms)
+            self.cache.attached(*self._read_network())
         self._log.debug('Connected to the network successfully')
+        return True
+
+    def _monitor(self):
+        """Returns the fields of the serving cell, then of each neighbour
+        cell, as dicts. e.g. for the serving cell '+SQNMONI: Bell Cc:302
+        Nc:610 RSRP:-98.20 CINR:0.00 RSRQ:-11.20 TAC:1234 Id:215 EARFCN:5110
+        PWR:-75.50 PAGING:128', for a neighbour '+SQNMONI: RSRP:-104.50
+        CINR:0.00 RSRQ:-14.20 Id:87 EARFCN:5110' (Id is the physical cell id)"""
+        cells = []
+        for line in self._send_at_cmd('AT+SQNMONI=9').split('\r\n'):
+            if not line.startswith('+SQNMONI:'):
+                continue
+            fields = {}
+            for word in line[9:].split():
+                name, _, value = word.partition(':')
+                fields[name] = value
+            cells.append(fields)
+        return cells
+
+    def _read_network(self):
+        """Returns the band, operator, cell and tracking area of the serving
+        cell, None for what the modem does not tell"""
+        band, operator, cell, tac = self._band, None, None, None
+        try:
+            cells = self._monitor()
+            fields = cells[0] if cells else {}
+            if 'Cc' in fields and 'Nc' in fields:
+                operator = int(fields['Cc']) * 1000 + int(fields['Nc'])
+            if 'Id' in fields:
+                cell = int(fields['Id'])
+            if 'TAC' in fields:
+                tac = int(fields['TAC'])
+            if 'EARFCN' in fields:
+                band = earfcn_band(int(fields['EARFCN'])) or band
+        except Exception as ex:
+            self._log.debug('Failed to read the serving cell: {}'.format(ex))
+        return band, operator, cell, tac
+
+    def read_cells(self):
+        """Returns the serving cell and the strongest neighbour cells as the
+        `cells` of a @TEL frame, for a coarse position without a fix:
+        '{mcc}:{mnc}:{tac}:{cell_id}:{rsrp}' then ';{earfcn}:{pci}:{rsrp}'
+        for each neighbour. '' if the serving cell is not known."""
+        cells = self._monitor()
+        if not cells or not {'Cc', 'Nc', 'Id'} <= set(cells[0]):
+            return ''
+        s = cells[0]
+        out = ['{}:{}:{}:{}:{}'.format(int(s['Cc']), int(s['Nc']), s.get('TAC', ''),
+                                       s['Id'], _rsrp(s))]
+        neighbours = [c for c in cells[1:] if 'Id' in c and 'EARFCN' in c]
+        neighbours.sort(key=lambda c: float(c.get('RSRP', -200)), reverse=True)
+        for c in neighbours[:MAX_NEIGHBOURS]:
+            out.append('{}:{}:{}'.format(c['EARFCN'], c['Id'], _rsrp(c)))
+        return ';'.join(out)
 
     def disconnect(self):
+        try:
+            self.cache.save()
+        except Exception as ex:
+            self._log.debug('Failed to save the modem state: {}'.format(ex))
+        if self.psm:
+            # ends the data session only, the modem stays registered and goes
+            # to PSM when the active timer expires
+            self._lte.disconnect()
+            self._lte.deinit(detach=False, reset=False)
+            self._log.debug('Disconnected, the modem stays registered in PSM\n')
+            return
+        if self.resumed:
+            # attached with PSM before, do not ask for it on the next attach
+            self._set_power_saving()
         self._lte.disconnect()
-        self._lte.dettach()
+        self._lte.detach()
         # not sure if this is needed since we already dettach above
         self._lte.deinit(detach=True, reset=False)
         self._log.debug('Detached from LTE module and turned it off\n')
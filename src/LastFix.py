@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+# Reuses the last GPS fix while the unit did not move, so a parked unit does
+# not power the GNSS and wait for a fix on every wake cycle (see Config,
+# gps_reuse_max_age). The unit did not move when the accelerometer activity
+# interrupt was armed during the deep sleep (acc_alert_enabled) and it did
+# not wake the device. A reused fix is at most gps_reuse_max_age seconds old;
+# any reset other than a deep sleep takes a new one.
+#
+# The position of a reused fix has `fix_age`, the seconds since the fix, and
+# its time is the time of the fix plus that age. The GNSS can be off during
+# the deep sleep while the next wake cycle will reuse the fix too; before the
+# fix gets too old it stays on, so the next fix is not a cold start.
+#
+# The last fix and the seconds since then are kept in NVS across deep sleep,
+# fixed point (see NvsUtil), and 0 means empty.
+#
+
+import machine
+import pycom
+
+from NvsUtil import COORD_SCALE, decode, encode, nvs_get
+from model import Position
+from TelRecord import iso_to_seconds, seconds_to_iso
+
+NVS_LAT_KEY = 'fix_lat'
+NVS_LNG_KEY = 'fix_lng'
+NVS_TIME_KEY = 'fix_time'  # seconds since 2000-01-01, 0 if unknown
+NVS_SECONDS_KEY = 'fix_secs'
+
+
+class LastFix:
+
+    def __init__(self, config):
+        self._max_age = config.gps_reuse_max_age
+        self.enabled = bool(self._max_age)
+        self.seconds = 0  # since the last fix
+        self._lat = self._lng = None
+        self._time = 0
+        if self.enabled:
+            lat, lng = nvs_get(NVS_LAT_KEY), nvs_get(NVS_LNG_KEY)
+            if lat and lng:
+                self._lat, self._lng = decode(lat, COORD_SCALE), decode(lng, COORD_SCALE)
+                self._time = nvs_get(NVS_TIME_KEY)
+                self.seconds = nvs_get(NVS_SECONDS_KEY)
+        self.reused = False
+        self.gps_off = False  # the GNSS can be off during the deep sleep, see save()
+
+    def reuse(self, reset_cause, moved):
+        """Returns the Position of the last fix if it can be used instead of
+        a new one, or None"""
+        self.reused = False
+        if not self.enabled or moved or reset_cause != machine.DEEPSLEEP_RESET:
+            return None
+        if self._lat is None or self.seconds >= self._max_age:
+            return None
+        self.reused = True
+        utc_datetime = seconds_to_iso(self._time + self.seconds) if self._time else ''
+        position = Position(self._lat, self._lng, utc_datetime, 0.0, '')
+        position.fix_age = self.seconds
+        return position
+
+    def save(self, position, awake_ms, sleep_seconds):
+        """Records the position of this wake cycle in NVS, before the deep
+        sleep"""
+        if not self.enabled:
+            return
+        if not self.reused and position.lat != '' and position.lng != '':
+            pycom.nvs_set(NVS_LAT_KEY, encode(position.lat, COORD_SCALE))
+            pycom.nvs_set(NVS_LNG_KEY, encode(position.lng, COORD_SCALE))
+            fix_time = 0
+            if len(position.utc_datetime) >= 19:
+                try:
+                    fix_time = iso_to_seconds(position.utc_datetime)
+                except ValueError:
+                    pass
+            pycom.nvs_set(NVS_TIME_KEY, fix_time)
+            self.seconds = sleep_seconds
+        else:
+            self.seconds += awake_ms // 1000 + sleep_seconds
+        pycom.nvs_set(NVS_SECONDS_KEY, self.seconds)
+        self.gps_off = self.reused and self.seconds < self._max_age
@@ -74,6 +74,10 @@ class Logger:
         else:
             return sys.stdout
 
+    def flush(self):
+        if self._logfile != None:
+            self._logfile.flush()
+
     def deinit(self):
         if self._logfile:
             self._logfile.close()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# What LTEUtil learned about the modem and the network in earlier wake
+# cycles, kept in NVS across deep sleep:
+#   - the IMEI, so it is not read from the modem on every boot
+#   - the band, operator (MCC * 1000 + MNC), cell and tracking area code of
+#     the last successful attach; the next attach tries that band first, and
+#     without a fix the cell is reported for a coarse position
+#   - smoothed durations of the attach on that band and of starting the data
+#     session, for adaptive timeouts (like the TCP retransmission timeout of
+#     RFC 6298: average + 4 * mean deviation)
+#   - the failed attaches in a row, each one doubles the adaptive timeouts
+#
+# NVS only holds 32-bit unsigned integers, so the 15 digits of the IMEI are
+# stored in two keys, each with a leading 1 to keep the leading zeros, and 0
+# means unknown. Keys are only written when they changed, to spare the flash.
+#
+
+import pycom
+
+from NvsUtil import nvs_get
+
+NVS_KEYS = ('mc_imei_h', 'mc_imei_l', 'mc_band', 'mc_oper', 'mc_cell', 'mc_tac',
+            'mc_att_avg', 'mc_att_dev', 'mc_con_avg', 'mc_con_dev', 'mc_fails')
+
+MIN_TIMEOUT_MS = 2000
+MAX_BACKOFF = 4  # the timeouts grow at most 2**4 times, up to the limit
+
+
+class ModemCache:
+
+    def __init__(self):
+        self._values = {key: nvs_get(key) for key in NVS_KEYS}
+        self._saved = dict(self._values)
+
+    @property
+    def imei(self):
+        high, low = self._values['mc_imei_h'], self._values['mc_imei_l']
+        if not high or not low:
+            return ''
+        return str(high)[1:] + str(low)[1:]
+
+    @imei.setter
+    def imei(self, imei):
+        if len(imei) == 15 and imei.isdigit():
+            self._values['mc_imei_h'] = int('1' + imei[:7])
+            self._values['mc_imei_l'] = int('1' + imei[7:])
+
+    @property
+    def band(self):
+        return self._values['mc_band'] or None
+
+    @property
+    def operator(self):
+        return self._values['mc_oper'] or None
+
+    @property
+    def cell(self):
+        return self._values['mc_cell'] or None
+
+    @property
+    def tac(self):
+        return self._values['mc_tac'] or None
+
+    def serving_cell(self):
+        """Returns the cell of the last attach as the `cells` of a @TEL
+        frame, without RSRP, or '' if it is not known"""
+        if not self.operator or not self.cell:
+            return ''
+        return '{}:{}:{}:{}:'.format(self.operator // 1000, self.operator % 1000,
+                                     self.tac or '', self.cell)
+
+    @property
+    def fails(self):
+        return self._values['mc_fails']
+
+    def timeout_ms(self, phase, limit_ms):
+        """Timeout of `phase` ('att' on the cached band or 'con'), at most
+        `limit_ms`, which is also the timeout before the first sample"""
+        avg = self._values['mc_{}_avg'.format(phase)]
+        if not avg:
+            return limit_ms
+        timeout = max(MIN_TIMEOUT_MS, avg + 4 * self._values['mc_{}_dev'.format(phase)])
+        return min(limit_ms, timeout << min(self.fails, MAX_BACKOFF))
+
+    def record(self, phase, ms):
+        """Adds a duration of `phase` to its smoothed average and deviation"""
+        avg_key, dev_key = 'mc_{}_avg'.format(phase), 'mc_{}_dev'.format(phase)
+        avg, dev = self._values[avg_key], self._values[dev_key]
+        if not avg:
+            avg, dev = ms, ms // 2
+        else:
+            dev += (abs(avg - ms) - dev) // 4
+            avg += (ms - avg) // 8
+        self._values[avg_key], self._values[dev_key] = max(1, avg), dev
+
+    def attached(self, band, operator, cell, tac=None):
+        """Records a successful attach, None for what the modem did not tell"""
+        self._values['mc_fails'] = 0
+        for key, value in (('mc_band', band), ('mc_oper', operator), ('mc_cell', cell),
+                           ('mc_tac', tac)):
+            if value is not None:
+                self._values[key] = value
+
+    def failed(self):
+        self._values['mc_fails'] += 1
+
+    def save(self):
+        """Writes the values that changed to NVS"""
+        for key in NVS_KEYS:
+            value = self._values[key]
+            if value != self._saved[key]:
+                pycom.nvs_set(key, value)
+                self._saved[key] = value
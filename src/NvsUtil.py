@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+#
+# Helpers for the values kept in NVS across deep sleep. NVS only holds 32-bit
+# unsigned integers, so signed decimals (temperatures, coordinates) are stored
+# fixed point with an offset, and 0 means empty.
+#
+
+import pycom
+
+TEMP_SCALE = 128  # TMP117 resolution is 1/128 degrees
+COORD_SCALE = 1000000  # microdegrees
+NVS_OFFSET = 0x80000000
+
+
+def nvs_get(key, default=0):
+    """The value stored under `key`, `default` if it is not stored yet"""
+    try:
+        value = pycom.nvs_get(key)
+    except ValueError:
+        value = None  # not stored yet
+    return value if value is not None else default
+
+
+def encode(value, scale):
+    """A decimal (or a string of one) as stored in NVS, 0 for None or ''"""
+    if value is None or value == '':
+        return 0
+    return int(round(float(value) * scale)) + NVS_OFFSET
+
+
+def decode(value, scale):
+    """The decimal stored by encode(), None if empty"""
+    if not value:
+        return None
+    return (value - NVS_OFFSET) / scale
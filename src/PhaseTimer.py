@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# Measures how long each phase of a wake cycle takes, keeps a history of the
+# last wake cycles on the SD card and summarizes it for the server ($TIM).
+#
+# The history has one line per wake cycle:
+#   '{awake_ms} {name}={ms} {name}={ms} ...\n'
+# and is renamed to 'timing_old' when it reaches HISTORY_SIZE bytes, so the
+# two files hold between one and two HISTORY_SIZE worth of wake cycles.
+#
+
+from machine import Timer
+import os
+
+HISTORY_FILES = ('/sd/timing_old', '/sd/timing')  # oldest first
+HISTORY_SIZE = 4096  # bytes, about 50 wake cycles
+
+
+class Span:
+    """Adds the time spent in a `with` block to a phase of the PhaseTimer"""
+
+    def __init__(self, timer, name):
+        self._timer = timer
+        self._name = name
+        self._start = 0
+
+    def __enter__(self):
+        self._start = self._timer.read_ms()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._timer.add(self._name, self._timer.read_ms() - self._start)
+        return False
+
+
+class PhaseTimer:
+
+    def __init__(self, boot_ms=0):
+        """`boot_ms` is the time from the wake up until the timer is created
+        (time.ticks_ms() at the start of main), recorded as the 'boot' phase"""
+        self._chrono = Timer.Chrono()
+        self._chrono.reset()
+        self._chrono.start()
+        self._boot_ms = boot_ms
+        self.phases = []  # (name, ms) in the order the phases started
+        if boot_ms:
+            self.add('boot', boot_ms)
+
+    def read_ms(self):
+        """Milliseconds since the wake up"""
+        return self._boot_ms + int(self._chrono.read_ms())
+
+    def span(self, name):
+        return Span(self, name)
+
+    def timed(self, name, fn, *args):
+        """Calls fn(*args) and adds the time it took to phase `name`"""
+        with self.span(name):
+            return fn(*args)
+
+    def add(self, name, ms):
+        """Adds `ms` to phase `name`, e.g. the time of a phase that ran in
+        another thread"""
+        for i, (n, total) in enumerate(self.phases):
+            if n == name:
+                self.phases[i] = (n, total + ms)
+                return
+        self.phases.append((name, ms))
+
+    def log(self, log):
+        """Logs the phase times. Because some phases overlap, their sum is
+        what the wake cycle would take if they ran one after another."""
+        total = 0
+        for _, ms in self.phases:
+            total += ms
+        log.info('Phases [ms]: {}'.format(
+            ' '.join('{}={}'.format(name, ms) for name, ms in self.phases)))
+        log.info('Awake {} ms, {} ms if the phases ran one after another'.format(
+            self.read_ms(), total))
+
+    def save(self):
+        """Appends this wake cycle to the history on the SD card"""
+        if 'sd' not in os.listdir('/'):
+            return
+        path = HISTORY_FILES[-1]
+        name = path[4:]
+        if name in os.listdir('/sd') and os.stat(path)[6] >= HISTORY_SIZE:
+            if HISTORY_FILES[0][4:] in os.listdir('/sd'):
+                os.remove(HISTORY_FILES[0])
+            os.rename(path, HISTORY_FILES[0])
+        line = '{} {}\n'.format(self.read_ms(), ' '.join(
+            '{}={}'.format(name, ms) for name, ms in self.phases))
+        with open(path, 'a') as f:
+            f.write(line)
+
+
+def summarize():
+    """Summarizes the history as '{wakes},{awake_avg},{awake_max}' followed
+    by ',{name}:{avg}:{max}' for each phase, the longest phase first. A
+    phase is averaged over the wake cycles it ran in. Times are in ms."""
+    wakes = 0
+    awake_total = 0
+    awake_max = 0
+    phases = {}  # name -> [total, max, count]
+    files = os.listdir('/sd') if 'sd' in os.listdir('/') else ()
+    for path in HISTORY_FILES:
+        if path[4:] not in files:
+            continue
+        with open(path, 'r') as f:
+            for line in f:
+                words = line.split()
+                if not line.endswith('\n') or not words:
+                    continue  # cut by a power loss
+                try:
+                    awake = int(words[0])
+                    times = [w.split('=') for w in words[1:]]
+                    times = [(name, int(ms)) for name, ms in times]
+                except ValueError:
+                    continue
+                wakes += 1
+                awake_total += awake
+                awake_max = max(awake_max, awake)
+                for name, ms in times:
+                    p = phases.get(name)
+                    if p is None:
+                        phases[name] = [ms, ms, 1]
+                    else:
+                        p[0] += ms
+                        p[1] = max(p[1], ms)
+                        p[2] += 1
+    avgs = sorted(((p[0] // p[2], p[1], name) for name, p in phases.items()),
+                  reverse=True)
+    words = ['{}'.format(wakes), '{}'.format(awake_total // wakes if wakes else 0),
+             '{}'.format(awake_max)]
+    words.extend('{}:{}:{}'.format(name, avg, mx) for avg, mx, name in avgs)
+    return ','.join(words)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# Decodes the data formats of the Ruuvi tags
+# (https://docs.ruuvi.com/communication/bluetooth-advertisements).
+#
+# Formats 3 (RAWv1) and 5 (RAWv2) come in the manufacturer specific data of
+# the BLE advertisement: the manufacturer ID (0x0499, little-endian), the data
+# format, then the fields. Each is read with one unpack_from() using the
+# struct format in FORMATS, and the fields are converted with integer
+# operations. Formats 2 and 4 are base64 in an Eddystone URL, see decode_url().
+#
+# The values are numbers; a field the tag marks as not available is ''.
+#
+
+import ubinascii
+import ustruct
+
+from model import ExternalSensor
+
+MANUFACTURER_ID = b'\x99\x04'
+HEADER_SIZE = 3  # manufacturer ID and data format
+
+
+def _decode_3(v, uid):
+    humidity, temp_int, temp_frac, pressure, acc_x, acc_y, acc_z, battery = v
+    # sign and magnitude, then hundredths
+    temperature = (temp_int & 0x7F) + temp_frac / 100
+    if temp_int & 0x80:
+        temperature = -temperature
+    return ExternalSensor(humidity=humidity / 2, temperature=round(temperature, 2),
+                          pressure=pressure + 50000, acceleration_x=acc_x,
+                          acceleration_y=acc_y, acceleration_z=acc_z,
+                          battery_voltage=battery, uid=uid)
+
+
+def _decode_5(v, uid):
+    (temperature, humidity, pressure, acc_x, acc_y, acc_z, power,
+     movement_counter, measurement_sequence) = v
+    # 11 bits battery voltage above 1600 mV, 5 bits tx power in 2 dBm steps from -40 dBm
+    battery, tx_power = power >> 5, power & 0x1F
+    return ExternalSensor(
+        temperature='' if temperature == -0x8000 else temperature * 0.005,
+        humidity='' if humidity == 0xFFFF else humidity * 0.0025,
+        pressure='' if pressure == 0xFFFF else pressure + 50000,
+        acceleration_x=acc_x, acceleration_y=acc_y, acceleration_z=acc_z,
+        battery_voltage='' if battery == 0x7FF else battery + 1600,
+        tx_power='' if tx_power == 0x1F else tx_power * 2 - 40,
+        movement_counter='' if movement_counter == 0xFF else movement_counter,
+        measurement_sequence='' if measurement_sequence == 0xFFFF else measurement_sequence,
+        uid=uid)
+
+
+# data format -> (struct format of the fields after the header, decoder)
+FORMATS = {
+    3: ('>BBBHhhhH', _decode_3),
+    5: ('>hHHhhhHBH', _decode_5),
+}
+
+
+def data_format(adv_data):
+    """Returns the data format of the manufacturer data, None if it is not
+    from a Ruuvi tag"""
+    if len(adv_data) < HEADER_SIZE or adv_data[:2] != MANUFACTURER_ID:
+        return None
+    return adv_data[2]
+
+
+def decode(adv_data, uid=''):
+    """Decodes the manufacturer data of an advertisement (starting with the
+    manufacturer ID) into an ExternalSensor. Returns None for a format that
+    is not supported or data that is too short."""
+    fmt = FORMATS.get(data_format(adv_data))
+    if fmt is None:
+        return None
+    layout, decoder = fmt
+    if len(adv_data) < HEADER_SIZE + ustruct.calcsize(layout):
+        return None
+    return decoder(ustruct.unpack_from(layout, memoryview(adv_data), HEADER_SIZE), uid)
+
+
+def decode_url(data, uid=''):
+    """Decodes the base64 data of the Eddystone URL of formats 2 and 4 (the
+    part after '#'), format 4 has one more character, the tag identifier"""
+    data = data.encode()
+    identifier = None
+    if len(data) > 8:
+        identifier = data[8]
+        data = data[:8]
+    v = ustruct.unpack_from('>BBBBH', ubinascii.a2b_base64(data), 0)
+    data_format, humidity, temp_int, temp_frac, pressure = v
+    temperature = (temp_int & 0x7F) + temp_frac / 100
+    if temp_int & 0x80:
+        temperature = -temperature
+    sensor = ExternalSensor(humidity=humidity / 2, temperature=round(temperature, 2),
+                            pressure=pressure + 50000, uid=uid)
+    return data_format, sensor, identifier
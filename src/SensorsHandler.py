@@ -1,7 +1,37 @@
 from TMP117 import *
 from Logger import Logger
+from machine import I2C
+import machine
+import pycom
 import time
 
+READY_POLL_MS = 5  # polling interval when a one-shot result is late
+
+# The sensors share one I2C bus. Which of the possible addresses have a
+# sensor is stored in the NVS as a bit mask (bit 0 for the first address), so
+# after a deep sleep the sensors are not looked for again unless reading them
+# fails. After any other reset the bus is scanned.
+SDA_PIN = 'P10'
+SCL_PIN = 'P11'
+SENSOR_ADDRESSES = (TMP117_I2CADDR_GND, TMP117_I2CADDR_VCC,
+                    TMP117_I2CADDR_SDA, TMP117_I2CADDR_SCL)
+NVS_SENSORS_KEY = 'tmp117_addrs'
+
+# Sampling profiles (config 'temp_profile'): (averaging mode, conversion cycle
+# bit, one-shot). With one-shot the sensors are shut down between the wake
+# cycles and every read waits for a one-shot conversion; otherwise they
+# convert continuously and usually have a result when the device wakes up.
+# More averaging means less noise but a longer active time (135 uA), so the
+# cycle is stretched to keep the sensors mostly on standby.
+SAMPLING_PROFILES = {
+    'fast': (AVG_NONE, 0, True),  # 16 ms single conversion, shut down between reads
+    'avg8': (AVG_8, 4, False),  # 125 ms every 1 s, the power-on default
+    'avg32': (AVG_32, 5, False),  # 500 ms every 4 s
+    'avg64': (AVG_64, 6, False),  # 1 s every 8 s
+    'alert': (AVG_8, 7, False),  # 125 ms every 16 s, for the alert mode
+}
+DEFAULT_PROFILE = 'avg8'
+
 
 class SensorsHandler:
 
@@ -10,52 +40,118 @@ class SensorsHandler:
     _temp_3 = None
     _temp_4 = None
 
-    def __init__(self, log):
+    def __init__(self, log, batched=True, profile=DEFAULT_PROFILE):
+        """With `batched`, get_temperatures() reads the sensors that already
+        have a result and starts a one-shot conversion on all the others at
+        once; otherwise it polls each sensor in turn until it has a result.
+        `profile` is one of SAMPLING_PROFILES, applied after each read."""
         self._log = log
-        # try and init all the four possible temperature sensors
-        try:
-            self._temp_1 = TMP117(device_addr=TMP117_I2CADDR_GND)
-        except Exception as ex:
-            self._log.debug(
-                'Failed to init temperature sensor 1: {}'.format(ex))
+        self._batched = batched
+        if profile not in SAMPLING_PROFILES:
+            self._log.error('Unknown temp_profile "{}"'.format(profile))
+            profile = DEFAULT_PROFILE
+        self._profile = SAMPLING_PROFILES[profile]
+        self._temp_1_config = None  # config register of sensor 1, see clear_alert()
+        self._i2c = I2C(0, mode=I2C.MASTER, pins=(SDA_PIN, SCL_PIN))
+        self._scanned = False  # whether the sensors were looked for this wake
+        addrs = None
+        if machine.reset_cause() == machine.DEEPSLEEP_RESET:
+            try:
+                addrs = pycom.nvs_get(NVS_SENSORS_KEY)
+            except ValueError:
+                pass  # not stored yet
+        if addrs is None:
+            self._find_sensors()
+        else:
+            self._init_sensors(addrs, False)
 
-        try:
-            self._temp_2 = TMP117(device_addr=TMP117_I2CADDR_VCC)
-        except Exception as ex:
-            self._log.debug(
-                'Failed to init temperature sensor 2: {}'.format(ex))
-
-        try:
-            self._temp_3 = TMP117(device_addr=TMP117_I2CADDR_SDA)
-        except Exception as ex:
-            self._log.debug(
-                'Failed to init temperature sensor 3: {}'.format(ex))
+    def _init_sensors(self, addrs, verify):
+        """Creates the drivers of the sensors in the bit mask `addrs` (bit 0
+        for SENSOR_ADDRESSES[0] and so on)"""
+        sensors = [None, None, None, None]
+        for i, addr in enumerate(SENSOR_ADDRESSES):
+            if addrs >> i & 1:
+                try:
+                    sensors[i] = TMP117(device_addr=addr, i2c=self._i2c, verify=verify)
+                except Exception as ex:
+                    self._log.debug(
+                        'Failed to init temperature sensor {}: {}'.format(i + 1, ex))
+        self._temp_1, self._temp_2, self._temp_3, self._temp_4 = sensors
 
-        try:
-            self._temp_4 = TMP117(device_addr=TMP117_I2CADDR_SCL)
-        except Exception as ex:
-            self._log.debug(
-                'Failed to init temperature sensor 4: {}'.format(ex))
+    def _find_sensors(self):
+        """Scans the bus for the sensors and stores which were found, so the
+        next wake cycles after a deep sleep skip this"""
+        found = self._i2c.scan()
+        addrs = 0
+        for i, addr in enumerate(SENSOR_ADDRESSES):
+            if addr in found:
+                addrs |= 1 << i
+        self._init_sensors(addrs, True)
+        addrs = 0
+        for i, sensor in enumerate(self._sensors()):
+            if sensor:
+                addrs |= 1 << i
+        pycom.nvs_set(NVS_SENSORS_KEY, addrs)
+        self._scanned = True
+        self._log.debug('Temperature sensors found: {}'.format(
+            ', '.join(hex(a) for i, a in enumerate(SENSOR_ADDRESSES) if addrs >> i & 1)))
 
-        if not self._temp_1 and not self._temp_2 and not self._temp_3 and not self._temp_4:
+        if not addrs:
             self._log.error('No temperature sensors!')
 
+    def _sensors(self):
+        return (self._temp_1, self._temp_2, self._temp_3, self._temp_4)
+
     def _read_temp_sensor(self, sensor):
         """Read the temperature from the given sensor as a string.
         Return an empty string if sensor is unavailable"""
 
         t = ''
         if sensor:
+            # reading the config register clears Data_Ready, so the mode is
+            # checked after it, from the shadow copy
+            ready = sensor.data_ready()
+            if not ready and sensor.get_conversion_mode() == MOD_SD:
+                sensor.start_one_shot()
             count = 0  # avoid infinite loop
-            while not sensor.data_ready() and count < 10:
+            while not ready and count < 10:
                 time.sleep(0.1)
+                ready = sensor.data_ready()
                 count += 1
             t = str(sensor.read_temp_c())
+            self._apply_profile(sensor)
         return t
 
+    def _apply_profile(self, sensor):
+        """Sets the sampling profile on the sensor, in one write of the config
+        register and none if it is set already. Sensor 1 in alert mode keeps
+        converting continuously, see setup_alert()."""
+        avg, conv, one_shot = self._profile
+        sensor.stage()
+        sensor.set_conversion_average_mode(avg)
+        sensor.set_conversion_cycle_bit(conv)
+        if one_shot and not (sensor is self._temp_1 and sensor.get_alert_function_mode()):
+            sensor.set_shutdown_mode()
+        else:
+            sensor.set_continuous_conversion_mode()
+        sensor.commit()
+
     def get_temperatures(self):
         """Returns a tuple with 4 values (strings) for each temp sensors.
         The value will be an empty string for each unavailable sensor."""
+        try:
+            return self._get_temperatures()
+        except OSError as ex:
+            if self._scanned:
+                raise
+            # a sensor was removed (or added) since the scan
+            self._log.error('Failed to read temp sensors, looking for them again: {}'.format(ex))
+            self._find_sensors()
+            return self._get_temperatures()
+
+    def _get_temperatures(self):
+        if self._batched:
+            return self._get_temperatures_batched()
 
         t1 = self._read_temp_sensor(self._temp_1)
         t2 = self._read_temp_sensor(self._temp_2)
@@ -64,12 +160,58 @@ class SensorsHandler:
 
         return (t1, t2, t3, t4)
 
+    def _get_temperatures_batched(self):
+        """The sensors convert continuously, so after a deep sleep they usually
+        have a result. A sensor without one would make us wait for the rest of
+        its conversion cycle (1 second by default), so instead all of those
+        start a one-shot conversion at once and are read when the slowest one
+        is done. Then the sampling profile is applied, which usually sets
+        continuous conversion again."""
+        sensors = self._sensors()
+        temps = ['', '', '', '']
+        pending = []
+        wait_ms = 0
+        for i, sensor in enumerate(sensors):
+            if not sensor:
+                continue
+            config = sensor.get_config_reg()
+            if sensor is self._temp_1:
+                # reading the config register clears the alert flags
+                self._temp_1_config = config
+            if readBit(config, 13):  # Data_Ready
+                temps[i] = str(sensor.read_temp_c())
+                self._apply_profile(sensor)
+            else:
+                sensor.start_one_shot()
+                pending.append(i)
+                wait_ms = max(wait_ms, conversion_time_ms(config))
+
+        if pending:
+            start = time.ticks_ms()
+            time.sleep_ms(wait_ms)
+            for i in pending:
+                sensor = sensors[i]
+                # give a late sensor up to one more conversion time
+                while (not sensor.data_ready() and
+                       time.ticks_diff(time.ticks_ms(), start) < 2 * wait_ms):
+                    time.sleep_ms(READY_POLL_MS)
+                temps[i] = str(sensor.read_temp_c())
+                self._apply_profile(sensor)
+
+        return tuple(temps)
+
     # this only works for the first sensor: _temp_1 because we can use only 1 interrupt pin
     def setup_alert(self, low_limit, high_limit):
         if self._temp_1:
+            # one write of the config register, none if it is set already
+            avg, conv, _ = self._profile
+            self._temp_1.stage()
+            self._temp_1.set_conversion_average_mode(avg)
+            self._temp_1.set_conversion_cycle_bit(conv)
             self._temp_1.set_continuous_conversion_mode()
             # self._temp_1.set_alert_pin_polarity(ALERT_POL_ACTIVE_HIGH)
             self._temp_1.set_alert_function_mode(ALERT_MODE_ALERT)
+            self._temp_1.commit()
             self._temp_1.set_low_limit(low_limit)
             self._temp_1.set_high_limit(high_limit)
 
@@ -77,7 +219,12 @@ class SensorsHandler:
         """ clears the alert only if it was raised by reseting the sensor.
         Returns 1 if alert was raised"""
         if self._temp_1:
-            low_alert, high_alert = self._temp_1.get_low_and_high_alert()
+            if self._temp_1_config is not None:
+                # the flags were cleared when get_temperatures() read them
+                config = self._temp_1_config
+                low_alert, high_alert = readBit(config, 14), readBit(config, 15)
+            else:
+                low_alert, high_alert = self._temp_1.get_low_and_high_alert()
             if low_alert or high_alert:
                 self._temp_1.soft_reset()
                 time.sleep_ms(3) # it takes 2 ms for the sensor to reset, wait 3 ms to be safe
@@ -7,86 +7,105 @@ import machine
 import ubinascii
 
 from model import *
+from BatchWriter import BatchWriter
+from Deflate import DEFAULT_WBITS, DeflateWriter
+from FrameQueue import FrameQueue
+from PhaseTimer import summarize as summarize_phase_times
+from TelRecord import TEL_BINARY_MARKER, encode_frame
 
 # TODO Send firmware version in +HRT frame and add support for handling $OTA requests
 
 
 class ServerUtil:
 
-    PROTOCOL_VERSION = 1
-    QUEUED_FRAMES_FILE = 'queued_frames'
-    queued_frames = []  # list of the queued frame to be sent
+    PROTOCOL_VERSION = 10  # 2 = binary @TEL records, 3 = sequence numbers and $ACK, 4 = $LOG ranges, 5 = deflate, 6 = $TIM, 7 = fix_age, 8 = $AGP, 9 = cells, 10 = sleep
+    QUEUE_DIR = 'queue'
+    LEGACY_QUEUED_FRAMES_FILE = 'queued_frames'  # single file queue of older firmware
+    TX_BUFFER_SIZE = 1024  # bytes, max size of one send to the server
+    LOG_FILES = ('/sd/log_old', '/sd/log')  # oldest first, see Logger
+    DEFLATE_MARKER = b'@DFL\r\n'  # start of a compressed response
+    DEFLATE_WBITS = DEFAULT_WBITS  # compression window announced in the heartbeat
 
-    def __init__(self, log, config):
+    def __init__(self, log, config, assist=None):
+        """`assist` is the GnssAssist that stores the data of $AGP"""
         self._log = log
         self._server_address = config.server_address
         self._server_port = config.server_port
         self._server_timeout = config.server_timeout
         self._use_ssl = config.server_use_ssl
         self._config = config
-
-    def _concat_log(self):
-        if ('sd' in os.listdir('/')):
-            if ('log_old' in os.listdir('/sd') and 'log' in os.listdir('/sd')):
-                with open('/sd/log_old', 'r') as file:
-                    data_log_old = file.read().replace('\n', '')
-                with open('/sd/log', 'r') as file:
-                    data_log = file.read().replace('\n', '')
-                concat_log = data_log + data_log_old
-            elif ('log' in os.listdir('/sd')):
-                with open('/sd/log', 'r') as file:
-                    data_log = file.read().replace('\n', '')
-                concat_log = data_log
-        return concat_log
-
-    def _log_file_size(self):
-        if ('sd' in os.listdir('/')):
-            if ('log_old' in os.listdir('/sd') and 'log' in os.listdir('/sd')):
-                file_size = os.stat('/sd/log')[6] + os.stat('/sd/log_old')[6]
-            elif ('log' in os.listdir('/sd')):
-                file_size = os.stat('/sd/log')[6]
-
-    def _read_queued_frames_from_file(self):
-        self._log.debug('_read_queued_frames_from_file')
-        queued_frames = []
+        self._assist = assist
+        self._rx = b''  # received after the last frame, e.g. the data of $AGP
+        self._uploaded = False  # the server confirmed the @TEL frames, see _tel_req()
+        # totals for the server session, to compare airtime between versions
+        self.bytes_sent = 0
+        self.segments_sent = 0
+        self._queue = None
+
+    def _log_files(self):
+        """Returns `(path, size)` of the log files, oldest first"""
+        files = []
+        if 'sd' in os.listdir('/'):
+            names = os.listdir('/sd')
+            for path in self.LOG_FILES:
+                if path[4:] in names:
+                    files.append((path, os.stat(path)[6]))
+        return files
+
+    def _get_queue(self):
+        """Returns the frame queue on the SD card, or None without an SD card"""
+        if self._queue is None and 'sd' in os.listdir('/'):
+            self._queue = FrameQueue('/sd/{}'.format(self.QUEUE_DIR))
+            if self.LEGACY_QUEUED_FRAMES_FILE in os.listdir('/sd'):
+                self._migrate_legacy_queue()
+        return self._queue
+
+    def _migrate_legacy_queue(self):
+        file_path = '/sd/{}'.format(self.LEGACY_QUEUED_FRAMES_FILE)
+        self._log.info('Moving queued frames from "{}"'.format(file_path))
+        with open(file_path, 'rb') as f:
+            for line in f:
+                if len(line) > 2:
+                    self._queue_frame(line.decode('ascii'))
+        os.remove(file_path)
+
+    def _queue_frame(self, frame):
+        # number the frame as '@TEL,{seq},...' when it is queued, the server
+        # acknowledges and deduplicates by this number
+        self._queue.append('{}{},{}'.format(frame[:5], self._queue.next_seq, frame[5:]))
+
+    @staticmethod
+    def _frame_seq(frame):
+        """Sequence number of a queued frame (bytes)"""
+        return int(frame[5:frame.index(b',', 5)])
+
+    def _count_queued_frames(self):
+        count = 0
         try:
-            file_path = '/sd/{}'.format(self.QUEUED_FRAMES_FILE)
-            if 'sd' in os.listdir('/') and self.QUEUED_FRAMES_FILE in os.listdir('/sd'):
-                with open(file_path, 'r') as f:
-                    frames_str = f.read()
-                    for fr in frames_str.split('\r\n'):
-                        queued_frames.append(fr+'\r\n')
-                    queued_frames.pop()  # remove last item because it is an empty string with an '\r\n'
-            else:
-                self._log.debug(
-                    'Queued frames file not found "{}"'.format(file_path))
-
+            queue = self._get_queue()
+            if queue is not None:
+                count = len(queue)
         except Exception as ex:
             self._log.error(
-                'ServerUtil._read_queued_frames_from_file: {}'.format(ex))
+                'ServerUtil._count_queued_frames: {}'.format(ex))
             sys.print_exception(ex)
-        finally:
-            return queued_frames
+        return count
 
-    def _delete_queued_frames_file(self):
-        self._log.debug('_delete_queued_frames_file')
+    def queued_bytes(self):
+        """Returns the size of the queued frames, 0 without an SD card"""
         try:
-            file_path = '/sd/{}'.format(self.QUEUED_FRAMES_FILE)
-            if 'sd' in os.listdir('/') and self.QUEUED_FRAMES_FILE in os.listdir('/sd'):
-                os.remove(file_path)
-
+            queue = self._get_queue()
+            if queue is not None:
+                return queue.queued_bytes()
         except Exception as ex:
-            self._log.error(
-                'ServerUtil._delete_queued_frames_file: {}'.format(ex))
-            sys.print_exception(ex)
+            self._log.error('ServerUtil.queued_bytes: {}'.format(ex))
+        return 0
 
     def add_frame_to_file(self, frame):
         self._log.debug('_add_frame_to_file')
         try:
-            file_path = '/sd/{}'.format(self.QUEUED_FRAMES_FILE)
-            if 'sd' in os.listdir('/'):
-                with open(file_path, 'a') as f:
-                    f.write(frame)
+            if self._get_queue() is not None:
+                self._queue_frame(frame)
 
         except Exception as ex:
             self._log.error('ServerUtil._add_frame_to_file: {}'.format(ex))
@@ -94,16 +113,21 @@ class ServerUtil:
 
     def create_heartbeat_frame(self, num_queued_frames=0):
         uid = ubinascii.hexlify(machine.unique_id()).decode('ascii').upper()
+        # the server resets its last sequence number when this one went back,
+        # e.g. after the queue on the SD card was lost
+        queue = self._get_queue()
+        next_seq = queue.next_seq if queue is not None else ''
 
-        frame = '+HRT,{},{},{}\r\n'.format(num_queued_frames,
-                                           uid, self.PROTOCOL_VERSION)
+        frame = '+HRT,{},{},{},{},{}\r\n'.format(num_queued_frames, uid,
+                                                 self.PROTOCOL_VERSION,
+                                                 self.DEFLATE_WBITS, next_seq)
 
         return frame
 
-    def create_tel_frame(self, battery_voltage: float, position_data: Position, acc_activity_alert: int, acc_data: tuple, temp_data: tuple, ex_sensor_data: ExternalSensor):
+    def create_tel_frame(self, battery_voltage: float, position_data: Position, acc_activity_alert: int, acc_data: tuple, temp_data: tuple, ex_sensor_data: ExternalSensor, sleep=''):
         """Create a @TEL frame:
 
-        @TEL,{utc_datetime},{lat},{lng},{cog},{speed},{battery_voltage},{acc_acitivity_alert},{acc_x},{acc_y},{acc_z},{acc_roll},{acc_pitch},{temp_alert},{temp_1},{temp_2},{temp_3},{temp_4},{ex_type},{ex_uid},{ex_acc_x},{ex_acc_y},{ex_acc_z},{ex_humidity},{ex_temp},{ex_pressure},{ex_battery_voltage},{ex_tx_power}\r\n
+        @TEL,{utc_datetime},{lat},{lng},{cog},{speed},{battery_voltage},{acc_acitivity_alert},{acc_x},{acc_y},{acc_z},{acc_roll},{acc_pitch},{temp_alert},{temp_1},{temp_2},{temp_3},{temp_4},{ex_type},{ex_uid},{ex_acc_x},{ex_acc_y},{ex_acc_z},{ex_humidity},{ex_temp},{ex_pressure},{ex_battery_voltage},{ex_tx_power},{fix_age},{cells},{sleep}\r\n
 
         Args:
             utc_datetime (String): ISO date time string
@@ -113,9 +137,10 @@ class ServerUtil:
             acc_data (Tuple): Tuple with 3 values: (acc_x, acc_y, acc_z)
             temp_data (Tuple): Tuple with 3 values: (temp_1, temp_2, temp_3)
             ex_sensor_data (ExternalSensor): Object containing the external sensor data (see model.py)
+            sleep (String): The last deep sleep and why it was that long (see SleepScheduler.report)
         """
 
-        frame = '@TEL,{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},,{},{},{},{},{},{},{},{}\r\n'.format(
+        frame = '@TEL,{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},,{},{},{},{},{},{},{},{},{},{},{}\r\n'.format(
             position_data.utc_datetime,
             position_data.lat,
             position_data.lng,
@@ -142,16 +167,20 @@ class ServerUtil:
             ex_sensor_data.temperature,
             ex_sensor_data.pressure,
             ex_sensor_data.battery_voltage,
-            ex_sensor_data.tx_power)
+            ex_sensor_data.tx_power,
+            position_data.fix_age,
+            position_data.cells,
+            sleep)
 
         return frame
 
     def create_cfg_frame(self):
         c = self._config
-        frame = '@CFG,{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\r\n'.format(
+        frame = '@CFG,{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\r\n'.format(
             c.log_level,
             c.log_file_size,
             c.sleep_seconds,
+            c.sleep_gps_on,
             c.server_address,
             c.server_port,
             c.server_use_ssl,
@@ -162,37 +191,99 @@ class ServerUtil:
             c.ruuvi_enabled,
             c.ruuvi_mac,
             c.ruuvi_timeout,
-            c.temp_min,
-            c.temp_max,
-            c.temp_threshold_enabled,
+            c.temp_alert_low,
+            c.temp_alert_high,
+            c.temp_alert_enabled,
             c.acc_alert_enabled,
             c.acc_alert_threshold,
-            c.acc_alert_duration)
+            c.acc_alert_duration,
+            c.temp_profile,
+            c.upload_every,
+            c.upload_queue_bytes,
+            c.upload_max_age,
+            c.upload_on_alert,
+            c.deadband_temp,
+            c.deadband_distance,
+            c.deadband_heartbeat,
+            c.lte_psm,
+            c.lte_psm_tau,
+            c.lte_psm_active,
+            c.lte_edrx,
+            c.gps_reuse_max_age,
+            c.sleep_adaptive,
+            c.sleep_min_seconds,
+            c.sleep_max_seconds,
+            c.sleep_batt_low)
         return frame
 
-    def create_log_frame(self):
-        c = self._config
+    def create_tim_frame(self):
+        return '@TIM,{}\r\n'.format(summarize_phase_times())
 
-        frame = '@log,{}\r\n\x02{}\x03'.format(
-            self._log_file_size(), self._concat_log())
+    def create_log_header_frame(self, total, offset, length):
+        return '@LOG,{},{},{}\r\n'.format(total, offset, length)
 
-        return frame
+    def create_agp_frame(self, stored):
+        return '@AGP,{}\r\n'.format(stored)
+
+    def _response_writer(self, compressed):
+        """Returns `(writer, out)`: the BatchWriter on the socket, and where
+        the response is written to, the same writer or a DeflateWriter on it"""
+        writer = BatchWriter(self._socket, self.TX_BUFFER_SIZE)
+        if not compressed:
+            return writer, writer
+        writer.write(self.DEFLATE_MARKER)
+        return writer, DeflateWriter(writer, self.DEFLATE_WBITS)
+
+    def _end_response(self, writer, out):
+        # send EOT (end-of-transmission) ascii char (0x04)
+        out.write(b'\x04')
+        if out is not writer:
+            out.close()
+            self._log.debug('Compressed {} bytes to {}'.format(out.bytes_in, out.bytes_out))
+        writer.flush()
+        self.bytes_sent += writer.bytes_sent
+        self.segments_sent += writer.segments
+
+    def _send(self, frame_out):
+        self._socket.sendall(frame_out)
+        self.bytes_sent += len(frame_out)
+        self.segments_sent += 1
+
+    def _recv_frame(self):
+        """Receives one frame from the server (up to and including '\\r\\n'),
+        what was received after it is kept for the next read"""
+        frame_in = self._rx
+        end = frame_in.find(b'\r\n')
+        while end < 0:  # end of frame
+            buffer = self._socket.recv(256)
+            if not buffer:
+                break  # connection closed
+            frame_in += buffer
+            end = frame_in.find(b'\r\n', max(0, len(frame_in) - len(buffer) - 1))
+        if end >= 0:
+            self._rx = frame_in[end + 2:]
+            frame_in = frame_in[:end + 2]
+        else:
+            self._rx = b''
+        self._log.debug('RECEIVED:\n\t{}'.format(frame_in))
+        return frame_in
+
+    def _recv_bytes(self, n):
+        """Receives at most `n` bytes of data that is not in frames"""
+        if self._rx:
+            data, self._rx = self._rx[:n], self._rx[n:]
+            return data
+        return self._socket.recv(n)
 
     def _send_heartbeat_and_handle_server_request(self, heartbeat_frame):
+        """Returns False when the exchange failed, e.g. timed out"""
         frame_out = bytes(heartbeat_frame, 'ascii')
         try:
-            self._socket.send(frame_out)
+            self._send(frame_out)
 
             self._log.debug('SENT:\n\t{}'.format(frame_out))
 
-            frame_in = b''
-            buffer = self._socket.recv(4096)
-            while buffer and len(buffer) > 0:
-                # self._log.debug('buffer:\n\t{}'.format(buffer))
-                frame_in += buffer
-                if (frame_in[-2:] == b'\r\n'):  # end of frame
-                    break
-            self._log.debug('RECEIVED:\n\t{}'.format(frame_in))
+            frame_in = self._recv_frame()
 
             frame_words = frame_in.decode('ascii').rstrip('\r\n').split(',')
             # In each frame the first word is {command}, and the second word is {keep_alive}
@@ -209,62 +300,205 @@ class ServerUtil:
                 self._wcf_req(frame_words)
             elif cmd == '$LOG':
                 self._log_req(frame_words)
+            elif cmd == '$TIM':
+                self._tim_req(frame_words)
+            elif cmd == '$AGP':
+                self._agp_req(frame_words)
             else:
                 self._log.error(
                     'ServerUtil: Unknown command "{}"'.format(cmd))
 
             if keep_alive == '1':
-                self._send_heartbeat_and_handle_server_request(
+                return self._send_heartbeat_and_handle_server_request(
                     self.create_heartbeat_frame())
+            return True
         except Exception as ex:
             self._log.error(
                 'ServerUtil._send_heartbeat_and_handle_server_request: {}'.format(ex))
             sys.print_exception(ex)
+        return False
 
     def _tel_req(self, frame_words):
+        """Handles '$TEL,{keep_alive},{format},{last_seq}'"""
         self._log.debug('_tel_req')
-        for f in self.queued_frames:
-            frame_out = bytes(f, 'ascii')
-            self._socket.send(frame_out)
-            self._log.debug('SENT:\n\t{}'.format(frame_out))
-
-        # send EOT (end-of-transmission) ascii char (0x04)
-        frame_out = bytes('\x04', 'ascii')
-        self._socket.send(frame_out)
-        self._log.debug('SENT:\n\t{}'.format(frame_out))
-
-        self.queued_frames = []
-        self._delete_queued_frames_file()
+        # {format} is 'B' for binary records and/or 'Z' for deflate
+        fmt = frame_words[2] if len(frame_words) > 2 else ''
+        binary = 'B' in fmt
+        # Servers with sequence number support always send {last_seq}, the
+        # highest sequence number they already have (those frames are not
+        # sent again), and reply to the EOT with '$ACK,{last_seq}'
+        expect_ack = len(frame_words) > 3
+        last_seq = 0
+        if expect_ack and frame_words[3] != '':
+            last_seq = int(frame_words[3])
+
+        writer, out = self._response_writer('Z' in fmt)
+        queue = self._get_queue()
+        num_frames = 0
+        acked = None  # cursor of the last frame the server already has
+        cursor = None
+        seq = 0
+        if queue is not None and last_seq >= queue.next_seq:
+            # the server is ahead of the queue, its last_seq is of frames
+            # that are gone: nothing queued now was acknowledged
+            self._log.error('ServerUtil: server last_seq {} >= next_seq {}'.format(
+                last_seq, queue.next_seq))
+            last_seq = 0
+        if queue is not None:
+            for f, cursor in queue.frames():
+                seq = self._frame_seq(f)
+                if seq <= last_seq:
+                    acked = cursor
+                    continue
+                # a frame with cells has no binary record, it goes as text
+                record = encode_frame(f.decode('ascii'), sequenced=True) if binary else None
+                if record is not None:
+                    out.write(TEL_BINARY_MARKER)
+                    out.write(record)
+                else:
+                    out.write(f)
+                num_frames += 1
+
+        self._end_response(writer, out)
+        self._log.debug('SENT {} frames (format={}): {} bytes in {} segments'.format(
+            num_frames, fmt, writer.bytes_sent, writer.segments))
+
+        if not expect_ack:
+            if cursor is not None:
+                queue.commit(cursor)
+            self._uploaded = True
+            return
+
+        # the frames that were sent are removed only once confirmed
+        ack_words = self._recv_frame().decode('ascii').rstrip('\r\n').split(',')
+        if ack_words[0] != '$ACK' or len(ack_words) < 2:
+            self._log.error('ServerUtil: Expected $ACK, got "{}"'.format(ack_words[0]))
+            if acked is not None:
+                queue.commit(acked)
+            return
+        ack_seq = int(ack_words[1]) if ack_words[1] != '' else 0
+        self._log.debug('Server acknowledged frames up to {}'.format(ack_seq))
+        self._uploaded = True
+        if num_frames > 0 and ack_seq >= seq:
+            queue.commit(cursor)
+        elif queue is not None and (acked is not None or ack_seq > last_seq):
+            self._commit_through(queue, max(ack_seq, last_seq))
+
+    def _commit_through(self, queue, last_seq):
+        """Removes the queued frames with a sequence number up to `last_seq`"""
+        cursor = None
+        frames = queue.frames()
+        for f, c in frames:
+            if self._frame_seq(f) > last_seq:
+                break
+            cursor = c
+        frames.close()
+        if cursor is not None:
+            queue.commit(cursor)
 
     def _rcf_req(self, frame_words):
         self._log.debug('_rcf_req')
         frame_out = bytes(self.create_cfg_frame(), 'ascii')
-        self._socket.send(frame_out)
+        self._send(frame_out)
         self._log.debug('SENT:\n\t{}'.format(frame_out))
 
     def _wcf_req(self, frame_words):
         self._log.debug('_wcf_req')
         self._config.write_config_json(frame_words)
         frame_out = bytes(self._config.read_config_file(), 'ascii')
-        self._socket.send(frame_out)
+        self._send(frame_out)
         self._log.debug('SENT:\n\t{}'.format(frame_out))
 
-    def _log_req(self, frame_words):
-        self._log.debug('_log_req')
+    def _tim_req(self, frame_words):
+        """Handles '$TIM,{keep_alive}' with a summary of the phase times of
+        the last wake cycles (see PhaseTimer)"""
+        self._log.debug('_tim_req')
+        frame_out = bytes(self.create_tim_frame(), 'ascii')
+        self._send(frame_out)
+        self._log.debug('SENT:\n\t{}'.format(frame_out))
 
-        frame_out = bytes(self.create_log_frame(), 'ascii')
-        self._socket.send(frame_out)
+    def _agp_req(self, frame_words):
+        """Handles '$AGP,{keep_alive},{utc_datetime},{lat},{lng},{length}' and
+        the `length` bytes of EPO data after it, for GnssAssist"""
+        self._log.debug('_agp_req')
+        words = frame_words + [''] * (6 - len(frame_words))
+        length = int(words[5]) if words[5] != '' else 0
+        stored = 0
+        if self._assist is not None:
+            stored = self._assist.receive(words[2], words[3], words[4], length,
+                                          self._recv_bytes)
+        else:
+            while length > 0:
+                data = self._recv_bytes(min(length, 1024))
+                if not data:
+                    break
+                length -= len(data)
+        frame_out = bytes(self.create_agp_frame(stored), 'ascii')
+        self._send(frame_out)
         self._log.debug('SENT:\n\t{}'.format(frame_out))
 
-    def init(self):
-        """Init communication with the server"""
+    def _log_req(self, frame_words):
+        """Handles '$LOG,{keep_alive},{offset},{length},{format}'. The log files are
+        streamed from the SD card in chunks of TX_BUFFER_SIZE bytes, so their
+        size is not limited by the heap."""
+        self._log.debug('_log_req')
+        self._log.flush()
+        files = self._log_files()
+        total = 0
+        for _, size in files:
+            total += size
+
+        # a negative offset counts from the end, to fetch only the tail
+        offset = 0
+        if len(frame_words) > 2 and frame_words[2] != '':
+            offset = int(frame_words[2])
+            if offset < 0:
+                offset = max(0, total + offset)
+        offset = min(offset, total)
+        length = total - offset
+        if len(frame_words) > 3 and frame_words[3] != '':
+            length = max(0, min(length, int(frame_words[3])))
+
+        # {format} 'Z' asks for deflate
+        compressed = len(frame_words) > 4 and 'Z' in frame_words[4]
+        writer, out = self._response_writer(compressed)
+        out.write(bytes(self.create_log_header_frame(total, offset, length), 'ascii'))
+        start = offset
+        buf = bytearray(self.TX_BUFFER_SIZE)
+        view = memoryview(buf)
+        remaining = length
+        for path, size in files:
+            if remaining == 0:
+                break
+            if offset >= size:
+                offset -= size
+                continue
+            # only up to the size seen above, the log grows while sending
+            n_file = min(remaining, size - offset)
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                while n_file > 0:
+                    n = f.readinto(view[:min(n_file, len(buf))])
+                    if not n:
+                        break
+                    out.write(view[:n])
+                    n_file -= n
+                    remaining -= n
+            offset = 0
+        self._end_response(writer, out)
+        self._log.debug('SENT log bytes {}-{} of {}: {} bytes in {} segments'.format(
+            start, start + length, total, writer.bytes_sent, writer.segments))
 
-        self.queued_frames = self._read_queued_frames_from_file()
+    def init(self):
+        """Init communication with the server. Returns True when the server
+        confirmed the queued @TEL frames."""
 
-        num_frames = len(self.queued_frames)
+        num_frames = self._count_queued_frames()
         self._log.debug('Queued frames: {}'.format(num_frames))
 
         heartbeat_frame = self.create_heartbeat_frame(num_frames)
+        self._rx = b''
+        self._uploaded = False
         try:
             self._socket = socket.socket()
             self._socket.settimeout(self._server_timeout)
@@ -275,10 +509,12 @@ class ServerUtil:
 
             self._socket.connect(socket.getaddrinfo(
                 self._server_address, self._server_port)[0][-1])
-            self._send_heartbeat_and_handle_server_request(heartbeat_frame)
+            completed = self._send_heartbeat_and_handle_server_request(heartbeat_frame)
 
             self._socket.close()
-            return True
+            self._log.info('Server session{}: sent {} bytes in {} segments'.format(
+                '' if completed else ' failed', self.bytes_sent, self.segments_sent))
+            return self._uploaded
         except Exception as ex:
             self._log.debug('Exception in ServerUtil: {}'.format(ex))
             sys.print_exception(ex)
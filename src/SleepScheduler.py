@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# Adaptive deep sleep interval (see Config, sleep_adaptive). Starts from
+# sleep_seconds and adjusts it to the state of the device, within
+# sleep_min_seconds and sleep_max_seconds:
+#   - batt: stretched up to MAX_STRETCH times as the battery voltage drops
+#     from BATT_FULL to sleep_batt_low
+#   - moving / parked: halved while the unit moves, doubled while it is
+#     parked. Motion is known from the accelerometer activity interrupt
+#     (acc_alert_enabled) or from the GPS speed
+#   - backlog: after a failed upload, stretched with the queued bytes, so a
+#     unit out of coverage neither piles up frames nor retries the attach too
+#     often
+#   - temp: with temp_alert_enabled, at most half of the time the
+#     temperature trend since the last wake cycle takes to reach
+#     temp_alert_low or temp_alert_high, so the drift is sampled again before
+#     the alert. A limit already reached is left to the alert itself
+#
+# The reasons are logged with their factors, and the next @TEL frame reports
+# the interval and the reasons as `sleep`, e.g. '1200:batt+parked'.
+#
+# The extreme temperatures of the last wake cycle, the seconds since then and
+# the last interval with its reasons are kept in NVS across deep sleep, fixed
+# point (see NvsUtil), and 0 means empty.
+#
+
+import machine
+import pycom
+
+from NvsUtil import TEMP_SCALE, decode, encode, nvs_get
+from TelRecord import SLEEP_REASONS
+
+NVS_TEMP_LOW_KEY = 'sl_tlow'
+NVS_TEMP_HIGH_KEY = 'sl_thigh'
+NVS_SECONDS_KEY = 'sl_secs'  # since the temperatures were read
+NVS_SLEEP_KEY = 'sl_sleep'  # seconds of the last deep sleep
+NVS_REASONS_KEY = 'sl_why'  # bitmask of SLEEP_REASONS of the last deep sleep
+
+BATT_FULL = 3.9  # volts, no stretch above
+MAX_STRETCH = 4.0
+MOVING_FACTOR = 0.5
+PARKED_FACTOR = 2.0
+MOVING_KNOTS = 2.0  # GPS speed above which the unit moves
+BACKLOG_BYTES = 4096  # queued bytes per additional sleep_seconds after a failed upload
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SleepScheduler:
+
+    def __init__(self, config):
+        self._base = config.sleep_seconds
+        self._min = config.sleep_min_seconds
+        self._max = config.sleep_max_seconds
+        self._batt_low = config.sleep_batt_low
+        self._temp_low = config.temp_alert_low
+        self._temp_high = config.temp_alert_high
+        self._temp_alert = config.temp_alert_enabled == 1
+        self.enabled = config.sleep_adaptive == 1
+        self.seconds = self._base  # of the next deep sleep, see schedule()
+        self.reasons = []  # why, e.g. ['batt x2.5', 'max 3600'], for the log
+        self._why = 0
+        self._temps = None  # lowest and highest of this wake cycle
+        self._last_temps = None
+        self._elapsed = 0
+        self._last = ''
+        if self.enabled and machine.reset_cause() == machine.DEEPSLEEP_RESET:
+            low = decode(nvs_get(NVS_TEMP_LOW_KEY), TEMP_SCALE)
+            high = decode(nvs_get(NVS_TEMP_HIGH_KEY), TEMP_SCALE)
+            if low is not None and high is not None:
+                self._last_temps = (low, high)
+            self._elapsed = nvs_get(NVS_SECONDS_KEY)
+            sleep, why = nvs_get(NVS_SLEEP_KEY), nvs_get(NVS_REASONS_KEY)
+            if sleep:
+                self._last = '{}:{}'.format(sleep, '+'.join(
+                    name for n, name in enumerate(SLEEP_REASONS) if why & (1 << n)))
+
+    def report(self):
+        """The last deep sleep as the `sleep` of a @TEL frame:
+        '{seconds}:{reason}+...', or '' when it was not scheduled"""
+        return self._last
+
+    def _apply(self, reason, factor):
+        self.seconds *= factor
+        self.reasons.append('{} x{:.3g}'.format(reason, factor))
+        self._why |= 1 << SLEEP_REASONS.index(reason)
+
+    def _temp_limit(self, temps):
+        """Seconds until the trend of the extreme temperatures reaches an
+        alert limit that is not reached yet, None if they do not drift toward
+        one"""
+        temps = [t for t in (_number(t) for t in temps) if t is not None]
+        if not temps:
+            return None
+        self._temps = (min(temps), max(temps))
+        low, high = self._temps
+        if not self._temp_alert or self._last_temps is None or self._elapsed <= 0:
+            return None
+        limits = []
+        rate = (low - self._last_temps[0]) / self._elapsed
+        if rate < 0 and low > self._temp_low:
+            limits.append((low - self._temp_low) / -rate)
+        rate = (high - self._last_temps[1]) / self._elapsed
+        if rate > 0 and high < self._temp_high:
+            limits.append((self._temp_high - high) / rate)
+        return min(limits) if limits else None
+
+    def schedule(self, batt_voltage, moved, speed, temps, queued_bytes, upload_failed):
+        """Returns the seconds of the next deep sleep. `moved` is None when
+        the accelerometer does not tell, `speed` the GPS speed in knots ('' if
+        unknown), `temps` the temperatures (strings, empty for a missing
+        sensor)"""
+        self.seconds = self._base
+        self.reasons = []
+        self._why = 0
+        limit = self._temp_limit(temps)
+        if not self.enabled:
+            return self.seconds
+
+        batt = _number(batt_voltage)
+        if batt and batt < BATT_FULL:
+            self._apply('batt', MAX_STRETCH if batt <= self._batt_low else
+                        1 + (MAX_STRETCH - 1) * (BATT_FULL - batt) / (BATT_FULL - self._batt_low))
+        speed = _number(speed)
+        if moved or (speed is not None and speed > MOVING_KNOTS):
+            self._apply('moving', MOVING_FACTOR)
+        elif moved is not None:
+            self._apply('parked', PARKED_FACTOR)
+        if upload_failed and queued_bytes:
+            self._apply('backlog', min(MAX_STRETCH, 1 + queued_bytes / BACKLOG_BYTES))
+        if limit is not None and limit / 2 < self.seconds:
+            self.seconds = limit / 2
+            self.reasons.append('temp {}'.format(int(limit)))
+            self._why |= 1 << SLEEP_REASONS.index('temp')
+
+        self.seconds = int(round(self.seconds))
+        if self.seconds < self._min:
+            self.seconds = self._min
+            self.reasons.append('min {}'.format(self._min))
+        elif self.seconds > self._max:
+            self.seconds = self._max
+            self.reasons.append('max {}'.format(self._max))
+        return self.seconds
+
+    def save(self, awake_ms):
+        """Records this wake cycle in NVS, before the deep sleep"""
+        if not self.enabled:
+            return
+        low, high = self._temps if self._temps is not None else (None, None)
+        pycom.nvs_set(NVS_TEMP_LOW_KEY, encode(low, TEMP_SCALE))
+        pycom.nvs_set(NVS_TEMP_HIGH_KEY, encode(high, TEMP_SCALE))
+        pycom.nvs_set(NVS_SECONDS_KEY, awake_ms // 1000 + self.seconds)
+        pycom.nvs_set(NVS_SLEEP_KEY, self.seconds)
+        pycom.nvs_set(NVS_REASONS_KEY, self._why)
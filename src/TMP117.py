@@ -31,12 +31,49 @@ DEVICE_ID_REG = 0x0F  # read only
 
 MASK_DEVICE_ID_REG_DID = 0x0FFF
 MASK_DEVICE_ID_REG_REV = 0xF000
+# HIGH_Alert, LOW_Alert and Data_Ready flags (bits 15:13), which the sensor
+# sets; everything else in the config register is set by us
+MASK_CONFIG_REG_SETTINGS = 0x1FFF
 
 MOD_CC = 0  # Continuous conversion
 MOD_SD = 1  # Shutdown
 MOD_CC_2 = 2  # Continuous conversion(CC),Same as 00 (readsback=00)
 MOD_OS = 3  # One shot conversion
 
+# Conversion averaging modes (AVG, bits 6:5 of the config register)
+AVG_NONE = 0
+AVG_8 = 1  # power-on default
+AVG_32 = 2
+AVG_64 = 3
+
+# Active conversion time in ms for each averaging mode, see Table 7-7 of the
+# datasheet. A one-shot conversion takes this long.
+CONVERSION_TIME_MS = (16, 125, 500, 1000)
+
+# Conversion cycle time in ms for each conversion cycle bit value (CONV,
+# bits 9:7 of the config register, rows) and averaging mode (columns), see
+# Table 7-7 of the datasheet. The sensor is on standby (about 1 uA instead of
+# 135 uA) for the rest of the cycle after the active conversion time.
+CYCLE_TIME_MS = ((16, 125, 500, 1000),
+                 (125, 125, 500, 1000),
+                 (250, 250, 500, 1000),
+                 (500, 500, 500, 1000),
+                 (1000, 1000, 1000, 1000),  # power-on default
+                 (4000, 4000, 4000, 4000),
+                 (8000, 8000, 8000, 8000),
+                 (16000, 16000, 16000, 16000))
+
+
+def conversion_time_ms(config_reg):
+    """Returns how long a conversion takes with the given config register"""
+    return CONVERSION_TIME_MS[config_reg >> 5 & 3]
+
+
+def cycle_time_ms(config_reg):
+    """Returns the continuous conversion cycle time of the given config register"""
+    return CYCLE_TIME_MS[config_reg >> 7 & 7][config_reg >> 5 & 3]
+
+
 # modes for the alert function (bit 4 in the config register)
 # see section 7.4.4 (page 14) of datasheet
 ALERT_MODE_THERM = 0
@@ -48,10 +85,29 @@ ALERT_POL_ACTIVE_HIGH = 1
 
 
 class TMP117:
-
-    def __init__(self, sda='P10', scl='P11', device_addr=TMP117_I2CADDR_GND):
+    """Driver for one TMP117.
+
+    The driver keeps shadow copies of the registers it writes: the settings
+    of the config register (without the flags), the limits and the offset.
+    Setters change the shadow copy and only write a register when its value
+    changes, and reading back a setting needs no I2C transfer. Changes to the
+    config register made between stage() and commit() are written at once.
+    """
+
+    def __init__(self, sda='P10', scl='P11', device_addr=TMP117_I2CADDR_GND,
+                 i2c=None, verify=True):
+        """Pass `i2c` to share a bus initialized once for all the sensors
+        (`sda` and `scl` are then ignored). Without `verify` the device ID is
+        not checked, for a sensor that was found on the bus before."""
         self._device_addr = device_addr  # I2C address of Temperature sensor
-        self._i2c = I2C(0, mode=I2C.MASTER, pins=(sda, scl))
+        if i2c is None:
+            i2c = I2C(0, mode=I2C.MASTER, pins=(sda, scl))
+        self._i2c = i2c
+        self._shadow = {}  # register -> value last read or written
+        self._staging = False
+        self._staged_from = None  # config settings at stage()
+        if not verify:
+            return
 
         # see "Device ID Register Description" (page 31 Table 15 of datasheet)
         r = self._i2c.readfrom_mem(self._device_addr, DEVICE_ID_REG, 2)
@@ -68,6 +124,51 @@ class TMP117:
         """Returns the address of the device"""
         return self._device_addr
 
+    def _read_reg(self, reg):
+        r = self._i2c.readfrom_mem(self._device_addr, reg, 2)
+        return struct.unpack('>h', r)[0]
+
+    def _cached_reg(self, reg):
+        r_int = self._shadow.get(reg)
+        if r_int is None:
+            r_int = self._read_reg(reg)
+            self._shadow[reg] = r_int
+        return r_int
+
+    def _write_reg(self, reg, r_int):
+        if self._shadow.get(reg) == r_int:
+            return  # the sensor has it already
+        r = struct.pack('>h', r_int)
+        self._i2c.writeto_mem(self._device_addr, reg, r)
+        self._shadow[reg] = r_int
+
+    def _config_settings(self):
+        """Returns the settings in the config register, from the shadow copy"""
+        if CONFIGURATION_REG not in self._shadow:
+            self.get_config_reg()
+        return self._shadow[CONFIGURATION_REG]
+
+    def _write_config(self, r_int):
+        r_int &= MASK_CONFIG_REG_SETTINGS
+        if self._staging:
+            self._shadow[CONFIGURATION_REG] = r_int
+        else:
+            self._write_reg(CONFIGURATION_REG, r_int)
+
+    def stage(self):
+        """Collects the changes of the config register settings until
+        commit(), which writes them in one transfer"""
+        self._staging = True
+        self._staged_from = self._shadow.get(CONFIGURATION_REG)
+
+    def commit(self):
+        """Writes the config register if the changes since stage() changed it"""
+        self._staging = False
+        r_int = self._shadow.get(CONFIGURATION_REG)
+        if r_int is not None and r_int != self._staged_from:
+            r = struct.pack('>h', r_int)
+            self._i2c.writeto_mem(self._device_addr, CONFIGURATION_REG, r)
+
     # double readTempC();
     def read_temp_c(self):
         """Returns the temperature in degrees C"""
@@ -80,16 +181,18 @@ class TMP117:
     # void softReset();
     def soft_reset(self):
         """Performs a software reset on the Configuration Register Field bits"""
-        r_int = self.get_config_reg()
+        r_int = self._config_settings()
         r_int = setBit(r_int, 1)
         r = struct.pack('>h', r_int)
         self._i2c.writeto_mem(self._device_addr, CONFIGURATION_REG, r)
+        # the registers are reloaded from the EEPROM
+        self._shadow = {}
+        self._staged_from = None
 
     # float getTemperatureOffset();
     def get_temp_offset(self):
         """Reads the temperature offset"""
-        r = self._i2c.readfrom_mem(self._device_addr, TEMP_OFFSET_REG, 2)
-        r_int = struct.unpack('>h', r)[0]
+        r_int = self._cached_reg(TEMP_OFFSET_REG)
         offset = r_int * TMP117_RESOLUTION
         return offset
 
@@ -97,14 +200,12 @@ class TMP117:
     def set_temp_offset(self, offset):
         """Writes to the temperature offset"""
         offset = offset / TMP117_RESOLUTION
-        r = struct.pack('>h', int(offset))
-        self._i2c.writeto_mem(self._device_addr, TEMP_OFFSET_REG, r)
+        self._write_reg(TEMP_OFFSET_REG, int(offset))
 
     # float getLowLimit();
     def get_low_limit(self):
         """Reads the low limit register that is set by the user. The values are signed integers since they can be negative."""
-        r = self._i2c.readfrom_mem(self._device_addr, T_LOW_LIMIT_REG, 2)
-        r_int = struct.unpack('>h', r)[0]
+        r_int = self._cached_reg(T_LOW_LIMIT_REG)
         limit = r_int * TMP117_RESOLUTION
         return limit
 
@@ -112,15 +213,12 @@ class TMP117:
     def set_low_limit(self, low_limit):
         """Sets the low limit temperature for the low limit register"""
         low_limit = low_limit / TMP117_RESOLUTION
-        r = struct.pack('>h', int(low_limit))
-        self._i2c.writeto_mem(self._device_addr, T_LOW_LIMIT_REG, r)
-        pass
+        self._write_reg(T_LOW_LIMIT_REG, int(low_limit))
 
     # float getHighLimit();
     def get_high_limit(self):
         """Reads the high limit register that is set by the user. The values are signed integers since they can be negative."""
-        r = self._i2c.readfrom_mem(self._device_addr, T_HIGH_LIMIT_REG, 2)
-        r_int = struct.unpack('>h', r)[0]
+        r_int = self._cached_reg(T_HIGH_LIMIT_REG)
         limit = r_int * TMP117_RESOLUTION
         return limit
 
@@ -128,14 +226,17 @@ class TMP117:
     def set_high_limit(self, high_limit):
         """Sets the high limit temperature for the low limit register"""
         high_limit = high_limit / TMP117_RESOLUTION
-        r = struct.pack('>h', int(high_limit))
-        self._i2c.writeto_mem(self._device_addr, T_HIGH_LIMIT_REG, r)
+        self._write_reg(T_HIGH_LIMIT_REG, int(high_limit))
 
     # uint16_t getConfigurationRegister();
     def get_config_reg(self):
-        """Get Configuration Register"""
-        r = self._i2c.readfrom_mem(self._device_addr, CONFIGURATION_REG, 2)
-        r_int = struct.unpack('>h', r)[0]
+        """Get Configuration Register, with the current flags. In alert mode
+        reading it clears the alert flags."""
+        r_int = self._read_reg(CONFIGURATION_REG)
+        if not self._staging or CONFIGURATION_REG not in self._shadow:
+            self._shadow[CONFIGURATION_REG] = r_int & MASK_CONFIG_REG_SETTINGS
+            if self._staging:
+                self._staged_from = self._shadow[CONFIGURATION_REG]
         return r_int
 
     def get_low_and_high_alert(self):
@@ -165,105 +266,127 @@ class TMP117:
     def set_alert_function_mode(self, mode):
         """Set alert or therm mode.
             For 'mode' use one of the constnats: ALERT_MODE_THERM or ALERT_MODE_ALERT"""
-        r_int = 0
-        r_int = self.get_config_reg()
+        r_int = self._config_settings()
         if mode == ALERT_MODE_THERM:    # == 0
             r_int = clearBit(r_int, 4)
         elif mode == ALERT_MODE_ALERT:  # == 1
             r_int = setBit(r_int, 4)
         else:
             return  # invalid mode, do nothing
-        r = struct.pack('>h', r_int)
-        self._i2c.writeto_mem(self._device_addr, CONFIGURATION_REG, r)
+        self._write_config(r_int)
 
     def get_alert_function_mode(self):
         """Check to see if in alert or therm mode"""
-        r_int = self.get_config_reg()
+        r_int = self._config_settings()
         mode = readBit(r_int, 4)
         return mode
 
     def set_alert_pin_polarity(self, pol):
-        r_int = 0
-        r_int = self.get_config_reg()
+        r_int = self._config_settings()
         if pol == ALERT_POL_ACTIVE_LOW:
             r_int = clearBit(r_int, 3)
         elif pol == ALERT_POL_ACTIVE_HIGH:
             r_int = setBit(r_int, 3)
         else:
             return  # invalid polarity, do nothing
-        r = struct.pack('>h', r_int)
-        self._i2c.writeto_mem(self._device_addr, CONFIGURATION_REG, r)
+        self._write_config(r_int)
 
     def get_conversion_mode(self):
         """Checks to see the Conversion Mode the device is currently in. The mode is the bit 10 and 11"""
-        conf_reg = self.get_config_reg()
+        conf_reg = self._config_settings()
         mod = conf_reg >> 10 & 3
         return mod
 
     # void setContinuousConversionMode();
     def set_continuous_conversion_mode(self):
         """Sets the Conversion Mode of the Device to be Continuous"""
-        r_int = self.get_config_reg()
+        r_int = self._config_settings()
 
         # Set bits 11:10 to 00, which is the continuous conversion mode
         r_int = clearBit(r_int, 11)
         r_int = clearBit(r_int, 10)
 
-        r = struct.pack('>h', r_int)
-        self._i2c.writeto_mem(self._device_addr, CONFIGURATION_REG, r)
+        self._write_config(r_int)
 
     # void setOneShotMode();
     def set_one_shot_mode(self):
         """Sets the Conversion Mode of the Device to be One Shot"""
-        r_int = self.get_config_reg()
+        r_int = self._config_settings()
 
         # Set bits 11:10 to 11, which is the oneshot mode
         r_int = setBit(r_int, 11)
         r_int = setBit(r_int, 10)
 
+        self._write_config(r_int)
+
+    def start_one_shot(self):
+        """Starts a one-shot conversion, after which the sensor shuts down"""
+        r_int = self._config_settings()
+
+        # Set bits 11:10 to 11, which is the oneshot mode
+        r_int = setBit(r_int, 11)
+        r_int = setBit(r_int, 10)
+
+        # written even when one-shot mode is set already, to start a new
+        # conversion; the sensor changes the mode itself when it is done
         r = struct.pack('>h', r_int)
         self._i2c.writeto_mem(self._device_addr, CONFIGURATION_REG, r)
+        del self._shadow[CONFIGURATION_REG]
 
     # void setShutdownMode();
     def set_shutdown_mode(self):
         """Sets the Conversion Mode of the Device to be Shutdown"""
-        r_int = self.get_config_reg()
+        r_int = self._config_settings()
 
         # Set bits 11:10 to 01, which is the shutdown mode
         r_int = clearBit(r_int, 11)
         r_int = setBit(r_int, 10)
 
-        r = struct.pack('>h', r_int)
-        self._i2c.writeto_mem(self._device_addr, CONFIGURATION_REG, r)
+        self._write_config(r_int)
 
     # void setConversionAverageMode(uint8_t convMode);
     def set_conversion_average_mode(self, mode):
-        """Sets the conversion averaging mode"""
-        # TODO
-        pass
+        """Sets the conversion averaging mode (AVG_NONE, AVG_8, AVG_32 or AVG_64)"""
+        r_int = self._config_settings()
+
+        # Set bits 6:5
+        r_int = (r_int & ~0x0060) | (mode & 3) << 5
+
+        self._write_config(r_int)
 
     # uint8_t getConversionAverageMode();
     def get_conversion_average_mode(self):
         """Returns the Conversion Averaging Mode"""
-        # TODO
-        pass
+        return self._config_settings() >> 5 & 3
 
     # void setConversionCycleBit(uint8_t convTime);
     def set_conversion_cycle_bit(self, conv_time):
-        """Sets the conversion cycle time bit"""
-        # TODO
-        pass
+        """Sets the conversion cycle time bit (0 to 7, see CYCLE_TIME_MS)"""
+        r_int = self._config_settings()
+
+        # Set bits 9:7
+        r_int = (r_int & ~0x0380) | (conv_time & 7) << 7
+
+        self._write_config(r_int)
 
     # uint8_t getConversionCycleBit();
     def get_conversion_cycle_bit(self):
         """Returns the conversion cycle time bit value"""
-        # TODO
-        pass
+        return self._config_settings() >> 7 & 7
+
+    def get_conversion_time_ms(self):
+        """Returns how long a conversion takes with the current settings, i.e.
+        how long to wait for the result of a one-shot conversion"""
+        return conversion_time_ms(self._config_settings())
+
+    def get_cycle_time_ms(self):
+        """Returns the conversion cycle time with the current settings, i.e.
+        how old the result can be in continuous conversion mode"""
+        return cycle_time_ms(self._config_settings())
 
     # bool dataReady();
     def data_ready(self):
         """Returns 1 when data is ready. """
-        r = self._i2c.readfrom_mem(self._device_addr, CONFIGURATION_REG, 2)
-        r_int = struct.unpack('>h', r)[0]
+        r_int = self.get_config_reg()
         ready = r_int >> 13 & 1
         return ready
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+#
+# Compact binary encoding of the @TEL frame (protocol version 2).
+#
+# A record is a fixed-width little-endian struct. Every value is stored as a
+# scaled integer, and a presence bitmask at the start tells which values were
+# actually measured (absent values are packed as 0). See doc/protocol.md for
+# the layout; extras/tel_codec.py has the matching decoder.
+#
+
+import struct
+
+# prefix of every binary record on the wire, instead of the '@TEL,' of a text frame
+TEL_BINARY_MARKER = b'@TLB'
+# protocol version 3: uint32 sequence number between the marker and the record
+SEQ_FORMAT = '<I'
+
+RECORD_FORMAT = '<IIiiHHHhhhhhhhhhBB6shhhHhHHb'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# bits of the presence mask
+P_TIME = 0
+P_POS = 1  # lat and lng
+P_COG = 2
+P_SPEED = 3
+P_BATT = 4
+P_ACC = 5  # acc_x, acc_y, acc_z
+P_ORIENT = 6  # acc_roll, acc_pitch
+P_TEMP_1 = 7  # temp_1 to temp_4 use bits 7 to 10
+P_EX_UID = 11
+P_EX_ACC = 12
+P_EX_HUM = 13
+P_EX_TEMP = 14
+P_EX_PRES = 15
+P_EX_BATT = 16
+P_EX_TX = 17
+
+# bits of the flags byte
+F_ACC_ALERT = 0
+F_TEMP_ALERT = 1
+F_FIX_REUSED = 2  # the position is a reused fix, see fix_age of the text frame
+F_SLEEP = 3  # bits 3 to 7, the reasons of the `sleep` of the text frame
+
+# reasons of an adaptive deep sleep interval, in the order of their flag bits
+SLEEP_REASONS = ('batt', 'moving', 'parked', 'temp', 'backlog')
+
+# seconds between 1970-01-01 and 2000-01-01, the epoch used in the record
+_EPOCH_2000 = 946684800
+
+
+def _days_from_civil(y, m, d):
+    """Days since 1970-01-01 for a proleptic Gregorian date"""
+    y -= m <= 2
+    era = (y if y >= 0 else y - 399) // 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def iso_to_seconds(s):
+    """Converts an ISO 8601 UTC string (e.g. '2020-06-05T21:44:20+00:00')
+    to seconds since 2000-01-01"""
+    days = _days_from_civil(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+    secs = int(s[11:13]) * 3600 + int(s[14:16]) * 60 + int(s[17:19])
+    return days * 86400 + secs - _EPOCH_2000
+
+
+def _civil_from_days(z):
+    """(year, month, day) of a number of days since 1970-01-01"""
+    z += 719468
+    era = (z if z >= 0 else z - 146096) // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + (3 if mp < 10 else -9)
+    return yoe + era * 400 + (m <= 2), m, d
+
+
+def seconds_to_iso(seconds):
+    """Converts seconds since 2000-01-01 to an ISO 8601 UTC string, the
+    inverse of iso_to_seconds()"""
+    days, secs = divmod(seconds + _EPOCH_2000, 86400)
+    y, m, d = _civil_from_days(days)
+    return '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}+00:00'.format(
+        y, m, d, secs // 3600, secs // 60 % 60, secs % 60)
+
+
+def _clamp(v, lo, hi):
+    if v < lo:
+        return lo
+    if v > hi:
+        return hi
+    return v
+
+
+def _scaled(s, scale, lo, hi):
+    """Returns the field `s` multiplied by `scale` as an int, or None if empty"""
+    if s == '':
+        return None
+    return _clamp(int(round(float(s) * scale)), lo, hi)
+
+
+def encode_frame(frame, sequenced=False):
+    """Encodes a text @TEL frame (see ServerUtil.create_tel_frame) as a binary
+    record. The queue keeps text frames, so the encoding is done when sending.
+    With `sequenced` the frame is '@TEL,{seq},...' and the sequence number is
+    packed in front of the record. Returns None for a frame with `cells`,
+    which the record does not hold."""
+    f = frame[5:].rstrip('\r\n').split(',')
+    seq = None
+    if sequenced:
+        seq = int(f.pop(0))
+    if len(f) > 29 and f[29] != '':
+        return None
+    mask = 0
+    values = [0] * 26
+
+    def put(bit, idx, v):
+        nonlocal mask
+        if v is not None:
+            mask |= 1 << bit
+            values[idx] = v
+
+    def scaled(i, scale, lo, hi):
+        try:
+            return _scaled(f[i], scale, lo, hi)
+        except ValueError:
+            return None
+
+    if len(f[0]) >= 19:
+        try:
+            put(P_TIME, 0, iso_to_seconds(f[0]))
+        except ValueError:
+            pass
+    lat = scaled(1, 1e7, -900000000, 900000000)
+    lng = scaled(2, 1e7, -1800000000, 1800000000)
+    if lat is not None and lng is not None:
+        put(P_POS, 1, lat)
+        values[2] = lng
+    put(P_COG, 3, scaled(3, 100, 0, 0xFFFF))
+    put(P_SPEED, 4, scaled(4, 100, 0, 0xFFFF))
+    put(P_BATT, 5, scaled(5, 1000, 0, 0xFFFF))
+
+    acc = [scaled(i, 1000, -32768, 32767) for i in (7, 8, 9)]
+    if None not in acc:
+        put(P_ACC, 6, acc[0])
+        values[7] = acc[1]
+        values[8] = acc[2]
+    roll = scaled(10, 100, -32768, 32767)
+    pitch = scaled(11, 100, -32768, 32767)
+    if roll is not None and pitch is not None:
+        put(P_ORIENT, 9, roll)
+        values[10] = pitch
+    for n in range(4):
+        # 1/128 C is the native resolution of the TMP117
+        put(P_TEMP_1 + n, 11 + n, scaled(13 + n, 128, -32768, 32767))
+
+    flags = 0
+    if f[6] == '1':
+        flags |= 1 << F_ACC_ALERT
+    if f[12] == '1':
+        flags |= 1 << F_TEMP_ALERT
+    if len(f) > 28 and f[28] != '':
+        flags |= 1 << F_FIX_REUSED
+    if len(f) > 30:
+        # '{seconds}:{reason}+{reason}...', the seconds are not in the record
+        for reason in f[30].partition(':')[2].split('+'):
+            if reason in SLEEP_REASONS:
+                flags |= 1 << (F_SLEEP + SLEEP_REASONS.index(reason))
+    values[15] = flags
+    values[16] = scaled(17, 1, 0, 0xFF) or 0
+
+    # note: the text frame has an empty column after ex_uid
+    values[17] = b'\x00' * 6
+    if len(f[18]) == 12:
+        try:
+            put(P_EX_UID, 17, bytes(int(f[18][i:i + 2], 16) for i in range(0, 12, 2)))
+        except ValueError:
+            pass
+    ex_acc = [scaled(i, 1, -32768, 32767) for i in (20, 21, 22)]
+    if None not in ex_acc:
+        put(P_EX_ACC, 18, ex_acc[0])
+        values[19] = ex_acc[1]
+        values[20] = ex_acc[2]
+    put(P_EX_HUM, 21, scaled(23, 400, 0, 0xFFFF))
+    put(P_EX_TEMP, 22, scaled(24, 200, -32768, 32767))
+    pres = scaled(25, 1, 50000, 50000 + 0xFFFF)
+    put(P_EX_PRES, 23, None if pres is None else pres - 50000)
+    put(P_EX_BATT, 24, scaled(26, 1, 0, 0xFFFF))
+    put(P_EX_TX, 25, scaled(27, 1, -128, 127))
+
+    record = struct.pack(RECORD_FORMAT, mask, *values)
+    if seq is not None:
+        return struct.pack(SEQ_FORMAT, seq) + record
+    return record
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+# Runs blocking work (e.g. a BLE scan) in a separate thread while the main
+# thread does something else, and hands back its result.
+#
+# Only work that does not use the I2C bus may run in a task: the Pytrack
+# coprocessor (GNSS, battery), the accelerometer and the temperature sensors
+# share I2C(0), and SensorsHandler re-initializes it with its own pins.
+#
+
+import _thread
+import time
+
+STACK_SIZE = 8192  # bytes per task thread
+
+
+class Task:
+
+    def __init__(self, name, fn, *args):
+        self.name = name
+        self.result = None
+        self.exception = None
+        self.ms = 0  # run time of fn
+        self._done = _thread.allocate_lock()
+        self._done.acquire()
+        _thread.stack_size(STACK_SIZE)
+        _thread.start_new_thread(self._run, (fn, args))
+
+    def _run(self, fn, args):
+        start = time.ticks_ms()
+        try:
+            self.result = fn(*args)
+        except Exception as ex:
+            self.exception = ex
+        finally:
+            self.ms = time.ticks_diff(time.ticks_ms(), start)
+            self._done.release()
+
+    def done(self):
+        return not self._done.locked()
+
+    def wait(self):
+        """Blocks until fn returned and returns its result. An exception
+        raised by fn is raised again here."""
+        self._done.acquire()
+        self._done.release()
+        if self.exception is not None:
+            raise self.exception
+        return self.result
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# Decides in which wake cycles the device brings up LTE and uploads the
+# queued frames. The other wake cycles only sample and queue a frame.
+#
+# A wake cycle uploads (see Config):
+#   - after any reset other than a deep sleep, to check in with the server
+#   - when the device was woken by an alert and upload_on_alert is on
+#   - every upload_every wake cycles
+#   - when upload_queue_bytes or more are queued
+#   - when the last upload was upload_max_age seconds ago or more
+#
+# The wake cycles and seconds since the last upload are kept in NVS across
+# deep sleep. A failed upload does not reset them, so the next wake cycle
+# tries again.
+#
+
+import machine
+import pycom
+
+from NvsUtil import nvs_get
+
+NVS_WAKES_KEY = 'up_wakes'
+NVS_SECONDS_KEY = 'up_secs'
+
+
+class UploadPolicy:
+
+    def __init__(self, config):
+        self._every = config.upload_every
+        self._queue_bytes = config.upload_queue_bytes
+        self._max_age = config.upload_max_age
+        self._on_alert = config.upload_on_alert
+        self.wakes = nvs_get(NVS_WAKES_KEY)  # since the last upload, without this one
+        self.seconds = nvs_get(NVS_SECONDS_KEY)  # since the last upload
+        self.reason = None  # why this wake cycle uploads, None if it does not
+
+    def check(self, reset_cause, alert, queued_bytes):
+        """Returns why this wake cycle should upload, or None"""
+        reason = None
+        if reset_cause != machine.DEEPSLEEP_RESET:
+            reason = 'reset'
+        elif alert and self._on_alert:
+            reason = 'alert'
+        elif self.wakes + 1 >= self._every:
+            reason = 'wakes'
+        elif self._queue_bytes and queued_bytes >= self._queue_bytes:
+            reason = 'queue'
+        elif self._max_age and self.seconds >= self._max_age:
+            reason = 'age'
+        self.reason = reason
+        return reason
+
+    def check_alert(self):
+        """Returns 'alert' if an alert that was raised while sampling (e.g.
+        the temperature limits) should start an upload this wake cycle"""
+        if self.reason is None and self._on_alert:
+            self.reason = 'alert'
+            return self.reason
+        return None
+
+    def save(self, uploaded, awake_ms, sleep_seconds):
+        """Records this wake cycle in NVS, before the deep sleep"""
+        if uploaded:
+            self.wakes = 0
+            self.seconds = sleep_seconds
+        else:
+            self.wakes += 1
+            self.seconds += awake_ms // 1000 + sleep_seconds
+        pycom.nvs_set(NVS_WAKES_KEY, self.wakes)
+        pycom.nvs_set(NVS_SECONDS_KEY, self.seconds)
@@ -16,10 +16,22 @@ from LIS2HH12 import LIS2HH12
 from Config import Config
 from Logger import Logger
 from LTEUtil import LTEUtil
+from ModemCache import ModemCache
 from RuuviUtil import RuuviUtil
 from ServerUtil import ServerUtil
 from model import ExternalSensor, Position
 from SensorsHandler import SensorsHandler
+from ThreadUtil import Task
+from PhaseTimer import PhaseTimer
+from UploadPolicy import UploadPolicy
+from Deadband import Deadband
+from LastFix import LastFix
+from GnssAssist import GnssAssist
+from SleepScheduler import SleepScheduler
+
+# PMTK225 periodic standby of the L76 between wake cycles: 30 s run, 20 s
+# sleep, then 60 s run, 60 s sleep (ms)
+GPS_PERIODIC_MODE = (2, 30000, 20000, 60000, 60000)
 
 
 def mount_sd_card():
@@ -37,13 +49,29 @@ def mount_sd_card():
     return False
 
 
-def read_position_data(py: Pytrack):
+def inject_assistance(py: Pytrack, assist):
+    """Injects the GPS assistance data into the L76 when it starts cold"""
+    log = Logger.get_instance()
+    try:
+        if assist.needed():
+            injected = assist.inject(py.i2c)
+            if injected is None:
+                log.debug('GPS assistance: no reference time')
+            else:
+                log.debug('GPS assistance: EPO of {} satellites'.format(injected))
+    except Exception as ex:
+        log.error('Failed to inject the GPS assistance', ex)
+
+
+def read_position_data(py: Pytrack, periodic=False, assist=None):
+    """Gets a fix, then with `periodic` leaves the L76 in periodic mode for
+    the deep sleep instead of always on. With `assist` (GnssAssist) the
+    assistance data is injected before and the fix updates it."""
     log = Logger.get_instance()
     try:
         config = Config.get_instance()
         L76 = L76GNSS(pytrack=py, timeout=config.gps_timeout)
         L76.setAlwaysOn()
-        # L76.setPeriodicMode(2,30000,20000,60000,60000)
         lat = ''
         lng = ''
         datetime = ''
@@ -53,6 +81,8 @@ def read_position_data(py: Pytrack):
         chrono = machine.Timer.Chrono()
         chrono.reset()
         chrono.start()
+        if assist is not None:
+            inject_assistance(py, assist)
         fixed = L76.get_fix()
         if fixed:
             chrono.stop()
@@ -73,6 +103,10 @@ def read_position_data(py: Pytrack):
             datetime = ''
 
         log.debug('{},{},{},{},{}'.format(datetime, lat, lng, speed, cog))
+        if fixed and assist is not None:
+            assist.update(datetime, lat, lng)
+        if periodic:
+            L76.setPeriodicMode(*GPS_PERIODIC_MODE)
 
         return Position(lat, lng, datetime, speed, cog)
     except Exception as ex:
@@ -81,12 +115,32 @@ def read_position_data(py: Pytrack):
     return Position()
 
 
+def read_cells(lte, connected):
+    """Returns the serving and neighbour cells for a coarse position without
+    a fix: read from the modem while connected, otherwise the cell of the
+    last attach"""
+    log = Logger.get_instance()
+    cells = ''
+    try:
+        if connected:
+            cells = lte.read_cells()
+        if not cells:
+            cache = lte.cache if lte is not None else ModemCache()
+            cells = cache.serving_cell()
+    except Exception as ex:
+        log.error('Failed to read the LTE cells', ex)
+    finally:
+        log.debug('LTE cells: {}'.format(cells))
+
+    return cells
+
+
 def read_temperature_and_setup_alert():
     log = Logger.get_instance()
     config = Config.get_instance()
     temp_data = ('0', '', '', '', '')
     try:
-        sensors = SensorsHandler(log)
+        sensors = SensorsHandler(log, profile=config.temp_profile)
         temps = sensors.get_temperatures()
 
         # it's very important that the setup_alert() is called after the clear_alert() and not before!
@@ -128,18 +182,20 @@ def read_accelerometer_and_setup_alert():
     return acc_data
 
 
-def read_external_sensor():
+def read_external_sensors():
+    """Returns a list with an ExternalSensor for each Ruuvi tag that was
+    found, or with one empty ExternalSensor"""
     log = Logger.get_instance()
     config = Config.get_instance()
-    ex_sensor = ExternalSensor()  # empty object
+    ex_sensors = []
     try:
         if config.ruuvi_enabled == 1:
             ruuvi = RuuviUtil(log, config.ruuvi_timeout, config.ruuvi_mac)
-            ex_sensor = ruuvi.get_sensor_data()
+            ex_sensors = ruuvi.get_sensors_data()
     except Exception as ex:
         log.error('Failed to read external sensor', ex)
 
-    return ex_sensor
+    return ex_sensors or [ExternalSensor()]  # empty object
 
 
 GREEN = 0x007f00
@@ -173,18 +229,47 @@ WAKE_REASON_DICT = {
 }
 
 
+def start_lte(timer, log, config):
+    """Starts the LTE attach in the background, returns the LTEUtil or None"""
+    try:
+        with timer.span('lte_init'):
+            lte = LTEUtil(log, config.apn, timeout=config.lte_timeout,
+                          psm=config.lte_psm == 1, psm_tau=config.lte_psm_tau,
+                          psm_active=config.lte_psm_active, edrx=config.lte_edrx)
+            lte.start_attach()
+            return lte
+    except Exception as ex:
+        log.error('Failed to start the LTE attach', ex)
+    return None
+
+
 def run():
-    flash_LED(2, 180)
+    timer = PhaseTimer(time.ticks_ms())
+    timer.timed('led', flash_LED, 2, 180)
     pytrack = Pytrack()
-    mount_sd_card()
+    timer.timed('sd', mount_sd_card)
     log = None
     config = None
+    policy = None
+    uploaded = False
+    deadband = None
+    queued = False
+    last_fix = None
+    assist = None
+    scheduler = None
+    serverUtil = None
+    upload = None
+    batt_voltage = ''
+    temp_data = ('0', '', '', '', '')
+    motion = None  # whether the unit moved, None if the accelerometer does not tell
+    position = Position()
     try:
-        config = Config.get_instance()  # init and read config file
-        log = Logger.get_instance()
+        with timer.span('config'):
+            config = Config.get_instance()  # init and read config file
+            log = Logger.get_instance()
 
         log.info('------ WAKEUP')
-        time.sleep(1)
+        timer.timed('delay', time.sleep, 1)
 
         reset_cause = machine.reset_cause()
         reset_cause_s = RESET_CAUSE_DICT[str(reset_cause)]
@@ -195,39 +280,143 @@ def run():
         log.info('wake_reason: {}'.format(wake_reason_s))
 
         # read battery voltage
-        batt_voltage = pytrack.read_battery_voltage()
+        batt_voltage = timer.timed('batt', pytrack.read_battery_voltage)
         log.debug('Battery voltage: {}'.format(batt_voltage))
 
-        temp_data = read_temperature_and_setup_alert()
+        assist = GnssAssist()
+        serverUtil = ServerUtil(log, config, assist)
+        policy = UploadPolicy(config)
+        scheduler = SleepScheduler(config)
+        upload = policy.check(reset_cause, wake_reason != WAKE_REASON_TIMER,
+                              serverUtil.queued_bytes())
+        log.info('Upload: {} ({} wakes, {} seconds since the last one)'.format(
+            upload, policy.wakes, policy.seconds))
+
+        # The LTE attach, the Ruuvi scan and the GPS fix are mostly waiting, so
+        # they overlap: the modem attaches in the background, the BLE scan runs
+        # in its own thread, and everything on the I2C bus stays in this one.
+        lte = None
+        if upload:
+            lte = start_lte(timer, log, config)
+        ruuvi_task = Task('ruuvi', read_external_sensors)
+
+        temp_data = timer.timed('temp', read_temperature_and_setup_alert)
+        if lte is None and temp_data[0] == '1' and policy.check_alert():
+            log.info('Upload: alert')
+            lte = start_lte(timer, log, config)
         acc_activity_alert = 1 if wake_reason == WAKE_REASON_ACCELEROMETER else 0
-        acc_data = read_accelerometer_and_setup_alert()
-        ex_sensor = read_external_sensor()  # ruuvi
-        position = read_position_data(pytrack)
-
-        serverUtil = ServerUtil(log, config)
-        # construct the new TEL frame
-        new_tel_frame = serverUtil.create_tel_frame(
-            batt_voltage, position, acc_activity_alert, acc_data, temp_data, ex_sensor)
-
-        serverUtil.add_frame_to_file(new_tel_frame)  # add to queue
-
-        lte = LTEUtil(log, config.apn, timeout=config.lte_timeout)
-        try:
-            lte.connect()
-            serverUtil.init()  # init communications with backend server
-        except Exception as ex:
-            log.error('Exception occured!', ex)
-        finally:
-            lte.disconnect()
+        acc_data = timer.timed('acc', read_accelerometer_and_setup_alert)
+        # a timer or temperature alert wake with the accelerometer interrupt
+        # armed means the unit did not move during the deep sleep
+        moved = not config.acc_alert_enabled or wake_reason in (
+            WAKE_REASON_ACCELEROMETER, WAKE_REASON_PUSH_BUTTON)
+        if config.acc_alert_enabled:
+            motion = moved
+        last_fix = LastFix(config)
+        position = last_fix.reuse(reset_cause, moved)
+        if position is not None:
+            log.info('Reusing the GPS fix of {} seconds ago'.format(position.fix_age))
+        else:
+            position = timer.timed('gps', read_position_data, pytrack,
+                                   last_fix.enabled and config.sleep_gps_on == 1, assist)
+        ex_sensors = ruuvi_task.wait()
+        timer.add(ruuvi_task.name, ruuvi_task.ms)
+
+        connected = False
+        if lte is not None:
+            try:
+                connected = lte.wait()
+                # a separate phase for the resumed data sessions, to compare
+                # them with the full attaches in the $TIM summary
+                timer.add('lte' if lte.mode == 'attach' else 'lte_resume', lte.connect_ms)
+                log.info('LTE {} in {} ms'.format(lte.mode, lte.connect_ms))
+            except Exception as ex:
+                log.error('Exception occured!', ex)
+        if position.lat == '':
+            # no fix, the server locates the cells instead
+            position.cells = timer.timed('cells', read_cells, lte, connected)
+
+        with timer.span('queue'):
+            deadband = Deadband(config)
+            reason = deadband.check(reset_cause, acc_activity_alert or temp_data[0] == '1',
+                                    temp_data[1:], position)
+            if reason:
+                # construct the new TEL frames, one for each Ruuvi tag
+                for ex_sensor in ex_sensors:
+                    new_tel_frame = serverUtil.create_tel_frame(
+                        batt_voltage, position, acc_activity_alert, acc_data, temp_data, ex_sensor,
+                        scheduler.report())
+                    serverUtil.add_frame_to_file(new_tel_frame)  # add to queue
+                queued = True
+                log.debug('{} frame(s) queued: {}'.format(len(ex_sensors), reason))
+            else:
+                log.info('Frame not queued, within the deadband')
+
+        if lte is not None:
+            try:
+                if connected:
+                    # init communications with backend server
+                    uploaded = timer.timed('server', serverUtil.init)
+                else:
+                    log.error('LTE timed out, not uploading')
+            except Exception as ex:
+                log.error('Exception occured!', ex)
+            finally:
+                timer.timed('lte_off', lte.disconnect)
 
     except Exception as ex:
         log.error('Exception occured!', ex)
     finally:
         if log != None:
-            log.info('------ DEEP SLEEP ({} seconds)'.format(config.sleep_seconds))
+            sleep_seconds = config.sleep_seconds
+            if scheduler is not None:
+                try:
+                    upload_failed = upload is not None and not uploaded
+                    queued_bytes = serverUtil.queued_bytes() if upload_failed else 0
+                    sleep_seconds = scheduler.schedule(batt_voltage, motion, position.speed,
+                                                       temp_data[1:], queued_bytes, upload_failed)
+                    if scheduler.enabled:
+                        log.info('Sleep: {} seconds ({})'.format(
+                            sleep_seconds, ', '.join(scheduler.reasons) or 'sleep_seconds'))
+                except Exception as ex:
+                    log.error('Failed to schedule the deep sleep', ex)
+            timer.timed('led_sleep', flash_LED, 2, 180, YELLOW)
+            timer.log(log)
+            try:
+                timer.save()
+            except Exception as ex:
+                log.error('Failed to save the phase times', ex)
+            if policy is not None:
+                try:
+                    policy.save(uploaded, timer.read_ms(), sleep_seconds)
+                except Exception as ex:
+                    log.error('Failed to save the upload state', ex)
+            if deadband is not None:
+                try:
+                    deadband.save(queued, timer.read_ms(), sleep_seconds)
+                except Exception as ex:
+                    log.error('Failed to save the deadband state', ex)
+            if last_fix is not None:
+                try:
+                    last_fix.save(position, timer.read_ms(), sleep_seconds)
+                except Exception as ex:
+                    log.error('Failed to save the last GPS fix', ex)
+            # a parked unit turns the GNSS off while it reuses the last fix
+            keep_gps_on = (config.sleep_gps_on == 1
+                           and not (last_fix is not None and last_fix.gps_off))
+            if assist is not None:
+                try:
+                    assist.save(sleep_seconds, keep_gps_on)
+                except Exception as ex:
+                    log.error('Failed to save the GPS assistance state', ex)
+            if scheduler is not None:
+                try:
+                    scheduler.save(timer.read_ms())
+                except Exception as ex:
+                    log.error('Failed to save the sleep schedule', ex)
+            log.info('------ DEEP SLEEP ({} seconds)'.format(sleep_seconds))
             log.deinit()
             machine.idle()
-            flash_LED(2, 180, YELLOW)
             if config.temp_alert_enabled:
                 # Setup interrupt for temp sensor
                 # Pass 'False' means interrupt on falling edge
@@ -236,8 +425,7 @@ def run():
                 # Setup interrupt for accelerometer activity
                 # Pass `True, False` means interrupt on activity, and do not intterupt on inactivity
                 pytrack.setup_int_wake_up(True, False)
-            pytrack.setup_sleep(config.sleep_seconds)
-            keep_gps_on = (config.sleep_gps_on == 1)
+            pytrack.setup_sleep(sleep_seconds)
             pytrack.go_to_sleep(gps=keep_gps_on)
             # machine.deepsleep(config.sleep_seconds*1000)  # milliseconds
         else:
@@ -1,12 +1,14 @@
 
 class Position:
 
-    def __init__(self, lat='', lng='', utc_datetime='', speed='', cog=''):
+    def __init__(self, lat='', lng='', utc_datetime='', speed='', cog='', fix_age='', cells=''):
         self.lat = lat
         self.lng = lng
         self.utc_datetime = utc_datetime
         self.speed = speed
         self.cog = cog
+        self.fix_age = fix_age  # seconds, only for a reused fix (see LastFix)
+        self.cells = cells  # only without a fix (see LTEUtil.read_cells)
 
 class ExternalSensor:
 